@@ -1,13 +1,32 @@
+import logging
+import os
+import time
+
 from aiogram import Router, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import FSInputFile, Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.filters import Command, CommandObject
+from archive import Archiver
+from broadcast import Broadcaster
 from database.db import Database
+from database.models import ScheduleEntry
+from export import export_table, parse_export_args
+from scheduler import BUMP_AT, Scheduler
 import config
 from handlers import get_main_menu
-import sqlite3
+
+logger = logging.getLogger(__name__)
 router = Router()
 
+# Ограничение Bot API на размер отправляемого ботом файла
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+BUMP_USAGE = (
+    "🔝 Поднятие объявления: /bump <id объявления> [каждые N часов] [сколько раз]\n"
+    "Отменить поднятия: /bump <id объявления> 0"
+)
+
 
 class AdminStates(StatesGroup):
     WAITING_FOR_SERVER_NAME = State()
@@ -38,8 +57,8 @@ back_button = ReplyKeyboardMarkup(
 
 # Обработка нажатия на кнопку "🛠 Админ-панель"
 @router.message(F.text == "🛠 Админ-панель")
-async def admin_panel(message: Message):
-    if not Database.is_admin(message.from_user.id) and message.from_user.id not in config.ADMIN_IDS:
+async def admin_panel(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
         await message.answer("У вас нет доступа к админ-панели")
         return
 
@@ -47,14 +66,14 @@ async def admin_panel(message: Message):
 
 # Обработка кнопки "Назад" для возвращения в главное меню
 @router.message(F.text == "⬅️ Назад")
-async def back_to_main_menu(message: Message):
-    await message.answer("Вы вернулись в главное меню.", reply_markup=get_main_menu(message.from_user.id))
+async def back_to_main_menu(message: Message, db: Database):
+    await message.answer("Вы вернулись в главное меню.", reply_markup=get_main_menu(db, message.from_user.id))
 
 
 
 @router.message(lambda msg: msg.text == "➕ Добавить Группу")
-async def add_server_start(message: Message, state: FSMContext):
-    if not Database.is_admin(message.from_user.id) and message.from_user.id not in config.ADMIN_IDS:
+async def add_server_start(message: Message, state: FSMContext, db: Database):
+    if not db.is_admin(message.from_user.id):
         return
 
     await message.answer("Введите название сервера:", reply_markup=back_button)
@@ -62,25 +81,142 @@ async def add_server_start(message: Message, state: FSMContext):
 
 
 @router.message(lambda msg: msg.text == "📋 Список Групп")
-async def list_servers(message: Message):
-    if not Database.is_admin(message.from_user.id) and message.from_user.id not in config.ADMIN_IDS:
+async def list_servers(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
         return
 
-    db = Database()
-    servers = db.get_servers()
-    db.close()
+    # Счётчики модерации читаются из moderation_counters, а не считаются по объявлениям
+    servers = await db.get_server_stats()
 
     if not servers:
         await message.answer("Серверов пока нет")
         return
 
     response = "Список серверов:\n\n"
-    for server_id, name in servers:
-        response += f"{server_id}. {name}\n"
+    for server_id, name, pending, approved, rejected, today_submitted, today_approved, today_rejected in servers:
+        response += (
+            f"{server_id}. {name}\n"
+            f"   ⏳ {pending} · ✅ {approved} · ❌ {rejected}\n"
+            f"   сегодня: подано {today_submitted} · ✅ {today_approved} · ❌ {today_rejected}\n"
+        )
 
     await message.answer(response)
 
 
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
+        return
+
+    drift = await db.rebuild_moderation_counters(config.ARCHIVE_PATH)
+    await message.answer(f"Счётчики модерации пересчитаны, исправлено расхождение: {drift}")
+
+
+@router.message(Command("archive"))
+async def archive_advertisements(message: Message, command: CommandObject, db: Database, archiver: Archiver):
+    if not db.is_admin(message.from_user.id):
+        return
+
+    if archiver.is_running():
+        await message.answer("Архивация уже выполняется")
+        return
+
+    if command.args == "vacuum":
+        await message.answer("Включаю incremental vacuum (полный VACUUM), бот может ненадолго замедлиться…")
+        await archiver.enable_incremental_vacuum()
+        await message.answer("Готово: теперь /archive возвращает освободившееся место системе")
+        return
+
+    await message.answer("Переношу старые объявления в архив…")
+    report = await archiver.run()
+    await message.answer(report.format())
+
+
+@router.message(Command("broadcast"))
+async def broadcast(message: Message, command: CommandObject, db: Database, broadcaster: Broadcaster):
+    if not db.is_admin(message.from_user.id):
+        return
+
+    if not command.args:
+        await message.answer("📣 Рассылка всем пользователям: /broadcast <текст>\nОстановить: /broadcast_stop")
+        return
+
+    if broadcaster.is_running():
+        await message.answer("Рассылка уже идёт — дождитесь её окончания или остановите /broadcast_stop")
+        return
+
+    await broadcaster.start(message.chat.id, command.args)
+
+
+@router.message(Command("broadcast_stop"))
+async def broadcast_stop(message: Message, db: Database, broadcaster: Broadcaster):
+    if not db.is_admin(message.from_user.id):
+        return
+
+    if await broadcaster.cancel():
+        await message.answer("Рассылка остановлена")
+    else:
+        await message.answer("Сейчас рассылок нет")
+
+
+@router.message(Command("bump"))
+async def bump_advertisement(message: Message, command: CommandObject, db: Database, scheduler: Scheduler):
+    # Периодическое (платное) поднятие: объявление публикуется в канале
+    # заново, прежняя публикация удаляется
+    if not db.is_admin(message.from_user.id):
+        return
+
+    args = (command.args or "").split()
+    if not 1 <= len(args) <= 3 or not all(arg.isdigit() for arg in args):
+        await message.answer(BUMP_USAGE)
+        return
+    ad_id = int(args[0])
+    hours = int(args[1]) if len(args) > 1 else config.BUMP_INTERVAL_HOURS
+    times = int(args[2]) if len(args) > 2 else config.BUMP_TIMES
+
+    if hours == 0:
+        cancelled = await db.cancel_schedule(ad_id, BUMP_AT)
+        await message.answer(f"Отменено поднятий объявления #{ad_id}: {cancelled}" if cancelled else "Поднятий не запланировано")
+        return
+    if times == 0:
+        await message.answer(BUMP_USAGE)
+        return
+
+    ad = await db.get_advertisement(ad_id)
+    if ad is None or ad.status != "approved" or ad.expired_at:
+        await message.answer("Поднять можно только опубликованное объявление")
+        return
+
+    interval = hours * 60 * 60
+    await scheduler.add(ad_id, [ScheduleEntry(BUMP_AT, time.time() + interval, interval, times)])
+    await message.answer(f"Объявление #{ad_id} будет подниматься каждые {hours} ч, раз: {times}")
+
+
+@router.message(Command("export"))
+async def export_data(message: Message, command: CommandObject, db: Database):
+    if not db.is_admin(message.from_user.id):
+        return
+
+    try:
+        query = parse_export_args(command.args or "")
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+
+    await message.answer("Готовлю выгрузку…")
+    path, rows = await export_table(db.db_name, query)
+    try:
+        if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+            await message.answer("Выгрузка больше 50 МБ — сузьте её фильтрами server:, status:, from:, to:")
+            return
+        await message.answer_document(FSInputFile(path, filename=query.filename), caption=f"Строк: {rows}")
+    except Exception as e:
+        logger.error("Ошибка при отправке выгрузки %s: %s", query.filename, e)
+        await message.answer("Не удалось отправить выгрузку")
+    finally:
+        os.remove(path)
+
+
 @router.message(AdminStates.WAITING_FOR_SERVER_NAME)
 async def process_server_name(message: Message, state: FSMContext):
     if message.text == "⬅️ Назад":
@@ -106,16 +242,15 @@ async def process_channel_id(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.WAITING_FOR_MODERATION_GROUP)
-async def process_moderation_group(message: Message, state: FSMContext):
+async def process_moderation_group(message: Message, state: FSMContext, db: Database):
     if message.text == "⬅️ Назад":
         await state.clear()
         await message.answer("Вы вернулись в админ-панель", reply_markup=admin_menu)
         return
 
     data = await state.get_data()
-    db = Database()
     try:
-        db.add_server(
+        await db.add_server(
             name=data['server_name'],
             channel_id=data['channel_id'],
             moderation_group_id=message.text
@@ -124,14 +259,13 @@ async def process_moderation_group(message: Message, state: FSMContext):
     except Exception as e:
         await message.answer(f"Ошибка при добавлении сервера: {str(e)}", reply_markup=admin_menu)
     finally:
-        db.close()
         await state.clear()
 
 
 # Обработка нажатия на кнопку "Добавить администратора"
 @router.message(F.text == "Добавить администратора")
-async def add_admin(message: Message, state: FSMContext):
-    if not Database.is_admin(message.from_user.id) and message.from_user.id not in config.ADMIN_IDS:
+async def add_admin(message: Message, state: FSMContext, db: Database):
+    if not db.is_admin(message.from_user.id):
         await message.answer("У вас нет доступа к этой функции.")
         return
 
@@ -139,7 +273,7 @@ async def add_admin(message: Message, state: FSMContext):
     await state.set_state(AdminStatesTwo.WAITING_FOR_ADMIN_ID)
 
 @router.message(AdminStatesTwo.WAITING_FOR_ADMIN_ID)
-async def process_admin_id(message: Message, state: FSMContext):
+async def process_admin_id(message: Message, state: FSMContext, db: Database):
     user_id = message.text
 
     # Проверка, что ID — число
@@ -149,24 +283,16 @@ async def process_admin_id(message: Message, state: FSMContext):
 
     user_id = int(user_id)
 
-    # Подключение к базе данных
-    conn = sqlite3.connect("bot.db")
-    cursor = conn.cursor()
-
     # Проверка, существует ли пользователь
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = await db.get_user(user_id)
 
     if not user:
         await message.answer(f"Пользователь с ID {user_id} не найден в базе данных.")
-        conn.close()
         await state.clear()
         return
 
     # Обновляем роль
-    cursor.execute("UPDATE users SET role = 'admin' WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    await db.set_user_role(user_id, "admin")
 
     await message.answer(f"Пользователь с ID {user_id} теперь администратор.")
 
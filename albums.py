@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import Message, Update
+
+from metrics import ALBUM_UPDATES_MERGED
+
+logger = logging.getLogger(__name__)
+
+
+class _Album:
+    __slots__ = ("messages", "updated_at")
+
+    def __init__(self, message: Message):
+        self.messages: List[Message] = [message]
+        self.updated_at = time.monotonic()
+
+
+class AlbumMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: части альбома (сообщения с общим
+    # media_group_id) Telegram присылает отдельными апдейтами. Первая часть
+    # ждёт, пока `latency` секунд не придёт следующая, и проходит дальше по
+    # цепочке одна, со всеми частями в data["album"]; остальные части
+    # поглощаются здесь и до FSM и хендлеров не доходят. Ожидание идёт в
+    # отдельной задаче, чтобы не задерживать получение остальных частей и при
+    # последовательной обработке апдейтов. Регистрируется раньше
+    # ChatOrderingMiddleware: альбом занимает очередь чата уже собранным.
+    # Следующие апдейты того же чата ждут обработки альбома, поэтому не
+    # обгоняют его и без ChatOrderingMiddleware. Ошибки альбома проходят через
+    # ErrorsMiddleware роутера, как и у остальных апдейтов, а close() при
+    # остановке бота дожидается альбомов, которые ещё собираются.
+    def __init__(self, router: Router, latency: float = 0.5):
+        self.latency = latency
+        self._errors = ErrorsMiddleware(router)
+        self._albums: Dict[Tuple[int, str], _Album] = {}
+        self._chats: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = event.message
+        if message is None or message.media_group_id is None:
+            chat = data.get("event_chat")
+            if chat is not None:
+                await self._wait_chat(chat.id)
+            return await handler(event, data)
+
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.messages.append(message)
+            album.updated_at = time.monotonic()
+            ALBUM_UPDATES_MERGED.inc()
+            return None
+
+        # Предыдущий альбом чата уже не получит частей — дожидаемся его, чтобы
+        # альбомы обрабатывались по порядку
+        await self._wait_chat(key[0])
+        self._albums[key] = _Album(message)
+        task = asyncio.create_task(self._flush(key, handler, event, data))
+        self._tasks.add(task)
+        self._chats[key[0]] = task
+        task.add_done_callback(partial(self._forget, key[0]))
+        return None
+
+    def _forget(self, chat_id: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._chats.get(chat_id) is task:
+            del self._chats[chat_id]
+
+    async def _wait_chat(self, chat_id: int):
+        task = self._chats.get(chat_id)
+        if task is not None:
+            await asyncio.wait({task})
+
+    async def _flush(self, key: Tuple[int, str], handler, event: Update, data: Dict[str, Any]):
+        album = self._albums[key]
+        while not self._closing and (delay := album.updated_at + self.latency - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        del self._albums[key]
+
+        data["album"] = sorted(album.messages, key=lambda message: message.message_id)
+        try:
+            await self._errors(handler, event, data)
+        except Exception as e:
+            logger.error("Ошибка при обработке альбома %s из чата %s: %s", key[1], key[0], e)
+
+    async def close(self, timeout: float = 10.0):
+        # Обработчик остановки диспетчера: собираемые альбомы больше не ждут
+        # новых частей после текущей паузы и обрабатываются; не успевшие за
+        # timeout отменяются
+        self._closing = True
+        if not self._tasks:
+            return
+        logger.info("Ожидание обработки %s альбомов перед остановкой", len(self._tasks))
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning("Не дождались обработки %s альбомов, отменяем", len(pending))
+            for task in pending:
+                task.cancel()
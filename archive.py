@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from database.db import Database
+
+logger = logging.getLogger(__name__)
+
+# SQLite: auto_vacuum=INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class ArchiveReport(NamedTuple):
+    moved: int
+    size_before: int
+    size_after: int
+    free_bytes: int
+    seconds: float
+    incremental: bool
+
+    def format(self) -> str:
+        mb = 1024 * 1024
+        text = (
+            f"🗄 Архивация завершена за {self.seconds:.1f} с\n\n"
+            f"Перенесено объявлений: {self.moved}\n"
+            f"Размер базы: {self.size_before / mb:.1f} → {self.size_after / mb:.1f} МБ "
+            f"(освобождено {(self.size_before - self.size_after) / mb:.1f} МБ)"
+        )
+        if not self.incremental and self.free_bytes:
+            text += (
+                f"\n\nСвободно внутри файла: {self.free_bytes / mb:.1f} МБ — место будет переиспользовано. "
+                "Чтобы возвращать его системе, один раз выполните /archive vacuum (полный VACUUM, база "
+                "на это время блокируется)"
+            )
+        return text
+
+
+class Archiver:
+    # Переносит старые промодерированные объявления из горячей таблицы в
+    # архивную базу (отдельный файл, подключается через ATTACH) пачками и
+    # затем возвращает освободившиеся страницы incremental vacuum'ом, тоже по
+    # частям. Запускается командой /archive или по расписанию (start()).
+    def __init__(
+        self,
+        db: Database,
+        archive_path: str = "bot_archive.db",
+        after_days: float = 90,
+        batch_size: int = 500,
+        vacuum_pages: int = 1000,
+        pause: float = 0.05,
+        interval_hours: float = 0,
+    ):
+        self.db = db
+        self.archive_path = archive_path
+        self.after = after_days * 24 * 60 * 60
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause
+        self.interval = interval_hours * 60 * 60
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def is_running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self) -> ArchiveReport:
+        async with self._lock:
+            started = time.perf_counter()
+            page_count, _, page_size, auto_vacuum = await self.db.get_storage_stats()
+            size_before = page_count * page_size
+
+            moved = 0
+            try:
+                while True:
+                    batch = await self.db.archive_advertisements(
+                        self.archive_path, time.time() - self.after, self.batch_size
+                    )
+                    moved += batch
+                    if batch < self.batch_size:
+                        break
+                    # Пауза между пачками — очередь запросов хендлеров не ждёт всю архивацию
+                    await asyncio.sleep(self.pause)
+            finally:
+                await self.db.detach_archive()
+
+            incremental = auto_vacuum == AUTO_VACUUM_INCREMENTAL
+            if incremental:
+                while await self.db.incremental_vacuum(self.vacuum_pages):
+                    await asyncio.sleep(self.pause)
+
+            page_count, free_pages, page_size, _ = await self.db.get_storage_stats()
+            report = ArchiveReport(
+                moved=moved,
+                size_before=size_before,
+                size_after=page_count * page_size,
+                free_bytes=free_pages * page_size,
+                seconds=time.perf_counter() - started,
+                incremental=incremental,
+            )
+            logger.info(
+                "Архивация: перенесено %s объявлений за %.1f с, размер базы %s -> %s байт",
+                report.moved, report.seconds, report.size_before, report.size_after
+            )
+            return report
+
+    async def enable_incremental_vacuum(self):
+        async with self._lock:
+            await self.db.enable_incremental_vacuum()
+
+    def start(self):
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _schedule(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error("Ошибка плановой архивации: %s", e)
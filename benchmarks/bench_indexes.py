@@ -0,0 +1,102 @@
+# Бенчмарк индексов таблицы объявлений: планы запросов и время выполнения
+# до и после миграций с индексами на синтетической таблице.
+#
+#   python -m benchmarks.bench_indexes --ads 1000000
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from database.migrations import run_migrations
+
+STATUSES = ("pending", "approved", "rejected")
+
+QUERIES = [
+    ("Очередь модерации",
+     "SELECT id FROM advertisements WHERE status = 'pending' ORDER BY created_at LIMIT 50", ()),
+    ("История пользователя",
+     "SELECT id, status, created_at FROM advertisements WHERE user_id = ? ORDER BY created_at DESC LIMIT 20", ("user",)),
+    ("Очередь сервера",
+     "SELECT id FROM advertisements WHERE server_id = ? AND status = 'pending' ORDER BY created_at LIMIT 50", ("server",)),
+    ("Статистика сервера",
+     "SELECT status, COUNT(*) FROM advertisements WHERE server_id = ? GROUP BY status", ("server",)),
+    ("Объявления за день",
+     "SELECT COUNT(*) FROM advertisements WHERE status = 'approved' AND created_at >= date('now', '-1 day')", ()),
+]
+
+
+def fill(conn: sqlite3.Connection, ads: int, users: int, servers: int):
+    conn.executemany(
+        "INSERT INTO servers (id, name, channel_id, moderation_group_id) VALUES (?, ?, ?, ?)",
+        ((i, f"Сервер {i}", f"-100{i}", f"-200{i}") for i in range(1, servers + 1))
+    )
+    rnd = random.Random(42)
+    # Большинство объявлений уже обработано, в очереди — около 2%
+    conn.executemany(
+        "INSERT INTO advertisements (user_id, server_id, text, status, created_at) "
+        "VALUES (?, ?, ?, ?, datetime('now', ?))",
+        (
+            (
+                rnd.randint(1, users),
+                rnd.randint(1, servers),
+                f"Продам аккаунт #{i}",
+                "pending" if rnd.random() < 0.02 else rnd.choice(STATUSES[1:]),
+                f"-{rnd.randint(0, 365 * 24 * 60)} minutes",
+            )
+            for i in range(ads)
+        )
+    )
+    conn.commit()
+
+
+def measure(conn: sqlite3.Connection, users: int, servers: int, repeat: int):
+    rnd = random.Random(7)
+    for title, sql, kinds in QUERIES:
+        def params():
+            return tuple(rnd.randint(1, users if kind == "user" else servers) for kind in kinds)
+
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params()).fetchall()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params()).fetchall()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+
+        print(f"  {title}: {elapsed:.3f} мс/запрос")
+        for row in plan:
+            print(f"      {row[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк индексов таблицы объявлений")
+    parser.add_argument("--ads", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        conn.execute("PRAGMA journal_mode=WAL")
+        run_migrations(conn, target=1)
+
+        started = time.perf_counter()
+        fill(conn, args.ads, args.users, args.servers)
+        print(f"Вставлено {args.ads} объявлений за {time.perf_counter() - started:.1f} с\n")
+
+        print("Без индексов (схема версии 1):")
+        measure(conn, args.users, args.servers, args.repeat)
+
+        started = time.perf_counter()
+        version = run_migrations(conn)
+        conn.execute("ANALYZE")
+        print(f"\nМиграции до версии {version} применены за {time.perf_counter() - started:.1f} с\n")
+
+        print(f"С индексами (схема версии {version}):")
+        measure(conn, args.users, args.servers, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Бенчмарк поиска: FTS5-индекс (Database.search_advertisements) против
+# наивного LIKE '%...%' на большом синтетическом корпусе объявлений.
+#
+#   python -m benchmarks.bench_search --ads 500000
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from database.db import Database
+from database.migrations import run_migrations
+from search import parse_query
+
+WORDS = (
+    "продам куплю обменяю аккаунт машина дом бизнес скин оружие одежда квартира гараж "
+    "уровень донат срочно дешево торг обмен новый редкий полный тюнинг номер маска "
+    "сервер вип лицензия бронь ферма завод магазин яхта вертолет мотоцикл"
+).split()
+SYLLABLES = "ба ве ги до жу зе ка ли мо ну пе ра си то фу ха це чи шо эл юн ям".split()
+VOCABULARY_SIZE = 20000
+
+
+def vocabulary():
+    # Частые слова объявлений плюс «длинный хвост» редких — названия, модели,
+    # ники. В тексте слова выбираются по закону Ципфа, как в живом корпусе.
+    rnd = random.Random(1)
+    words = list(WORDS)
+    while len(words) < VOCABULARY_SIZE:
+        words.append("".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(3, 5))))
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return words, cum_weights
+
+
+def fill(path: str, ads: int, servers: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    run_migrations(conn)
+    conn.executemany(
+        "INSERT INTO servers (id, name, channel_id, moderation_group_id) VALUES (?, ?, ?, ?)",
+        ((i, f"Сервер {i}", f"-100{i}", f"-200{i}") for i in range(1, servers + 1))
+    )
+    rnd = random.Random(42)
+    words, cum_weights = vocabulary()
+    conn.executemany(
+        "INSERT INTO advertisements (user_id, server_id, text, status) VALUES (?, ?, ?, ?)",
+        (
+            (
+                rnd.randint(1, 100000),
+                rnd.randint(1, servers),
+                " ".join(rnd.choices(words, cum_weights=cum_weights, k=rnd.randint(5, 30))),
+                "approved" if rnd.random() < 0.9 else "pending",
+            )
+            for _ in range(ads)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def queries():
+    # Запросы разной избирательности: частое слово, пара частых, слова из
+    # середины и хвоста словаря и слово, которого нет в корпусе
+    words, _ = vocabulary()
+    return [
+        words[0],
+        f"{words[1]} {words[3]}",
+        words[300],
+        words[5000],
+        f"{words[200]} {words[900]}",
+        "несуществующее",
+    ]
+
+
+def like_search(conn: sqlite3.Connection, words, limit: int):
+    # То, что пришлось бы делать без индекса: просмотр таблицы до LIMIT совпадений
+    where = " AND ".join("a.text LIKE ?" for _ in words)
+    return conn.execute(
+        f"SELECT a.id FROM advertisements a WHERE a.status = 'approved' AND {where} ORDER BY a.id LIMIT ?",
+        [f"%{word}%" for word in words] + [limit]
+    ).fetchall()
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        started = time.perf_counter()
+        fill(path, args.ads, args.servers)
+        print(f"Корпус: {args.ads} объявлений, заполнение и индексация {time.perf_counter() - started:.1f} с")
+        # bm25 ранжирует все совпадения, поэтому время FTS5 растёт с их числом;
+        # LIKE с LIMIT быстро находит частые слова, но на редких и отсутствующих
+        # словах просматривает всю таблицу
+        print("Время: FTS5 — первая и вторая страница, LIKE — первые 12 совпадений\n")
+
+        db = Database(path)
+        await db.connect()
+        conn = sqlite3.connect(path)
+
+        print(f"{'запрос':<32}{'совпадений':>12}{'FTS5 мс':>10}{'LIKE мс':>10}{'ускорение':>12}")
+        for query in queries():
+            match, status, server_id = parse_query(query, False)
+            matches = conn.execute(
+                "SELECT COUNT(*) FROM advertisements_fts WHERE advertisements_fts MATCH ?", (match,)
+            ).fetchone()[0]
+
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                page = await db.search_advertisements(match, status, server_id, None, 6)
+                if page:
+                    await db.search_advertisements(match, status, server_id, (page[-1][4], page[-1][0]), 6)
+            fts_ms = (time.perf_counter() - started) / args.repeat * 1000
+
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                like_search(conn, query.split(), 12)
+            like_ms = (time.perf_counter() - started) / args.repeat * 1000
+
+            print(f"{query:<32}{matches:>12}{fts_ms:>10.2f}{like_ms:>10.2f}{like_ms / fts_ms:>11.1f}x")
+
+        conn.close()
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк полнотекстового поиска")
+    parser.add_argument("--ads", type=int, default=500_000)
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
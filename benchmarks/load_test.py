@@ -0,0 +1,297 @@
+# Нагрузочный тест: прогоняет через настоящий Dispatcher и роутеры бота поток
+# синтетических апдейтов от множества одновременных пользователей — /start,
+# выбор сервера, текст, фото или «без фото» — и модерацию (approve/reject),
+# затем ждёт, пока очередь заданий выполнит пересылки и публикации.
+# Вместо сети используется фейковая сессия Bot API с настраиваемой задержкой.
+# Отчёт: пропускная способность, p50/p95/p99 по шагам и время БД на шаг;
+# --json сохраняет результаты для сравнения прогонов.
+#
+#   python -m benchmarks.load_test --users 500 --concurrency 100
+import argparse
+import asyncio
+import contextvars
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, SendMediaGroup, TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+from database.db import Database
+from database.fsm_storage import SQLiteStorage
+from jobs import JobWorker
+from main import create_dispatcher
+from sender import OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+BOT_ID = 1000000
+SERVER_CHANNEL = "-1001000000001"
+SERVER_MODERATION = "-1001000000002"
+MODERATOR_ID = 7
+
+# Время в потоке БД, накопленное текущим апдейтом
+_db_time: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar("db_time", default=None)
+
+
+class TimedDatabase(Database):
+    # Складывает время запросов в счётчик текущего апдейта. _observe
+    # вызывается в контексте обратившегося к базе, в том числе для отложенных
+    # записей, зафиксированных пачкой вместе с чужими
+    def _observe(self, name, elapsed, stats):
+        super()._observe(name, elapsed, stats)
+        acc = _db_time.get()
+        if acc is not None:
+            acc[0] += elapsed
+
+
+class FakeSession(BaseSession):
+    # Отвечает на любой метод Bot API правдоподобным результатом без сети
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    def _message(self, method: TelegramMethod) -> Message:
+        chat_id = getattr(method, "chat_id", 0)
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private" if chat_id > 0 else "supergroup"),
+        )
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, GetMe):
+            return User(id=BOT_ID, is_bot=True, first_name="bench")
+        if isinstance(method, SendMediaGroup):
+            return [self._message(method) for _ in method.media]
+        if "Message" in str(method.__returning__):
+            return self._message(method)
+        return True
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> User:
+        return User(id=user_id, is_bot=False, first_name=f"User {user_id}", username=f"user{user_id}")
+
+    def message(self, user_id: int, text: Optional[str] = None, photo: Optional[str] = None) -> Update:
+        extra = {}
+        if photo:
+            extra["photo"] = [PhotoSize(file_id=photo, file_unique_id=f"u{photo}", width=1280, height=720)]
+        return Update(update_id=next(self._update_ids), message=Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=self._user(user_id),
+            text=text,
+            **extra,
+        ))
+
+    def callback(self, user_id: int, data: str, chat_id: Optional[int] = None) -> Update:
+        chat_id = chat_id or user_id
+        message = Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private" if chat_id > 0 else "supergroup"),
+            text="…",
+        )
+        return Update(update_id=next(self._update_ids), callback_query=CallbackQuery(
+            id=str(next(self._callback_ids)),
+            from_user=self._user(user_id),
+            chat_instance="bench",
+            message=message,
+            data=data,
+        ))
+
+
+class Recorder:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.db_time: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def feed(self, dp, bot: Bot, step: str, update: Update):
+        acc = [0.0]
+        token = _db_time.set(acc)
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            self.errors[step] += 1
+            logger.debug("Ошибка на шаге %s: %s", step, e)
+        finally:
+            self.latency[step].append(time.perf_counter() - started)
+            self.db_time[step].append(acc[0])
+            _db_time.reset(token)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def user_flow(dp, bot, factory: UpdateFactory, recorder: Recorder, user_id: int, with_photo: bool):
+    await recorder.feed(dp, bot, "start", factory.message(user_id, "/start"))
+    await recorder.feed(dp, bot, "create", factory.message(user_id, "📝 Создать объявление"))
+    await recorder.feed(dp, bot, "server", factory.callback(user_id, "server_1"))
+    await recorder.feed(dp, bot, "text", factory.message(user_id, f"Продам аккаунт, уровень {user_id % 100}"))
+    if with_photo:
+        await recorder.feed(dp, bot, "add_photo", factory.callback(user_id, "add_photo"))
+        await recorder.feed(dp, bot, "photo", factory.message(user_id, photo=f"photo{user_id}"))
+    else:
+        await recorder.feed(dp, bot, "no_photo", factory.callback(user_id, "no_photo"))
+
+
+async def run_limited(coroutines, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _limited(coroutine):
+        async with semaphore:
+            await coroutine
+
+    await asyncio.gather(*(_limited(coroutine) for coroutine in coroutines))
+
+
+def report(recorder: Recorder, phase_seconds: Dict[str, float], total_updates: int) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"steps": {}, "phases": phase_seconds, "updates": total_updates}
+    print(f"{'шаг':<12}{'n':>7}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'БД мс':>10}{'ошибки':>8}")
+    for step, values in recorder.latency.items():
+        db_values = recorder.db_time[step]
+        row = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "db_mean_ms": sum(db_values) / len(db_values) * 1000,
+            "errors": recorder.errors.get(step, 0),
+        }
+        result["steps"][step] = row
+        print(
+            f"{step:<12}{row['count']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+            f"{row['p99_ms']:>10.2f}{row['db_mean_ms']:>10.2f}{row['errors']:>8}"
+        )
+
+    elapsed = sum(phase_seconds.values())
+    result["throughput_updates_per_sec"] = total_updates / elapsed if elapsed else 0.0
+    print(f"\nВсего апдейтов: {total_updates} за {elapsed:.2f} с — {result['throughput_updates_per_sec']:.0f} апдейтов/с")
+    for phase, seconds in phase_seconds.items():
+        print(f"  {phase}: {seconds:.2f} с")
+    return result
+
+
+async def run(args):
+    tmp = tempfile.TemporaryDirectory()
+    db = TimedDatabase(os.path.join(tmp.name, "load.db"))
+    await db.connect()
+    await db.migrate()
+    await db.add_server("Benchmark", SERVER_CHANNEL, SERVER_MODERATION)
+
+    session = FakeSession(latency=args.api_latency / 1000)
+    bot = Bot(token=f"{BOT_ID}:BENCHMARK", session=session)
+    if args.real_limits:
+        sender = OutboundQueue(bot)
+    else:
+        sender = OutboundQueue(bot, global_rate=1e9, chat_rate=1e9, group_rate=1e9, group_burst=1e9, concurrency=64)
+    storage = SQLiteStorage(db)
+    dp = create_dispatcher(db, sender, storage)
+    worker = JobWorker(db, sender, poll_interval=0.05)
+    sender.start()
+    storage.start()
+    worker.start()
+
+    factory = UpdateFactory()
+    recorder = Recorder()
+    rnd = random.Random(args.seed)
+    user_ids = [100000 + i for i in range(args.users)]
+    phases: Dict[str, float] = {}
+
+    started = time.perf_counter()
+    await run_limited(
+        [user_flow(dp, bot, factory, recorder, user_id, rnd.random() < args.photo_share) for user_id in user_ids],
+        args.concurrency,
+    )
+    phases["подача объявлений"] = time.perf_counter() - started
+
+    # Объявления создаются с id 1..N в свежей базе
+    ad_ids = list(range(1, args.users + 1))
+    moderation_chat = int(SERVER_MODERATION)
+    actions = ["approve" if rnd.random() < args.approve_share else "reject" for _ in ad_ids]
+    started = time.perf_counter()
+    await run_limited(
+        [
+            recorder.feed(dp, bot, action, factory.callback(MODERATOR_ID, f"{action}_{ad_id}", moderation_chat))
+            for action, ad_id in zip(actions, ad_ids)
+        ],
+        args.concurrency,
+    )
+    phases["модерация"] = time.perf_counter() - started
+
+    # Пересылка, публикация и уведомления выполняются очередью заданий —
+    # ждём, пока она опустеет
+    started = time.perf_counter()
+    while any(status in ("pending", "running") for _, status, _ in await db.get_job_counts()):
+        await asyncio.sleep(0.05)
+    phases["очередь заданий"] = time.perf_counter() - started
+
+    total_updates = sum(len(values) for values in recorder.latency.values())
+    result = report(recorder, phases, total_updates)
+    result["api_requests"] = session.requests
+    result["args"] = vars(args)
+
+    await dp.emit_shutdown(bot=bot)
+    await worker.stop()
+    await sender.stop()
+    await db.close()
+    tmp.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диспетчера бота")
+    parser.add_argument("--users", type=int, default=500, help="пользователей, каждый подаёт одно объявление")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--photo-share", type=float, default=0.5, help="доля объявлений с фото")
+    parser.add_argument("--approve-share", type=float, default=0.8, help="доля одобренных объявлений")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--real-limits", action="store_true", help="использовать боевые лимиты очереди отправки")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    # INFO-логи для замеров — шум, выводятся только предупреждения и ошибки
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import EditMessageText, SendMessage
+
+from database.db import Database
+from database.models import Broadcast
+from metrics import BROADCAST_MESSAGES
+from sender import OutboundQueue, Priority
+
+logger = logging.getLogger(__name__)
+
+
+def format_progress(broadcast: Broadcast, rate: float, finished: bool = False) -> str:
+    processed = broadcast.sent + broadcast.failed + broadcast.blocked
+    if finished:
+        title = f"✅ Рассылка #{broadcast.id} завершена"
+    else:
+        title = f"📣 Рассылка #{broadcast.id}"
+    text = (
+        f"{title}\n\n"
+        f"Обработано: {processed} из {broadcast.total}\n"
+        f"Доставлено: {broadcast.sent} · ошибок: {broadcast.failed} · заблокировали бота: {broadcast.blocked}"
+    )
+    if not finished and rate > 0:
+        eta = max(broadcast.total - processed, 0) / rate
+        text += f"\nСкорость: {rate:.1f} сообщ./с · осталось ≈ {eta / 60:.0f} мин"
+    return text
+
+
+class Broadcaster:
+    # Рассылка сообщения всем активным пользователям. Получатели читаются
+    # страницами по id (keyset), страница целиком ставится в очередь отправки
+    # с приоритетом BULK — общий лимит бота выбирается полностью, но
+    # модерация и уведомления идут вперёд. В очереди одновременно не больше
+    # `window` страниц. После доставки страницы её последний id сохраняется
+    # как контрольная точка, поэтому после перезапуска бота (resume())
+    # рассылка продолжается с неё — повторно сообщение могут получить не
+    # больше одной-двух страниц пользователей. Заблокировавшие бота
+    # помечаются is_active = 0 и следующими рассылками пропускаются.
+    def __init__(
+        self,
+        db: Database,
+        sender: OutboundQueue,
+        page_size: int = 200,
+        window: int = 2,
+        progress_interval: float = 5.0,
+    ):
+        self.db = db
+        self.sender = sender
+        self.page_size = page_size
+        self.window = window
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, admin_chat_id: int, text: str) -> Broadcast:
+        # Сообщение с прогрессом отправляется сразу, его id хранится в рассылке
+        message = await self.sender.send(
+            SendMessage(chat_id=admin_chat_id, text="📣 Рассылка запускается…"), priority=Priority.NOTIFICATION
+        )
+        broadcast = await self.db.create_broadcast(admin_chat_id, message.message_id, text)
+        self._spawn(broadcast)
+        return broadcast
+
+    async def resume(self):
+        # Вызывается при старте бота: продолжает рассылки, прерванные перезапуском
+        for broadcast in await self.db.get_running_broadcasts():
+            logger.info("Продолжаю рассылку %s с пользователя %s", broadcast.id, broadcast.last_user_id)
+            self._spawn(broadcast)
+
+    async def cancel(self) -> int:
+        # Отмена администратором: рассылка больше не продолжится после перезапуска
+        cancelled = list(self._tasks)
+        await self.stop()
+        for broadcast_id in cancelled:
+            await self.db.finish_broadcast(broadcast_id, "cancelled")
+        return len(cancelled)
+
+    async def stop(self):
+        # Остановка вместе с ботом: статус не меняется, resume() продолжит
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, broadcast: Broadcast):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast.id, None))
+
+    def _report(self, broadcast: Broadcast, rate: float, finished: bool = False):
+        self.sender.send(
+            EditMessageText(
+                chat_id=broadcast.admin_chat_id,
+                message_id=broadcast.progress_message_id,
+                text=format_progress(broadcast, rate, finished),
+            ),
+            priority=Priority.NOTIFICATION,
+        )
+
+    async def _run(self, broadcast: Broadcast):
+        started = time.monotonic()
+        processed_at_start = broadcast.sent + broadcast.failed + broadcast.blocked
+        reported_at = started
+        after_id = broadcast.last_user_id
+        exhausted = False
+        pages: Deque[Tuple[int, List[int], List[asyncio.Future]]] = deque()
+
+        def rate() -> float:
+            processed = broadcast.sent + broadcast.failed + broadcast.blocked - processed_at_start
+            return processed / max(time.monotonic() - started, 1e-9)
+
+        try:
+            while True:
+                while not exhausted and len(pages) < self.window:
+                    user_ids = await self.db.get_active_user_ids(after_id, self.page_size)
+                    if not user_ids:
+                        exhausted = True
+                        break
+                    after_id = user_ids[-1]
+                    futures = [
+                        self.sender.send(SendMessage(chat_id=user_id, text=broadcast.text), priority=Priority.BULK)
+                        for user_id in user_ids
+                    ]
+                    pages.append((after_id, user_ids, futures))
+                if not pages:
+                    break
+
+                last_id, user_ids, futures = pages[0]
+                results = await asyncio.gather(*futures, return_exceptions=True)
+                pages.popleft()
+
+                sent = failed = 0
+                blocked: List[int] = []
+                for user_id, result in zip(user_ids, results):
+                    if isinstance(result, TelegramForbiddenError):
+                        blocked.append(user_id)
+                    elif isinstance(result, Exception):
+                        failed += 1
+                    else:
+                        sent += 1
+                broadcast = await self.db.checkpoint_broadcast(broadcast.id, last_id, sent, failed, blocked)
+                BROADCAST_MESSAGES.inc("sent", amount=sent)
+                BROADCAST_MESSAGES.inc("failed", amount=failed)
+                BROADCAST_MESSAGES.inc("blocked", amount=len(blocked))
+
+                if time.monotonic() - reported_at >= self.progress_interval:
+                    reported_at = time.monotonic()
+                    self._report(broadcast, rate())
+        except asyncio.CancelledError:
+            # Ещё не отправленные запросы снимаются с очереди отправки
+            for _, _, futures in pages:
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            logger.error("Ошибка рассылки %s, продолжится после перезапуска: %s", broadcast.id, e)
+            return
+
+        await self.db.finish_broadcast(broadcast.id)
+        self._report(broadcast, rate(), finished=True)
@@ -6,6 +6,114 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id]
 
+# Время жизни кэша ролей (сек); изменения ролей применяются к кэшу сразу,
+# TTL лишь страхует от правок БД в обход бота
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "300"))
+
+# Лимиты исходящих запросов к Bot API (очередь отправки sender.OutboundQueue)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))                  # сообщений в секунду на бота
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))                       # сообщений в секунду в личный чат
+SEND_GROUP_RATE_PER_MINUTE = float(os.getenv("SEND_GROUP_RATE_PER_MINUTE", "20"))  # сообщений в минуту в группу/канал
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+
+# Очередь заданий (jobs.JobWorker): публикация, пересылка на модерацию и
+# уведомления. JOB_EMBEDDED_WORKER=1 — задания выполняет сам процесс бота;
+# 0 — только отдельные процессы `python worker.py` (их число — JOB_WORKER_PROCESSES)
+JOB_EMBEDDED_WORKER = os.getenv("JOB_EMBEDDED_WORKER", "1") == "1"
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "10"))
+
+# Хранилище черновиков FSM: через сколько часов брошенный черновик удаляется
+# и сколько активных черновиков держать в памяти
+FSM_DRAFT_TTL_HOURS = float(os.getenv("FSM_DRAFT_TTL_HOURS", "24"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1000"))
+
+# Групповая фиксация записей в БД: сколько ждать попутные записи (мс) и
+# максимум записей в одной транзакции
+DB_WRITE_DELAY_MS = float(os.getenv("DB_WRITE_DELAY_MS", "5"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))
+
+# Логи (logs.setup_logging): уровень, формат — "json" (по строке JSON на
+# запись) или "text", и выборка частых событий по логгерам: доля сохраняемых
+# записей ниже WARNING, например "aiogram.event=0.01,database.db=0.1".
+# LOG_LEAN_RECORDS=1 — не собирать в записи место вызова, поток и процесс
+# (глобальные настройки модуля logging, затрагивают весь процесс)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "aiogram.event=0.01")
+LOG_LEAN_RECORDS = os.getenv("LOG_LEAN_RECORDS", "0") == "1"
+
+# Сколько апдейтов обрабатывается одновременно (по разным чатам; внутри
+# одного чата — всегда по порядку). 0 — строго последовательная обработка
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+# Рассылки: пользователей на страницу (и на контрольную точку) и как часто
+# обновлять сообщение с прогрессом
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Отложенные действия с объявлениями (scheduler.Scheduler): через сколько
+# дней после публикации объявление снимается (0 — не снимается) и как —
+# "mark" (пометка в тексте) или "delete" (удаление; сообщения старше 48 часов
+# Bot API удалить не даёт, они помечаются). Поднятие (/bump) по умолчанию —
+# раз в BUMP_INTERVAL_HOURS часов, BUMP_TIMES раз. Время в /schedule задаётся
+# в часовом поясе UTC+SCHEDULE_UTC_OFFSET
+AD_EXPIRE_DAYS = float(os.getenv("AD_EXPIRE_DAYS", "30"))
+AD_EXPIRE_MODE = os.getenv("AD_EXPIRE_MODE", "mark")
+BUMP_INTERVAL_HOURS = int(os.getenv("BUMP_INTERVAL_HOURS", "24"))
+BUMP_TIMES = int(os.getenv("BUMP_TIMES", "7"))
+SCHEDULE_UTC_OFFSET = float(os.getenv("SCHEDULE_UTC_OFFSET", "3"))
+SCHEDULE_BATCH_SIZE = int(os.getenv("SCHEDULE_BATCH_SIZE", "100"))
+
+# Сколько секунд после последней части альбома ждать следующую, прежде чем
+# передать альбом в хендлер целиком
+ALBUM_LATENCY = float(os.getenv("ALBUM_LATENCY", "0.5"))
+
+# Лимиты входящих апдейтов на пользователя (throttling.ThrottlingMiddleware):
+# общий — запросов в секунду и размер всплеска, и на каждый тип действия
+# (команда, photo/text, префикс callback_data). Отдельные лимиты для действий
+# задаются строкой "page=3:10,search=2:6" (запросов в секунду:всплеск)
+THROTTLE_USER_RATE = float(os.getenv("THROTTLE_USER_RATE", "2"))
+THROTTLE_USER_BURST = float(os.getenv("THROTTLE_USER_BURST", "10"))
+THROTTLE_ACTION_RATE = float(os.getenv("THROTTLE_ACTION_RATE", "1"))
+THROTTLE_ACTION_BURST = float(os.getenv("THROTTLE_ACTION_BURST", "5"))
+THROTTLE_ACTIONS = os.getenv("THROTTLE_ACTIONS", "page=3:10,search=2:6")
+
+# Архивация (archive.Archiver): одобренные и отклонённые объявления старше
+# ARCHIVE_AFTER_DAYS переносятся в отдельную базу ARCHIVE_PATH пачками по
+# ARCHIVE_BATCH_SIZE; плановый запуск раз в ARCHIVE_INTERVAL_HOURS (0 — только
+# командой /archive)
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "bot_archive.db")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+
+# Поиск повторно поданных объявлений (dedup.DuplicateDetector): за сколько
+# дней сравнивать, с какой схожести текстов (оценка коэффициента Жаккара по
+# MinHash, от 0 до 1) считать объявление повтором и для скольких пар
+# пользователь/сервер держать историю в памяти
+DEDUP_WINDOW_DAYS = float(os.getenv("DEDUP_WINDOW_DAYS", "7"))
+DEDUP_MIN_SIMILARITY = float(os.getenv("DEDUP_MIN_SIMILARITY", "0.7"))
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Внешний адрес бота (https://example.com); если пуст, webhook в Telegram
+# не регистрируется и сервер принимает апдейты только локально
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# HTTP-эндпоинт с метриками в формате Prometheus (/metrics) без
+# авторизации. По умолчанию выключен (порт 0); включается явным портом,
+# слушает только localhost, если не задан METRICS_HOST
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
 # Состояния для FSM
 class States:
     WAITING_FOR_TEXT = "waiting_for_text"
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from metrics import DB_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Запись — функция, выполняемая в потоке БД на курсоре Database, без commit()
+Write = Callable[[], Any]
+
+
+class WriteBuffer:
+    # Групповая фиксация записей (write-behind). Записи копятся в буфере и
+    # применяются пачкой в одной транзакции — один commit (и один fsync) на
+    # пачку вместо одного на каждое событие. Пачка уходит через `delay`
+    # секунд после первой записи, при `max_rows` записях или сразу, если
+    # запись срочная (хендлеру нужен её результат, например id объявления).
+    # Пока поток БД фиксирует одну пачку, следующие записи копятся в новую.
+    # Каждая запись выполняется в своём SAVEPOINT: ошибка одной откатывает
+    # только её, остальные записи пачки фиксируются.
+    def __init__(
+        self,
+        apply: Callable[[List[Write]], Awaitable[List[Tuple[Any, Optional[Exception]]]]],
+        delay: float = 0.005,
+        max_rows: int = 100,
+    ):
+        self._apply = apply
+        self.delay = delay
+        self.max_rows = max_rows
+        self._pending: List[Tuple[Write, asyncio.Future]] = []
+        self._urgent = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, write: Write, urgent: bool = False) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((write, future))
+        if urgent or len(self._pending) >= self.max_rows:
+            self._urgent.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+        return future
+
+    async def flush(self):
+        # Немедленно фиксирует всё, что уже в буфере
+        if self._pending:
+            await self.submit(lambda: None, urgent=True)
+
+    async def _flush_loop(self):
+        try:
+            while self._pending:
+                if not self._urgent.is_set():
+                    try:
+                        await asyncio.wait_for(self._urgent.wait(), self.delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self._urgent.clear()
+
+                batch, self._pending = self._pending, []
+                DB_WRITE_BATCH_SIZE.observe(len(batch))
+                try:
+                    outcomes = await self._apply([write for write, _ in batch])
+                except Exception as e:
+                    # Не удалась вся транзакция (например, commit)
+                    logger.error("Ошибка при групповой записи %s изменений: %s", len(batch), e)
+                    outcomes = [(None, e)] * len(batch)
+
+                for (_, future), (result, error) in zip(batch, outcomes):
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+        finally:
+            self._task = None
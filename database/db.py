@@ -1,146 +1,1140 @@
+import asyncio
+import json
 import sqlite3
 import logging
-from typing import List, Tuple
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from database.batching import Write, WriteBuffer
+from database.models import AD_COLUMNS, BROADCAST_COLUMNS, SERVER_COLUMNS, Ad, Broadcast, ScheduleEntry, Server
+from database.migrations import rebuild_moderation_counters, run_migrations
+from database.roles import RoleCache
+from dedup import Fingerprint, fingerprint
+from metrics import DB_COMMIT_SECONDS, DB_ERRORS, DB_QUERY_SECONDS, DB_ROWS
+
+logger = logging.getLogger(__name__)
+
+
+class _QueryStats:
+    # Замеры одного вызова Database._run: строки и время фиксации транзакций
+    __slots__ = ("rows", "commit_seconds")
+
+    def __init__(self):
+        self.rows = 0
+        self.commit_seconds = 0.0
+
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.connection.stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self.connection.stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.connection.stats.rows += len(rows)
+        return rows
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = _QueryStats()
+
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        self.stats.commit_seconds += time.perf_counter() - started
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        started = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            if exc_type is None:
+                self.stats.commit_seconds += time.perf_counter() - started
+
+
+def _method_name(func: Callable) -> str:
+    # "Database.get_server.<locals>._query" -> "get_server"
+    return func.__qualname__.split(".<locals>")[0].rsplit(".", 1)[-1]
+
 
 class Database:
-    def __init__(self, db_name: str = "bot.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        logging.info(f"Подключение к базе данных {db_name} установлено")
-        self._create_tables()
+    # Все обращения к SQLite выполняются в одном выделенном потоке через одно
+    # долгоживущее соединение, а хендлеры получают awaitable API и не блокируют
+    # event loop. Экземпляр создаётся один раз в main.py и передаётся в хендлеры
+    # через DI aiogram (аргумент `db`).
+    def __init__(
+        self,
+        db_name: str = "bot.db",
+        admin_ids: Iterable[int] = (),
+        role_cache_ttl: float = 300.0,
+        write_delay: float = 0.005,
+        write_batch_size: int = 100,
+    ):
+        self.db_name = db_name
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cursor: Optional[sqlite3.Cursor] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self.roles = RoleCache(admin_ids, ttl=role_cache_ttl)
+        # Увеличивается при каждом изменении списка серверов; по нему
+        # сбрасываются закэшированные клавиатуры выбора сервера
+        self.servers_version = 0
+        # Серверы не меняются после добавления, а читаются при каждой подаче и
+        # модерации объявления — поэтому они кэшируются на весь процесс
+        self._servers: Dict[int, Server] = {}
+        self._roles_reload_task: Optional[asyncio.Task] = None
+        # Горячие записи (регистрация пользователей, подача и модерация
+        # объявлений) фиксируются пачками, см. database/batching.py
+        self.writes = WriteBuffer(self._write_batch, delay=write_delay, max_rows=write_batch_size)
+
+    def _measured(self, func: Callable, args: tuple):
+        stats = _QueryStats()
+        if self.conn is not None:
+            self.conn.stats = stats
+        started = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - started, stats
 
-    def add_user_if_not_exists(self, user_id: int, username: str = None, full_name: str = None):
+    def _observe(self, name: str, elapsed: float, stats: _QueryStats):
+        # Вызывается в контексте того, кто обратился к базе: время в потоке
+        # БД, прочитанные строки и время фиксации транзакций
+        DB_QUERY_SECONDS.observe(elapsed, name)
+        if stats.rows:
+            DB_ROWS.inc(name, amount=stats.rows)
+        if stats.commit_seconds:
+            DB_COMMIT_SECONDS.observe(stats.commit_seconds, name)
+
+    async def _run(self, func: Callable, *args):
+        # Все методы выполняются через _run или _submit, поэтому здесь же
+        # снимаются метрики
+        name = _method_name(func)
+        loop = asyncio.get_running_loop()
         try:
-            self.cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-            if not self.cursor.fetchone():
-                self.cursor.execute(
-                    "INSERT INTO users (id, username, full_name) VALUES (?, ?, ?)",
-                    (user_id, username, full_name)
-                )
-                self.conn.commit()
-                logging.info(f"Добавлен новый пользователь: {user_id}")
+            result, elapsed, stats = await loop.run_in_executor(self._executor, self._measured, func, args)
         except Exception as e:
-            logging.error(f"Ошибка при добавлении пользователя {user_id}: {e}")
+            DB_ERRORS.inc(name, type(e).__name__)
             raise
+        self._observe(name, elapsed, stats)
+        return result
+
+    def _submit(self, write: Write, urgent: bool = False) -> asyncio.Future:
+        # Отложенная запись через WriteBuffer. Каждая запись пачки замеряется
+        # отдельно, а метрики снимаются под именем метода в колбэке, который
+        # выполняется в контексте вызвавшего, — время относится к его апдейту,
+        # а не к тому, чей апдейт запустил фиксацию пачки
+        name = _method_name(write)
+        result = asyncio.get_running_loop().create_future()
+
+        def _done(measured: asyncio.Future):
+            if measured.cancelled():
+                result.cancel()
+            elif measured.exception() is not None:
+                DB_ERRORS.inc(name, type(measured.exception()).__name__)
+                result.set_exception(measured.exception())
+            else:
+                value, elapsed, stats = measured.result()
+                self._observe(name, elapsed, stats)
+                result.set_result(value)
 
-    def _create_tables(self):
+        self.writes.submit(partial(self._measured, write, ()), urgent).add_done_callback(_done)
+        return result
+
+    def _apply_writes(self, writes: List[Write]) -> List[Tuple[object, Optional[Exception]]]:
+        # Выполняется в потоке БД: вся пачка — одна транзакция, каждая запись —
+        # в своём SAVEPOINT, чтобы ошибка одной не откатывала остальные
+        outcomes = []
+        batch = self.conn.stats
+        if not self.conn.in_transaction:
+            self.cursor.execute("BEGIN")
         try:
-            # Таблица для серверов/каналов
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS servers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    moderation_group_id TEXT NOT NULL
-                )
-            """)
-
-            # Таблица для объявлений
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS advertisements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    server_id INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    photo_id TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (server_id) REFERENCES servers (id)
-                )
-            """)
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    role TEXT DEFAULT 'user'
-                )
-            """)
+            for write in writes:
+                self.cursor.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((write(), None))
+                except Exception as e:
+                    self.cursor.execute("ROLLBACK TO write")
+                    outcomes.append((None, e))
+                self.cursor.execute("RELEASE write")
+            # Фиксация — общая для пачки, она не входит в замер последней записи
+            self.conn.stats = batch
             self.conn.commit()
-            logging.info("Таблицы базы данных успешно созданы")
-        except Exception as e:
-            logging.error(f"Ошибка при создании таблиц: {e}")
+        except Exception:
+            self.conn.rollback()
             raise
+        return outcomes
+
+    async def _write_batch(self, writes: List[Write]) -> List[Tuple[object, Optional[Exception]]]:
+        # Время записей снимает _submit; здесь — только фиксация всей пачки
+        loop = asyncio.get_running_loop()
+        outcomes, _, stats = await loop.run_in_executor(self._executor, self._measured, self._apply_writes, (writes,))
+        if stats.commit_seconds:
+            DB_COMMIT_SECONDS.observe(stats.commit_seconds, "write_batch")
+        return outcomes
+
+    def _insert_ad_jobs(self, ad_ids: Iterable[int], jobs: Iterable[Tuple[str, int]], key_suffix: str = ""):
+        # Выполняется в потоке БД внутри транзакции вызывающего метода. Задания
+        # привязаны к объявлению: payload {"ad_id": ..., "message_ids": [...]}
+        # с сообщениями публикации на момент постановки (по ним исполнитель
+        # узнаёт, что задание уже выполнялось), ключ "<вид>:<id>" (для
+        # повторяющихся действий — с суффиксом срабатывания)
+        now = time.time()
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO jobs (kind, payload, idempotency_key, priority, run_at, created_at) "
+            "SELECT ?, json_object('ad_id', id, 'message_ids', json(COALESCE(channel_message_ids, '[]'))), ?, ?, ?, ? "
+            "FROM advertisements WHERE id = ?",
+            [
+                (kind, f"{kind}:{ad_id}{key_suffix}", int(priority), now, now, ad_id)
+                for ad_id in ad_ids for kind, priority in jobs
+            ]
+        )
+
+    def _insert_schedule(self, ad_ids: Iterable[int], entries: Iterable[ScheduleEntry]):
+        # Выполняется в потоке БД внутри транзакции вызывающего метода
+        self.cursor.executemany(
+            "INSERT INTO schedule (ad_id, kind, run_at, interval, repeats) VALUES (?, ?, ?, ?, ?)",
+            [
+                (ad_id, entry.kind, entry.run_at, entry.interval, entry.repeats)
+                for ad_id in ad_ids for entry in entries
+            ]
+        )
+
+    async def connect(self):
+        def _connect():
+            # sqlite3 кэширует подготовленные выражения по тексту запроса,
+            # поэтому все запросы ниже — константные строки с параметрами
+            self.conn = sqlite3.connect(self.db_name, cached_statements=256, factory=_InstrumentedConnection)
+            self.cursor = self.conn.cursor()
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute("PRAGMA synchronous=NORMAL")
+            self.cursor.execute("PRAGMA busy_timeout=5000")
+            self.cursor.execute("PRAGMA foreign_keys=ON")
 
-    def add_server(self, name: str, channel_id: str, moderation_group_id: str) -> int:
         try:
+            await self._run(_connect)
+            logger.info("Подключение к базе данных %s установлено", self.db_name)
+        except Exception as e:
+            logger.error("Ошибка при подключении к базе данных %s: %s", self.db_name, e)
+            raise
+
+    async def migrate(self) -> int:
+        # Вызывается один раз при старте процесса, до обработки апдейтов
+        version = await self._run(run_migrations, self.conn)
+        await self.reload_roles()
+        logger.info("Схема базы данных в версии %s", version)
+        return version
+
+    async def ping(self):
+        def _query():
+            self.cursor.execute("SELECT 1")
+            return self.cursor.fetchone()
+
+        return await self._run(_query)
+
+    async def add_user_if_not_exists(self, user_id: int, username: str = None, full_name: str = None):
+        # Одна UPSERT-запись вместо SELECT + INSERT: новый пользователь
+        # добавляется, у существующего обновляются изменившиеся username и
+        # full_name, а заблокировавший бота и вернувшийся снова получает
+        # рассылки. Неизменённая строка не переписывается. Запись
+        # отложенная — хендлер не ждёт фиксации
+        def _write():
+            self.cursor.execute(
+                "INSERT INTO users (id, username, full_name) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET username = excluded.username, full_name = excluded.full_name, is_active = 1 "
+                "WHERE username IS NOT excluded.username OR full_name IS NOT excluded.full_name OR is_active = 0",
+                (user_id, username, full_name)
+            )
+
+        def _done(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error("Ошибка при добавлении пользователя %s: %s", user_id, future.exception())
+
+        self._submit(_write).add_done_callback(_done)
+
+    async def add_server(self, name: str, channel_id: str, moderation_group_id: str) -> int:
+        def _query():
             self.cursor.execute(
                 "INSERT INTO servers (name, channel_id, moderation_group_id) VALUES (?, ?, ?)",
                 (name, channel_id, moderation_group_id)
             )
             self.conn.commit()
-            logging.info(f"Добавлен новый сервер: {name}")
             return self.cursor.lastrowid
+
+        try:
+            server_id = await self._run(_query)
+            self.servers_version += 1
+            logger.info("Добавлен новый сервер: %s", name)
+            return server_id
         except Exception as e:
-            logging.error(f"Ошибка при добавлении сервера: {e}")
+            logger.error("Ошибка при добавлении сервера: %s", e)
             raise
 
-    def get_servers(self) -> List[Tuple]:
-        try:
+    async def get_servers(self) -> List[Tuple]:
+        def _query():
             self.cursor.execute("SELECT id, name FROM servers")
             return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
         except Exception as e:
-            logging.error(f"Ошибка при получении списка серверов: {e}")
+            logger.error("Ошибка при получении списка серверов: %s", e)
             raise
 
-    def get_server(self, server_id: int) -> Tuple:
+    async def get_servers_page(self, after_id: int = 0, limit: int = 5) -> Tuple[List[Tuple], bool, Optional[int]]:
+        # Keyset-пагинация по id: страница — это `limit` серверов с id > after_id.
+        # Новые серверы получают больший id и попадают в конец списка,
+        # поэтому уже показанные страницы не сдвигаются.
+        # Возвращает (серверы, есть ли следующая страница, якорь предыдущей).
+        def _query():
+            self.cursor.execute(
+                "SELECT id, name FROM servers WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit + 1)
+            )
+            rows = self.cursor.fetchall()
+
+            prev_after_id = None
+            if after_id > 0:
+                self.cursor.execute(
+                    "SELECT id FROM servers WHERE id <= ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    (after_id, limit)
+                )
+                row = self.cursor.fetchone()
+                prev_after_id = row[0] if row else 0
+            return rows[:limit], len(rows) > limit, prev_after_id
+
         try:
-            self.cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
-            return self.cursor.fetchone()
+            return await self._run(_query)
         except Exception as e:
-            logging.error(f"Ошибка при получении сервера {server_id}: {e}")
+            logger.error("Ошибка при получении страницы серверов после %s: %s", after_id, e)
             raise
 
-    def add_advertisement(self, user_id: int, server_id: int, text: str, photo_id: str = None) -> int:
+    async def get_server(self, server_id: int) -> Optional[Server]:
+        server = self._servers.get(server_id)
+        if server is not None:
+            return server
+
+        def _query():
+            self.cursor.execute(f"SELECT {SERVER_COLUMNS} FROM servers WHERE id = ?", (server_id,))
+            row = self.cursor.fetchone()
+            return Server._make(row) if row else None
+
         try:
+            server = await self._run(_query)
+            if server is not None:
+                self._servers[server_id] = server
+            return server
+        except Exception as e:
+            logger.error("Ошибка при получении сервера %s: %s", server_id, e)
+            raise
+
+    async def add_advertisement(
+        self,
+        user_id: int,
+        server_id: int,
+        text: str,
+        photo_id: str = None,
+        fingerprint: Optional[Fingerprint] = None,
+        jobs: Iterable[Tuple[str, int]] = (),
+        photos: Sequence[Tuple[str, Optional[str]]] = (),
+    ) -> int:
+        # jobs — задания (вид, приоритет), которые ставятся в очередь в той же
+        # транзакции, что и само объявление. photos — все фото альбома
+        # (file_id, file_unique_id) по порядку, первое становится photo_id
+        text_hash, minhash, photo_unique_id = fingerprint or (None, None, None)
+        if not photos and photo_id:
+            photos = [(photo_id, photo_unique_id)]
+        if photos:
+            photo_id = photos[0][0]
+
+        def _write():
             self.cursor.execute(
-                "INSERT INTO advertisements (user_id, server_id, text, photo_id) VALUES (?, ?, ?, ?)",
-                (user_id, server_id, text, photo_id)
+                "INSERT INTO advertisements (user_id, server_id, text, photo_id, text_hash, minhash, photo_unique_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, server_id, text, photo_id, text_hash, minhash, photo_unique_id)
             )
-            self.conn.commit()
-            logging.info(f"Добавлено новое объявление от пользователя {user_id}")
-            return self.cursor.lastrowid
+            ad_id = self.cursor.lastrowid
+            self.cursor.executemany(
+                "INSERT INTO advertisement_photos (ad_id, position, file_id, file_unique_id) VALUES (?, ?, ?, ?)",
+                [(ad_id, position, file_id, unique_id) for position, (file_id, unique_id) in enumerate(photos)]
+            )
+            self._insert_ad_jobs([ad_id], jobs)
+            return ad_id
+
+        try:
+            # Хендлеру нужен id — пачка фиксируется сразу, вместе с уже
+            # накопленными записями
+            ad_id = await self._submit(_write, urgent=True)
+            logger.info("Добавлено новое объявление от пользователя %s", user_id)
+            return ad_id
         except Exception as e:
-            logging.error(f"Ошибка при добавлении объявления: {e}")
+            logger.error("Ошибка при добавлении объявления: %s", e)
             raise
 
-    def update_advertisement_status(self, ad_id: int, status: str):
+    async def get_recent_fingerprints(self, user_id: int, server_id: int, since: float, limit: int = 20) -> List[Tuple]:
+        # Отпечатки неотклонённых объявлений пользователя на сервере, поданных
+        # после `since` (unix-время), от новых к старым: (id, время подачи,
+        # text_hash, minhash, photo_unique_id).
+        # У объявлений, поданных до появления отпечатков, MinHash считается
+        # здесь же, в потоке БД: их немного, и со временем они уходят из окна
+        def _query():
+            self.cursor.execute(
+                "SELECT id, CAST(strftime('%s', created_at) AS REAL), text_hash, minhash, photo_unique_id, "
+                "CASE WHEN minhash IS NULL THEN text END "
+                "FROM advertisements WHERE user_id = ? AND created_at >= datetime(?, 'unixepoch') AND server_id = ? "
+                "AND status != 'rejected' ORDER BY created_at DESC LIMIT ?",
+                (user_id, since, server_id, limit)
+            )
+            return [
+                (ad_id, created_at, text_hash, signature if text is None else fingerprint(text).minhash, photo)
+                for ad_id, created_at, text_hash, signature, photo, text in self.cursor.fetchall()
+            ]
+
         try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении недавних объявлений пользователя %s: %s", user_id, e)
+            raise
+
+    async def update_advertisement_status(
+        self,
+        ad_id: int,
+        status: str,
+        jobs: Iterable[Tuple[str, int]] = (),
+        expected: str = "pending",
+        schedule: Iterable[ScheduleEntry] = (),
+    ) -> bool:
+        # Compare-and-set: статус меняется, только если сейчас он `expected`;
+        # задания и отложенные действия ставятся лишь при успешном переходе.
+        # False — объявление уже промодерировано (другим модератором или
+        # повторным нажатием) или его нет
+        def _write():
             self.cursor.execute(
-                "UPDATE advertisements SET status = ? WHERE id = ?",
-                (status, ad_id)
+                "UPDATE advertisements SET status = ? WHERE id = ? AND status = ?",
+                (status, ad_id, expected)
+            )
+            if self.cursor.rowcount != 1:
+                return False
+            self._insert_ad_jobs([ad_id], jobs)
+            self._insert_schedule([ad_id], schedule)
+            return True
+
+        try:
+            changed = await self._submit(_write, urgent=True)
+            if changed:
+                logger.info("Обновлен статус объявления %s на %s", ad_id, status)
+            return changed
+        except Exception as e:
+            logger.error("Ошибка при обновлении статуса объявления %s: %s", ad_id, e)
+            raise
+
+    async def get_pending_counts(self) -> List[Tuple]:
+        # (id сервера, название, группа модерации, объявлений в очереди) —
+        # по счётчикам moderation_counters, без подсчёта объявлений
+        def _query():
+            self.cursor.execute(
+                "SELECT s.id, s.name, s.moderation_group_id, c.pending "
+                "FROM servers s JOIN moderation_counters c ON c.server_id = s.id AND c.day = '*' "
+                "WHERE c.pending > 0 ORDER BY s.id"
+            )
+            return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при подсчёте очереди модерации: %s", e)
+            raise
+
+    async def get_server_stats(self) -> List[Tuple]:
+        # (id, название, в очереди, одобрено, отклонено, подано сегодня,
+        # одобрено сегодня, отклонено сегодня) — два чтения по первичному
+        # ключу счётчиков на сервер
+        def _query():
+            self.cursor.execute(
+                "SELECT s.id, s.name, "
+                "COALESCE(t.pending, 0), COALESCE(t.approved, 0), COALESCE(t.rejected, 0), "
+                "COALESCE(d.submitted, 0), COALESCE(d.approved, 0), COALESCE(d.rejected, 0) "
+                "FROM servers s "
+                "LEFT JOIN moderation_counters t ON t.server_id = s.id AND t.day = '*' "
+                "LEFT JOIN moderation_counters d ON d.server_id = s.id AND d.day = date('now') "
+                "ORDER BY s.id"
+            )
+            return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении статистики серверов: %s", e)
+            raise
+
+    async def rebuild_moderation_counters(self, archive_path: Optional[str] = None) -> int:
+        # Пересчитывает счётчики по объявлениям (и архиву, если он есть) и
+        # возвращает расхождение: сумму модулей разниц итоговых значений
+        def _totals():
+            self.cursor.execute(
+                "SELECT server_id, submitted, pending, approved, rejected FROM moderation_counters WHERE day = '*'"
+            )
+            return {row[0]: row[1:] for row in self.cursor.fetchall()}
+
+        def _query():
+            tables = ("main.advertisements",)
+            if archive_path and os.path.exists(archive_path):
+                self._attach_archive(archive_path)
+                tables += ("archive.advertisements",)
+            try:
+                with self.conn:
+                    before = _totals()
+                    rebuild_moderation_counters(self.cursor, tables)
+                    after = _totals()
+            finally:
+                self._detach_archive()
+
+            empty = (0, 0, 0, 0)
+            return sum(
+                abs(a - b)
+                for server_id in before.keys() | after.keys()
+                for a, b in zip(before.get(server_id, empty), after.get(server_id, empty))
+            )
+
+        try:
+            drift = await self._run(_query)
+            logger.info("Счётчики модерации пересчитаны, расхождение: %s", drift)
+            return drift
+        except Exception as e:
+            logger.error("Ошибка при пересчёте счётчиков модерации: %s", e)
+            raise
+
+    async def moderate_pending_advertisements(
+        self,
+        server_id: int,
+        status: str,
+        limit: int = 500,
+        jobs: Iterable[Tuple[str, int]] = (),
+        schedule: Iterable[ScheduleEntry] = (),
+    ) -> List[Ad]:
+        # Переводит до `limit` ожидающих объявлений сервера в `status` одной
+        # транзакцией (вместе с заданиями `jobs` и отложенными действиями
+        # `schedule` для каждого) и возвращает их
+        def _query():
+            # Выборка и смена статуса — одно выражение, поэтому объявление,
+            # которое параллельно одобрил другой модератор или процесс, сюда
+            # не попадёт
+            with self.conn:
+                self.cursor.execute(
+                    "UPDATE advertisements SET status = ? "
+                    "WHERE id IN (SELECT id FROM advertisements WHERE server_id = ? AND status = 'pending' "
+                    "ORDER BY created_at, id LIMIT ?) AND status = 'pending' "
+                    f"RETURNING {AD_COLUMNS}",
+                    (status, server_id, limit)
+                )
+                ads = sorted(map(Ad._make, self.cursor.fetchall()))
+                self._insert_ad_jobs([ad.id for ad in ads], jobs)
+                self._insert_schedule([ad.id for ad in ads], schedule)
+            return ads
+
+        try:
+            ads = await self._run(_query)
+            logger.info("Статус %s объявлений сервера %s обновлен на %s", len(ads), server_id, status)
+            return ads
+        except Exception as e:
+            logger.error("Ошибка при массовой модерации объявлений сервера %s: %s", server_id, e)
+            raise
+
+    async def search_advertisements(
+        self,
+        match: str,
+        status: str = "approved",
+        server_id: Optional[int] = None,
+        after: Optional[Tuple[float, int]] = None,
+        limit: int = 5,
+    ) -> List[Tuple]:
+        # Поиск по FTS5 с ранжированием bm25. Пагинация keyset по паре
+        # (rank, id): after — значения последней строки предыдущей страницы.
+        # Одобренные объявления ищутся только среди тех, что сейчас в канале:
+        # отложенные статус получают сразу, а снятые его сохраняют.
+        # Возвращает (id, server_id, название сервера, фрагмент текста, rank)
+        after_rank, after_id = after if after else (float("-inf"), 0)
+
+        def _query():
+            self.cursor.execute(
+                "SELECT a.id, a.server_id, s.name, "
+                "snippet(advertisements_fts, 0, '', '', '…', 16), advertisements_fts.rank "
+                "FROM advertisements_fts "
+                "JOIN advertisements a ON a.id = advertisements_fts.rowid "
+                "JOIN servers s ON s.id = a.server_id "
+                "WHERE advertisements_fts MATCH ? AND a.status = ? AND (? IS NULL OR a.server_id = ?) "
+                "AND (a.status != 'approved' OR a.channel_message_ids IS NOT NULL AND a.expired_at IS NULL) "
+                "AND (advertisements_fts.rank > ? OR (advertisements_fts.rank = ? AND a.id > ?)) "
+                "ORDER BY advertisements_fts.rank, a.id LIMIT ?",
+                (match, status, server_id, server_id, after_rank, after_rank, after_id, limit)
+            )
+            return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при поиске объявлений по запросу %r: %s", match, e)
+            raise
+
+    async def get_advertisement(self, ad_id: int) -> Optional[Ad]:
+        def _query():
+            self.cursor.execute(f"SELECT {AD_COLUMNS} FROM advertisements WHERE id = ?", (ad_id,))
+            row = self.cursor.fetchone()
+            return Ad._make(row) if row else None
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении объявления %s: %s", ad_id, e)
+            raise
+
+    async def get_advertisement_photos(self, ad_ids: Iterable[int]) -> Dict[int, List[str]]:
+        # file_id всех фото объявлений по порядку, одним запросом на пачку
+        def _query():
+            self.cursor.execute(
+                "SELECT ad_id, file_id FROM advertisement_photos "
+                "WHERE ad_id IN (SELECT value FROM json_each(?)) ORDER BY ad_id, position",
+                (json.dumps(list(ad_ids)),)
+            )
+            photos: Dict[int, List[str]] = {}
+            for ad_id, file_id in self.cursor.fetchall():
+                photos.setdefault(ad_id, []).append(file_id)
+            return photos
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении фото объявлений: %s", e)
+            raise
+
+    async def add_schedule(self, ad_id: int, entries: Iterable[ScheduleEntry]):
+        def _write():
+            self._insert_schedule([ad_id], entries)
+
+        try:
+            await self._submit(_write, urgent=True)
+        except Exception as e:
+            logger.error("Ошибка при планировании действий с объявлением %s: %s", ad_id, e)
+            raise
+
+    async def cancel_schedule(self, ad_id: int, kind: str) -> int:
+        def _write():
+            self.cursor.execute(
+                "UPDATE schedule SET status = 'cancelled' WHERE ad_id = ? AND kind = ? AND status = 'pending'",
+                (ad_id, kind)
+            )
+            return self.cursor.rowcount
+
+        try:
+            return await self._submit(_write, urgent=True)
+        except Exception as e:
+            logger.error("Ошибка при отмене действий %s с объявлением %s: %s", kind, ad_id, e)
+            raise
+
+    async def get_schedule_times(self) -> List[float]:
+        # Время срабатывания всех ожидающих действий — только по частичному
+        # индексу, без чтения самой таблицы
+        def _query():
+            self.cursor.execute("SELECT run_at FROM schedule WHERE status = 'pending'")
+            return [row[0] for row in self.cursor.fetchall()]
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при загрузке расписания: %s", e)
+            raise
+
+    async def fire_schedule(
+        self, now: float, jobs: Dict[str, Iterable[Tuple[str, int]]], limit: int = 100
+    ) -> List[Tuple[str, Optional[float]]]:
+        # Одной транзакцией: до `limit` наступивших действий ставят свои задания
+        # (jobs: вид действия -> задания) и переходят на следующее срабатывание
+        # или в 'done'. Пропущенные, пока бот не работал, повторы не
+        # догоняются — следующее срабатывание отсчитывается от `now`.
+        # Возвращает (вид, время следующего срабатывания или None)
+        def _query():
+            with self.conn:
+                self.cursor.execute(
+                    "UPDATE schedule SET repeats = repeats - 1, run_at = MAX(run_at, ?) + interval, "
+                    "status = CASE WHEN repeats > 1 THEN 'pending' ELSE 'done' END "
+                    "WHERE id IN (SELECT id FROM schedule WHERE status = 'pending' AND run_at <= ? "
+                    "ORDER BY run_at LIMIT ?) "
+                    "RETURNING id, ad_id, kind, run_at, repeats, status",
+                    (now, now, limit)
+                )
+                fired = []
+                for schedule_id, ad_id, kind, run_at, repeats, status in self.cursor.fetchall():
+                    self._insert_ad_jobs([ad_id], jobs.get(kind, ()), f"@{schedule_id}.{repeats}")
+                    fired.append((kind, run_at if status == "pending" else None))
+                return fired
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при запуске отложенных действий: %s", e)
+            raise
+
+    def is_admin(self, user_id: int) -> bool:
+        # Проверка идёт по кэшу ролей; по истечении TTL кэш перечитывается
+        # в фоне, а текущий вызов отвечает по уже загруженным данным
+        if self.roles.is_stale():
+            self._schedule_roles_reload()
+        return self.roles.is_admin(user_id)
+
+    def _schedule_roles_reload(self):
+        if self._roles_reload_task is None or self._roles_reload_task.done():
+            self._roles_reload_task = asyncio.create_task(self.reload_roles())
+
+    async def reload_roles(self):
+        def _query():
+            self.cursor.execute("SELECT id FROM users WHERE role = 'admin'")
+            return [row[0] for row in self.cursor.fetchall()]
+
+        try:
+            self.roles.load(await self._run(_query))
+        except Exception as e:
+            logger.error("Ошибка при загрузке ролей пользователей: %s", e)
+            raise
+
+    async def get_user_role(self, user_id: int):
+        def _query():
+            self.cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+            return self.cursor.fetchone()
+
+        result = await self._run(_query)
+        return result[0] if result else "user"
+
+    async def get_user(self, user_id: int) -> Tuple:
+        def _query():
+            self.cursor.execute("SELECT id, username, full_name, role FROM users WHERE id = ?", (user_id,))
+            return self.cursor.fetchone()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении пользователя %s: %s", user_id, e)
+            raise
+
+    async def get_active_user_ids(self, after_id: int = 0, limit: int = 500) -> List[int]:
+        # Keyset-пагинация по первичному ключу: страница — `limit` активных
+        # пользователей с id > after_id, без OFFSET и без чтения всей таблицы
+        def _query():
+            self.cursor.execute(
+                "SELECT id FROM users WHERE id > ? AND is_active = 1 ORDER BY id LIMIT ?",
+                (after_id, limit)
+            )
+            return [row[0] for row in self.cursor.fetchall()]
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении пользователей после %s: %s", after_id, e)
+            raise
+
+    async def create_broadcast(self, admin_chat_id: int, progress_message_id: int, text: str) -> Broadcast:
+        def _query():
+            with self.conn:
+                self.cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
+                total = self.cursor.fetchone()[0]
+                self.cursor.execute(
+                    "INSERT INTO broadcasts (admin_chat_id, progress_message_id, text, total) VALUES (?, ?, ?, ?) "
+                    f"RETURNING {BROADCAST_COLUMNS}",
+                    (admin_chat_id, progress_message_id, text, total)
+                )
+                return Broadcast._make(self.cursor.fetchone())
+
+        try:
+            broadcast = await self._run(_query)
+            logger.info("Создана рассылка %s на %s пользователей", broadcast.id, broadcast.total)
+            return broadcast
+        except Exception as e:
+            logger.error("Ошибка при создании рассылки: %s", e)
+            raise
+
+    async def get_running_broadcasts(self) -> List[Broadcast]:
+        def _query():
+            self.cursor.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return [Broadcast._make(row) for row in self.cursor.fetchall()]
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении незавершённых рассылок: %s", e)
+            raise
+
+    async def checkpoint_broadcast(
+        self, broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_ids: List[int]
+    ) -> Broadcast:
+        # Одна транзакция: контрольная точка, счётчики и отметка пользователей,
+        # заблокировавших бота. Возвращает рассылку с обновлёнными счётчиками
+        def _query():
+            with self.conn:
+                self.cursor.executemany("UPDATE users SET is_active = 0 WHERE id = ?", [(user_id,) for user_id in blocked_ids])
+                self.cursor.execute(
+                    "UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ? "
+                    f"WHERE id = ? RETURNING {BROADCAST_COLUMNS}",
+                    (last_user_id, sent, failed, len(blocked_ids), broadcast_id)
+                )
+                return Broadcast._make(self.cursor.fetchone())
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при сохранении прогресса рассылки %s: %s", broadcast_id, e)
+            raise
+
+    async def finish_broadcast(self, broadcast_id: int, status: str = "done"):
+        def _query():
+            self.cursor.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+                (status, broadcast_id)
             )
             self.conn.commit()
-            logging.info(f"Обновлен статус объявления {ad_id} на {status}")
+
+        try:
+            await self._run(_query)
+            logger.info("Рассылка %s завершена со статусом %s", broadcast_id, status)
         except Exception as e:
-            logging.error(f"Ошибка при обновлении статуса объявления {ad_id}: {e}")
+            logger.error("Ошибка при завершении рассылки %s: %s", broadcast_id, e)
             raise
 
-    def get_advertisement(self, ad_id: int) -> Tuple:
+    async def set_user_role(self, user_id: int, role: str):
+        def _query():
+            self.cursor.execute("UPDATE users SET role = ? WHERE id = ?", (role, user_id))
+            self.conn.commit()
+
         try:
-            self.cursor.execute("SELECT * FROM advertisements WHERE id = ?", (ad_id,))
+            await self._run(_query)
+            self.roles.set_role(user_id, role)
+            logger.info("Пользователю %s назначена роль %s", user_id, role)
+        except Exception as e:
+            logger.error("Ошибка при изменении роли пользователя %s: %s", user_id, e)
+            raise
+
+    async def get_fsm_record(self, key: str) -> Optional[Tuple]:
+        def _query():
+            self.cursor.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (key,))
             return self.cursor.fetchone()
+
+        try:
+            return await self._run(_query)
         except Exception as e:
-            logging.error(f"Ошибка при получении объявления {ad_id}: {e}")
+            logger.error("Ошибка при чтении состояния FSM %s: %s", key, e)
             raise
 
-    @staticmethod
-    def is_admin(user_id: int) -> bool:
-        db = Database()
-        role = db.get_user_role(user_id)
-        db.close()
-        return role == "admin"
+    async def save_fsm_records(self, upserts: List[Tuple], deletes: List[str]):
+        # Накопленные изменения FSM пишутся одной транзакцией
+        def _query():
+            with self.conn:
+                self.cursor.executemany(
+                    "INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts
+                )
+                self.cursor.executemany("DELETE FROM fsm_storage WHERE key = ?", [(key,) for key in deletes])
 
-    def get_user_role(self, user_id: int):
-        self.cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        result = self.cursor.fetchone()
-        return result[0] if result else "user"
+        try:
+            await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при сохранении состояний FSM: %s", e)
+            raise
+
+    async def delete_expired_fsm_records(self, updated_before: float) -> int:
+        def _query():
+            with self.conn:
+                self.cursor.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (updated_before,))
+                return self.cursor.rowcount
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при удалении устаревших состояний FSM: %s", e)
+            raise
+
+    def _attach_archive(self, archive_path: str) -> List[str]:
+        # Подключает архивную базу как схему `archive` и приводит таблицу
+        # archive.advertisements к текущему набору колонок основной таблицы
+        # (колонки добавляются миграциями — архив догоняет их сам). Возвращает
+        # список колонок для копирования
+        self.cursor.execute("PRAGMA database_list")
+        if "archive" not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            self.cursor.execute("PRAGMA archive.journal_mode=WAL")
+            self.cursor.fetchall()
+
+        self.cursor.execute("PRAGMA main.table_info(advertisements)")
+        columns = [(row[1], row[2]) for row in self.cursor.fetchall()]
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS archive.advertisements ("
+            "id INTEGER PRIMARY KEY, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        self.cursor.execute("PRAGMA archive.table_info(advertisements)")
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for name, column_type in columns:
+            if name not in existing:
+                self.cursor.execute(f'ALTER TABLE archive.advertisements ADD COLUMN "{name}" {column_type}')
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS archive.advertisement_photos ("
+            "ad_id INTEGER NOT NULL, position INTEGER NOT NULL, file_id TEXT NOT NULL, file_unique_id TEXT, "
+            "PRIMARY KEY (ad_id, position)) WITHOUT ROWID"
+        )
+        return [name for name, _ in columns]
 
+    async def archive_advertisements(self, archive_path: str, created_before: float, limit: int = 500) -> int:
+        # Переносит до `limit` одобренных и отклонённых объявлений, поданных
+        # раньше `created_before` (unix-время), в архивную базу. Одна пачка —
+        # одна короткая транзакция, между пачками поток БД свободен для других
+        # запросов. Копирование идемпотентно (INSERT OR IGNORE по id), поэтому
+        # сбой между фиксацией архива и основной базы лишь повторит пачку
+        def _query():
+            columns = ", ".join(f'"{name}"' for name in self._attach_archive(archive_path))
+            with self.conn:
+                self.cursor.execute(
+                    "SELECT id FROM main.advertisements "
+                    "WHERE status IN ('approved', 'rejected') AND created_at < datetime(?, 'unixepoch') "
+                    "ORDER BY created_at LIMIT ?",
+                    (created_before, limit)
+                )
+                ids = json.dumps([row[0] for row in self.cursor.fetchall()])
+                self.cursor.execute(
+                    f"INSERT OR IGNORE INTO archive.advertisements ({columns}) "
+                    f"SELECT {columns} FROM main.advertisements WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids,)
+                )
+                # Фото из основной базы удалит ON DELETE CASCADE
+                self.cursor.execute(
+                    "INSERT OR IGNORE INTO archive.advertisement_photos (ad_id, position, file_id, file_unique_id) "
+                    "SELECT ad_id, position, file_id, file_unique_id FROM main.advertisement_photos "
+                    "WHERE ad_id IN (SELECT value FROM json_each(?))",
+                    (ids,)
+                )
+                self.cursor.execute(
+                    "DELETE FROM main.advertisements WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+                )
+                return self.cursor.rowcount
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при архивации объявлений: %s", e)
+            raise
+
+    def _detach_archive(self):
+        self.cursor.execute("PRAGMA database_list")
+        if "archive" in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute("DETACH DATABASE archive")
+
+    async def detach_archive(self):
+        try:
+            await self._run(self._detach_archive)
+        except Exception as e:
+            logger.error("Ошибка при отключении архивной базы: %s", e)
+            raise
+
+    async def get_storage_stats(self) -> Tuple[int, int, int, int]:
+        # (страниц в файле, свободных страниц, размер страницы, режим auto_vacuum)
+        def _query():
+            stats = []
+            for pragma in ("page_count", "freelist_count", "page_size", "auto_vacuum"):
+                self.cursor.execute(f"PRAGMA {pragma}")
+                stats.append(self.cursor.fetchone()[0])
+            return tuple(stats)
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении статистики файла базы данных: %s", e)
+            raise
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        # Возвращает до `pages` свободных страниц файловой системе (нужен
+        # auto_vacuum=INCREMENTAL); результат — сколько страниц освобождено
+        def _query():
+            self.cursor.execute("PRAGMA freelist_count")
+            before = self.cursor.fetchone()[0]
+            # Прагма освобождает по странице за шаг, а execute() для выражений
+            # без колонок делает только один шаг — executescript выполняет до конца
+            self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            self.cursor.execute("PRAGMA freelist_count")
+            return before - self.cursor.fetchone()[0]
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при incremental vacuum: %s", e)
+            raise
+
+    async def enable_incremental_vacuum(self):
+        # auto_vacuum меняется только полным VACUUM: операция разовая и на
+        # время выполнения блокирует базу
+        def _query():
+            self.cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.cursor.execute("VACUUM")
+
+        try:
+            await self._run(_query)
+            logger.info("Включён режим auto_vacuum=INCREMENTAL")
+        except Exception as e:
+            logger.error("Ошибка при включении incremental vacuum: %s", e)
+            raise
+
+    async def claim_jobs(
+        self, owner: str, limit: int, lease_seconds: float, kinds: Optional[Iterable[str]] = None
+    ) -> List[Tuple]:
+        # Берёт в аренду до `limit` готовых заданий и заданий, чья аренда
+        # истекла (исполнитель упал), одним UPDATE ... RETURNING — два процесса
+        # не получат одно задание. kinds — только задания этих видов (None — любые).
+        # Возвращает (id, kind, payload, attempts)
+        kinds_json = json.dumps(list(kinds)) if kinds is not None else None
+
+        def _query():
+            now = time.time()
+            with self.conn:
+                self.cursor.execute(
+                    "UPDATE jobs SET status = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE id IN (SELECT id FROM ("
+                    "SELECT id, kind, priority, run_at FROM jobs WHERE status = 'pending' AND run_at <= ? "
+                    "UNION ALL "
+                    "SELECT id, kind, priority, run_at FROM jobs WHERE status = 'running' AND lease_until < ?"
+                    ") WHERE ? IS NULL OR kind IN (SELECT value FROM json_each(?)) "
+                    "ORDER BY priority, run_at LIMIT ?) "
+                    "RETURNING id, kind, payload, attempts",
+                    (owner, now + lease_seconds, now, now, kinds_json, kinds_json, limit)
+                )
+                return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при получении заданий из очереди: %s", e)
+            raise
+
+    async def extend_job_leases(self, owner: str, job_ids: List[int], lease_seconds: float):
+        def _query():
+            with self.conn:
+                self.cursor.executemany(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                    [(time.time() + lease_seconds, job_id, owner) for job_id in job_ids]
+                )
 
-    def close(self):
         try:
-            self.conn.close()
-            logging.info("Соединение с базой данных закрыто")
+            await self._run(_query)
         except Exception as e:
-            logging.error(f"Ошибка при закрытии соединения с базой данных: {e}")
-            raise
\ No newline at end of file
+            logger.error("Ошибка при продлении аренды заданий: %s", e)
+            raise
+
+    async def complete_jobs(
+        self,
+        owner: str,
+        job_ids: List[int],
+        message_ids: Optional[Dict[int, List[int]]] = None,
+        expired: Iterable[int] = ()
+    ):
+        # Итог задания записывается в объявления в той же транзакции, что и
+        # отметка о выполнении: message_ids — сообщения публикации в канале
+        # {id объявления: [id сообщений]}, expired — снятые объявления.
+        # Иначе после падения между записями задание повторилось бы или
+        # публикация осталась бы без сообщений, по которым её снимают
+        def _query():
+            now = time.time()
+            with self.conn:
+                if message_ids:
+                    self.cursor.executemany(
+                        "UPDATE advertisements SET channel_message_ids = ? WHERE id = ?",
+                        [(json.dumps(ids), ad_id) for ad_id, ids in message_ids.items()]
+                    )
+                if expired:
+                    self.cursor.execute(
+                        "UPDATE advertisements SET expired_at = CURRENT_TIMESTAMP "
+                        "WHERE id IN (SELECT value FROM json_each(?)) AND expired_at IS NULL",
+                        (json.dumps(list(expired)),)
+                    )
+                self.cursor.executemany(
+                    "UPDATE jobs SET status = 'done', finished_at = ?, lease_owner = NULL, lease_until = NULL "
+                    "WHERE id = ? AND lease_owner = ?",
+                    [(now, job_id, owner) for job_id in job_ids]
+                )
+
+        try:
+            await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при завершении заданий: %s", e)
+            raise
+
+    async def fail_jobs(self, owner: str, job_ids: List[int], error: str, retry_at: Optional[float]):
+        # retry_at=None — задание больше не повторяется
+        def _query():
+            with self.conn:
+                self.cursor.executemany(
+                    "UPDATE jobs SET status = ?, run_at = COALESCE(?, run_at), last_error = ?, "
+                    "finished_at = CASE WHEN ? IS NULL THEN ? END, lease_owner = NULL, lease_until = NULL "
+                    "WHERE id = ? AND lease_owner = ?",
+                    [
+                        ("failed" if retry_at is None else "pending", retry_at, error, retry_at, time.time(), job_id, owner)
+                        for job_id in job_ids
+                    ]
+                )
+
+        try:
+            await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при записи неудачи заданий %s: %s", job_ids, e)
+            raise
+
+    async def get_job_counts(self) -> List[Tuple]:
+        # (вид, статус, количество)
+        def _query():
+            self.cursor.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status")
+            return self.cursor.fetchall()
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при подсчёте заданий: %s", e)
+            raise
+
+    async def delete_finished_jobs(self, finished_before: float) -> int:
+        # Выполненные задания хранятся какое-то время, чтобы ключ
+        # идемпотентности отсекал повторную постановку
+        def _query():
+            with self.conn:
+                self.cursor.execute(
+                    "DELETE FROM jobs WHERE status = 'done' AND finished_at < ?", (finished_before,)
+                )
+                return self.cursor.rowcount
+
+        try:
+            return await self._run(_query)
+        except Exception as e:
+            logger.error("Ошибка при удалении выполненных заданий: %s", e)
+            raise
+
+    async def close(self):
+        # Сначала фиксируются отложенные записи
+        await self.writes.flush()
+
+        def _close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+        try:
+            await self._run(_close)
+            self._executor.shutdown(wait=True)
+            logger.info("Соединение с базой данных закрыто")
+        except Exception as e:
+            logger.error("Ошибка при закрытии соединения с базой данных: %s", e)
+            raise
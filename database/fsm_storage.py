@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    # FSM-хранилище черновиков в той же SQLite-базе (таблица fsm_storage).
+    # Перед диском — небольшой LRU-кэш горячих ключей. Изменения копятся в
+    # памяти и пишутся одной транзакцией раз в `flush_delay` секунд, так что
+    # последовательные update_data/set_state одного шага FSM дают одну запись.
+    # Черновики, не менявшиеся дольше `ttl`, считаются брошенными и удаляются
+    # фоновой очисткой.
+    def __init__(
+        self,
+        db: Database,
+        ttl: float = 24 * 60 * 60,
+        cache_size: int = 1000,
+        flush_delay: float = 1.0,
+        sweep_interval: float = 10 * 60,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+        self.sweep_interval = sweep_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # Текущая запись в базу; close() её дожидается, а не отменяет
+        self._flushing: Optional[asyncio.Future] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    def _is_expired(self, record: _Record, now: float) -> bool:
+        return bool(record.updated_at) and now - record.updated_at > self.ttl
+
+    def _remember(self, key: str, record: _Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        # Вытесненные грязные записи остаются в self._dirty до ближайшего сброса
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            record = self._dirty.get(key)
+            if record is None:
+                row = await self.db.get_fsm_record(key)
+                # Пока шёл запрос, другой апдейт мог загрузить или изменить
+                # этот ключ — тогда его запись новее прочитанной из базы
+                record = self._cache.get(key) or self._dirty.get(key)
+                if record is None:
+                    record = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record()
+            self._remember(key, record)
+
+        if self._is_expired(record, time.time()):
+            record = _Record()
+            self._remember(key, record)
+        return record
+
+    def _touch(self, key: str, record: _Record):
+        record.updated_at = time.time()
+        self._remember(key, record)
+        self._dirty[key] = record
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Сбрасывает, пока есть изменения: и пришедшие во время записи, и
+        # возвращённые в очередь после ошибки
+        while self._dirty:
+            await asyncio.sleep(self.flush_delay)
+            self._flushing = asyncio.ensure_future(self.flush())
+            try:
+                await asyncio.shield(self._flushing)
+            except Exception as e:
+                logger.error("Ошибка при сохранении черновиков FSM, повтор через %s с: %s", self.flush_delay, e)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [
+            (key, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at)
+            for key, record in dirty.items()
+            if not record.is_empty()
+        ]
+        deletes = [key for key, record in dirty.items() if record.is_empty()]
+        try:
+            await self.db.save_fsm_records(upserts, deletes)
+        except BaseException:
+            # Не теряем изменения, в том числе при отмене: вернём их в очередь,
+            # если их не перезаписали
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                now = time.time()
+                for key in [key for key, record in self._cache.items() if self._is_expired(record, now)]:
+                    del self._cache[key]
+                removed = await self.db.delete_expired_fsm_records(now - self.ttl)
+                if removed:
+                    logger.info("Удалено брошенных черновиков FSM: %s", removed)
+            except Exception as e:
+                logger.error("Ошибка при очистке FSM-хранилища: %s", e)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self._key(key)
+        record = await self._load(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self._key(key)
+        record = await self._load(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(self._key(key))).data.copy()
+
+    async def close(self) -> None:
+        for task in (self._sweep_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+        # Начатая запись доводится до конца; при ошибке её изменения уже
+        # вернулись в очередь и уйдут последним сбросом
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
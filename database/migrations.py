@@ -0,0 +1,340 @@
+import sqlite3
+import logging
+from typing import Callable, List, Optional, Tuple, Union
+
+from dedup import text_hash
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции — SQL-выражение или функция, получающая курсор
+Step = Union[str, Callable[[sqlite3.Cursor], None]]
+
+
+def _backfill_fingerprints(cursor: sqlite3.Cursor, batch_size: int = 1000):
+    # Только дешёвый хэш текста, пачками: миграция держит блокировку записи.
+    # MinHash старых объявлений не сохраняется — его для окна поиска
+    # дубликатов считает Database.get_recent_fingerprints
+    rows = cursor.connection.cursor()
+    rows.execute("SELECT id, text FROM advertisements")
+    while batch := rows.fetchmany(batch_size):
+        cursor.executemany(
+            "UPDATE advertisements SET text_hash = ? WHERE id = ?",
+            [(text_hash(text), ad_id) for ad_id, text in batch]
+        )
+
+
+def rebuild_moderation_counters(cursor: sqlite3.Cursor, tables: Tuple[str, ...] = ("main.advertisements",)):
+    # Пересчитывает moderation_counters с нуля по объявлениям из `tables`
+    # (основная таблица и, если подключён, архив)
+    source = " UNION ALL ".join(
+        f"SELECT server_id, status, created_at, moderated_at FROM {table}" for table in tables
+    )
+    cursor.execute("DELETE FROM moderation_counters")
+    cursor.execute(
+        "INSERT INTO moderation_counters (server_id, day, submitted, pending, approved, rejected) "
+        "SELECT server_id, '*', COUNT(*), SUM(status = 'pending'), SUM(status = 'approved'), SUM(status = 'rejected') "
+        f"FROM ({source}) GROUP BY server_id"
+    )
+    cursor.execute(
+        "INSERT INTO moderation_counters (server_id, day, submitted) "
+        f"SELECT server_id, date(created_at), COUNT(*) FROM ({source}) GROUP BY 1, 2"
+    )
+    cursor.execute(
+        "INSERT INTO moderation_counters (server_id, day, approved, rejected) "
+        "SELECT server_id, date(COALESCE(moderated_at, created_at)), SUM(status = 'approved'), SUM(status = 'rejected') "
+        f"FROM ({source}) WHERE status IN ('approved', 'rejected') GROUP BY 1, 2 "
+        "ON CONFLICT (server_id, day) DO UPDATE SET approved = excluded.approved, rejected = excluded.rejected"
+    )
+
+
+# Версионированные миграции схемы. Применяются по порядку один раз при старте
+# (main.py), номер последней применённой версии хранится в schema_version.
+# Уже выпущенные миграции не редактируются — изменения схемы добавляются
+# новой записью в конец списка.
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "Базовые таблицы", [
+        # Таблица для серверов/каналов
+        """
+        CREATE TABLE IF NOT EXISTS servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            moderation_group_id TEXT NOT NULL
+        )
+        """,
+        # Таблица для объявлений
+        """
+        CREATE TABLE IF NOT EXISTS advertisements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            photo_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (server_id) REFERENCES servers (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            role TEXT DEFAULT 'user'
+        )
+        """,
+    ]),
+    (2, "Индексы для выборок объявлений и ролей", [
+        # Очередь модерации: WHERE status = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_ads_status_created ON advertisements (status, created_at)",
+        # История пользователя: WHERE user_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_ads_user_created ON advertisements (user_id, created_at)",
+        # Статистика и очередь по серверу: WHERE server_id = ? [AND status = ?];
+        # заодно покрывает проверку внешнего ключа server_id
+        "CREATE INDEX IF NOT EXISTS idx_ads_server_status_created ON advertisements (server_id, status, created_at)",
+        # Загрузка кэша ролей: WHERE role = 'admin'
+        "CREATE INDEX IF NOT EXISTS idx_users_admins ON users (id) WHERE role = 'admin'",
+    ]),
+    (3, "Хранилище FSM для черновиков объявлений", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)",
+    ]),
+    (4, "Полнотекстовый индекс FTS5 по тексту объявлений", [
+        # External content: текст хранится только в advertisements, индекс
+        # синхронизируется триггерами
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS advertisements_fts USING fts5(
+            text,
+            content='advertisements',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS advertisements_fts_insert AFTER INSERT ON advertisements BEGIN
+            INSERT INTO advertisements_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS advertisements_fts_delete AFTER DELETE ON advertisements BEGIN
+            INSERT INTO advertisements_fts (advertisements_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS advertisements_fts_update AFTER UPDATE OF text ON advertisements BEGIN
+            INSERT INTO advertisements_fts (advertisements_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO advertisements_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        # Индексируем уже существующие объявления
+        "INSERT INTO advertisements_fts (advertisements_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Отпечатки объявлений для поиска дубликатов", [
+        "ALTER TABLE advertisements ADD COLUMN text_hash INTEGER",
+        # Подпись dedup.minhash (BLOB)
+        "ALTER TABLE advertisements ADD COLUMN minhash BLOB",
+        "ALTER TABLE advertisements ADD COLUMN photo_unique_id TEXT",
+        # file_unique_id у старых объявлений неизвестен — считаем только текст
+        _backfill_fingerprints,
+    ]),
+    (6, "Очередь заданий с арендой для процессов-обработчиков", [
+        # Побочные эффекты (пересылка на модерацию, публикация, уведомления)
+        # ставятся сюда в одной транзакции со сменой статуса объявления и
+        # выполняются jobs.JobWorker. idempotency_key не даёт поставить одно и
+        # то же задание дважды; lease_owner/lease_until — аренда исполнителя
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            idempotency_key TEXT NOT NULL UNIQUE,
+            priority INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+        """,
+        # Выборка готовых заданий и заданий с истёкшей арендой
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_at) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (lease_until) WHERE status = 'running'",
+    ]),
+    (7, "Счётчики модерации по серверам и дням", [
+        "ALTER TABLE advertisements ADD COLUMN moderated_at TIMESTAMP",
+        # Время модерации старых объявлений неизвестно — считаем по дате подачи
+        "UPDATE advertisements SET moderated_at = created_at WHERE status != 'pending'",
+        # day = '*' — итоги по серверу: submitted и approved/rejected за всё
+        # время, pending — текущая очередь. Строки с датой (UTC) — сколько
+        # подано и промодерировано за день. Поддерживаются триггерами в той же
+        # транзакции, что и изменение объявления; удаление (архивация) их не
+        # меняет, так что статистика включает архив
+        """
+        CREATE TABLE IF NOT EXISTS moderation_counters (
+            server_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            submitted INTEGER NOT NULL DEFAULT 0,
+            pending INTEGER NOT NULL DEFAULT 0,
+            approved INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (server_id, day)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS moderation_counters_insert AFTER INSERT ON advertisements BEGIN
+            INSERT INTO moderation_counters (server_id, day, submitted, pending, approved, rejected) VALUES
+                (new.server_id, '*', 1, new.status = 'pending', new.status = 'approved', new.status = 'rejected'),
+                (new.server_id, date(new.created_at), 1, 0, 0, 0)
+            ON CONFLICT (server_id, day) DO UPDATE SET
+                submitted = submitted + excluded.submitted,
+                pending = pending + excluded.pending,
+                approved = approved + excluded.approved,
+                rejected = rejected + excluded.rejected;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS moderation_counters_update AFTER UPDATE OF status ON advertisements
+        WHEN old.status IS NOT new.status BEGIN
+            UPDATE advertisements SET moderated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+            INSERT INTO moderation_counters (server_id, day, submitted, pending, approved, rejected) VALUES
+                (
+                    new.server_id, '*', 0,
+                    (new.status = 'pending') - (old.status = 'pending'),
+                    (new.status = 'approved') - (old.status = 'approved'),
+                    (new.status = 'rejected') - (old.status = 'rejected')
+                ),
+                (new.server_id, date('now'), 0, 0, new.status = 'approved', new.status = 'rejected')
+            ON CONFLICT (server_id, day) DO UPDATE SET
+                pending = pending + excluded.pending,
+                approved = approved + excluded.approved,
+                rejected = rejected + excluded.rejected;
+        END
+        """,
+        rebuild_moderation_counters,
+    ]),
+    (8, "Фото объявлений (альбомы)", [
+        # Все фото объявления по порядку; advertisements.photo_id остаётся
+        # первым фото (обложкой) для поиска, выгрузки и объявлений из одного фото
+        """
+        CREATE TABLE IF NOT EXISTS advertisement_photos (
+            ad_id INTEGER NOT NULL REFERENCES advertisements (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            PRIMARY KEY (ad_id, position)
+        ) WITHOUT ROWID
+        """,
+        "INSERT OR IGNORE INTO advertisement_photos (ad_id, position, file_id, file_unique_id) "
+        "SELECT id, 0, photo_id, photo_unique_id FROM advertisements WHERE photo_id IS NOT NULL",
+    ]),
+    (9, "Рассылки с контрольными точками", [
+        # 0 — пользователь заблокировал бота, рассылки его пропускают до нового /start
+        "ALTER TABLE users ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1",
+        # last_user_id — контрольная точка: все пользователи с id не больше
+        # неё уже обработаны, после перезапуска рассылка продолжается с неё
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            progress_message_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+    ]),
+    (10, "Отложенная публикация, истечение и поднятие объявлений", [
+        # id сообщений публикации в канале (JSON-список) — их удаляет или
+        # помечает истечение и заменяет поднятие; expired_at — когда снято
+        "ALTER TABLE advertisements ADD COLUMN channel_message_ids TEXT",
+        "ALTER TABLE advertisements ADD COLUMN expired_at TIMESTAMP",
+        # Отложенные действия (scheduler.Scheduler): run_at — unix-время
+        # следующего срабатывания; повторяющееся действие (поднятие)
+        # срабатывает repeats раз с шагом interval секунд
+        """
+        CREATE TABLE IF NOT EXISTS schedule (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ad_id INTEGER NOT NULL REFERENCES advertisements (id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            run_at REAL NOT NULL,
+            interval REAL NOT NULL DEFAULT 0,
+            repeats INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Только ожидающие действия: индекс не растёт с историей, по нему
+        # таймеры загружаются при старте и выбираются сработавшие
+        "CREATE INDEX IF NOT EXISTS idx_schedule_pending ON schedule (run_at) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_schedule_ad ON schedule (ad_id)",
+    ]),
+]
+
+
+def get_schema_version(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    # Каждая миграция выполняется в своей транзакции вместе с записью в
+    # schema_version: при ошибке схема остаётся на предыдущей версии
+    cursor = conn.cursor()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        version = get_schema_version(cursor)
+        for number, description, steps in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (number, description)
+                )
+                cursor.execute("COMMIT")
+            except Exception as e:
+                cursor.execute("ROLLBACK")
+                logger.error("Ошибка при применении миграции %s (%s): %s", number, description, e)
+                raise
+            version = number
+            logger.info("Применена миграция %s: %s", number, description)
+
+        # Внешние ключи включаются на каждом соединении; здесь только
+        # сообщаем о строках, нарушавших их до включения проверки
+        cursor.execute("PRAGMA foreign_key_check")
+        violations = cursor.fetchall()
+        if violations:
+            logger.warning("Найдено строк с нарушением внешних ключей: %s", len(violations))
+        return version
+    finally:
+        conn.isolation_level = isolation_level
@@ -0,0 +1,54 @@
+import json
+from typing import List, NamedTuple, Optional
+
+
+# Строки, которые Database возвращает хендлерам и фоновым задачам. Запросы
+# выбирают ровно эти колонки (см. *_COLUMNS), а вызывающий код обращается к
+# полям по имени, а не по индексу — добавление колонки в таблицу ничего не
+# сдвигает.
+class Ad(NamedTuple):
+    id: int
+    user_id: int
+    server_id: int
+    text: str
+    photo_id: Optional[str]
+    status: str
+    channel_message_ids: Optional[str]
+    expired_at: Optional[str]
+
+    @property
+    def message_ids(self) -> List[int]:
+        # Сообщения публикации в канале (пусто, если ещё не опубликовано)
+        return json.loads(self.channel_message_ids) if self.channel_message_ids else []
+
+
+class Server(NamedTuple):
+    id: int
+    name: str
+    channel_id: str
+    moderation_group_id: str
+
+
+class Broadcast(NamedTuple):
+    id: int
+    admin_chat_id: int
+    progress_message_id: int
+    text: str
+    last_user_id: int
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+
+
+# Отложенное действие с объявлением при постановке (таблица schedule)
+class ScheduleEntry(NamedTuple):
+    kind: str
+    run_at: float
+    interval: float = 0
+    repeats: int = 1
+
+
+AD_COLUMNS = ", ".join(Ad._fields)
+SERVER_COLUMNS = ", ".join(Server._fields)
+BROADCAST_COLUMNS = ", ".join(Broadcast._fields)
@@ -0,0 +1,29 @@
+import time
+from typing import Iterable
+
+
+class RoleCache:
+    # Кэш ролей на весь процесс: администраторы из БД плюс config.ADMIN_IDS.
+    # Проверка — поиск в множестве без обращения к БД. Изменения ролей
+    # применяются явно через set_role, TTL — страховка от расхождения с БД.
+    def __init__(self, static_admin_ids: Iterable[int] = (), ttl: float = 300.0):
+        self._static_admin_ids = frozenset(static_admin_ids)
+        self._admin_ids = set(self._static_admin_ids)
+        self.ttl = ttl
+        self._loaded_at = 0.0
+
+    def load(self, admin_ids: Iterable[int]):
+        self._admin_ids = set(self._static_admin_ids).union(admin_ids)
+        self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self._admin_ids
+
+    def set_role(self, user_id: int, role: str):
+        if role == "admin":
+            self._admin_ids.add(user_id)
+        elif user_id not in self._static_admin_ids:
+            self._admin_ids.discard(user_id)
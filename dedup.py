@@ -0,0 +1,170 @@
+import hashlib
+import heapq
+import re
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Deque, NamedTuple, Optional, Set, Tuple
+
+from metrics import DUPLICATE_ADS
+
+# Поиск повторно поданных объявлений. У каждого объявления считается отпечаток:
+# хэш нормализованного текста (точный повтор), MinHash-подпись множества
+# символьных 4-грамм (повтор с мелкими правками — цена, опечатки, знаки
+# препинания) и file_unique_id фото (то же фото, даже пересжатое клиентом).
+# Подпись — bottom-k: MINHASH_SIZE наименьших 64-битных хэшей 4-грамм, по
+# одному хэшу на 4-грамму. По двум подписям оценивается коэффициент Жаккара
+# их 4-грамм, и, в отличие от расстояния между SimHash, оценка не зависит от
+# длины текста: правка цены в коротком объявлении меняет лишь несколько
+# 4-грамм. Подпись считается по первым MAX_SHINGLED_CHARS символам
+# нормализованного текста, так что её цена ограничена и для длинных текстов.
+# Новое объявление сравнивается с недавними объявлениями того же
+# пользователя на том же сервере. Они держатся в памяти (ограниченный LRU по
+# парам пользователь/сервер), а при промахе подгружаются из БД, поэтому
+# проверка переживает перезапуск бота.
+
+_WORD_RE = re.compile(r"\w+")
+
+SHINGLE_SIZE = 4
+MINHASH_SIZE = 64
+MAX_SHINGLED_CHARS = 500
+
+
+class Fingerprint(NamedTuple):
+    text_hash: int
+    minhash: bytes
+    photo_unique_id: Optional[str]
+
+
+def _signed(value: int) -> int:
+    # SQLite хранит INTEGER как знаковое 64-битное число
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+def shingles(normalized: str) -> Set[str]:
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash(normalized: str) -> bytes:
+    # Подпись — наименьшие хэши 4-грамм по возрастанию (у короткого текста
+    # их может быть меньше MINHASH_SIZE)
+    hashes = {_hash64(shingle) for shingle in shingles(normalized[:MAX_SHINGLED_CHARS])}
+    values = heapq.nsmallest(MINHASH_SIZE, hashes)
+    return struct.pack(f"<{len(values)}Q", *values)
+
+
+def _unpack(signature: bytes) -> Set[int]:
+    return set(struct.unpack(f"<{len(signature) // 8}Q", signature))
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    # Оценка коэффициента Жаккара: какая доля MINHASH_SIZE наименьших хэшей
+    # объединения есть в обеих подписях. Если у обоих текстов 4-грамм меньше
+    # MINHASH_SIZE, это точный коэффициент
+    first, second = _unpack(a), _unpack(b)
+    union = heapq.nsmallest(MINHASH_SIZE, first | second)
+    if not union:
+        return 0.0
+    shared = first & second
+    return sum(value in shared for value in union) / len(union)
+
+
+def text_hash(text: str) -> int:
+    # Хэш точного повтора — без MinHash, для массового пересчёта
+    return _signed(_hash64(normalize_text(text or "")))
+
+
+def fingerprint(text: str, photo_unique_id: Optional[str] = None) -> Fingerprint:
+    normalized = normalize_text(text or "")
+    return Fingerprint(_signed(_hash64(normalized)), minhash(normalized), photo_unique_id)
+
+
+# (id объявления, время подачи, отпечаток)
+_Entry = Tuple[int, float, Fingerprint]
+
+
+class DuplicateDetector:
+    def __init__(
+        self,
+        db,
+        window_days: float = 7,
+        min_similarity: float = 0.7,
+        per_key: int = 20,
+        max_keys: int = 10000,
+    ):
+        self.db = db
+        self.window = window_days * 24 * 60 * 60
+        self.min_similarity = min_similarity
+        self.per_key = per_key
+        self.max_keys = max_keys
+        self._recent: "OrderedDict[Tuple[int, int], Deque[_Entry]]" = OrderedDict()
+
+    async def _entries(self, user_id: int, server_id: int) -> Deque[_Entry]:
+        key = (user_id, server_id)
+        entries = self._recent.get(key)
+        if entries is not None:
+            self._recent.move_to_end(key)
+            return entries
+
+        rows = await self.db.get_recent_fingerprints(user_id, server_id, time.time() - self.window, self.per_key)
+        # Из БД строки приходят от новых к старым, в памяти храним по порядку подачи
+        entries = deque(
+            ((ad_id, created_at, Fingerprint(text_hash, signature, photo)) for ad_id, created_at, text_hash, signature, photo in reversed(rows)),
+            maxlen=self.per_key,
+        )
+        self._store(key, entries)
+        return entries
+
+    def _store(self, key: Tuple[int, int], entries: Deque[_Entry]):
+        self._recent[key] = entries
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_keys:
+            self._recent.popitem(last=False)
+
+    def _match(self, new: Fingerprint, old: Fingerprint) -> Optional[str]:
+        if new.photo_unique_id and new.photo_unique_id == old.photo_unique_id:
+            return "photo"
+        if new.text_hash == old.text_hash:
+            return "exact"
+        if old.minhash is not None and similarity(new.minhash, old.minhash) >= self.min_similarity:
+            return "near"
+        return None
+
+    async def find_duplicate(self, user_id: int, server_id: int, fp: Fingerprint) -> Optional[int]:
+        # Возвращает id недавнего объявления, повтором которого является новое
+        # Отклонённые объявления повтором не считаются: автор подаёт
+        # исправленный вариант. Из БД они не загружаются, а у объявлений из
+        # памяти статус проверяется только при совпадении
+        entries = await self._entries(user_id, server_id)
+        since = time.time() - self.window
+        for ad_id, created_at, old in reversed(entries):
+            if created_at < since:
+                break
+            kind = self._match(fp, old)
+            if kind and not await self._is_rejected(ad_id):
+                DUPLICATE_ADS.inc(kind)
+                return ad_id
+        return None
+
+    async def _is_rejected(self, ad_id: int) -> bool:
+        ad = await self.db.get_advertisement(ad_id)
+        return ad is None or ad.status == "rejected"
+
+    def remember(self, user_id: int, server_id: int, ad_id: int, fp: Fingerprint):
+        key = (user_id, server_id)
+        entries = self._recent.get(key)
+        if entries is None:
+            # Если ключа нет в памяти, его история подгрузится из БД при следующей проверке
+            return
+        entries.append((ad_id, time.time(), fp))
+        self._recent.move_to_end(key)
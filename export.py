@@ -0,0 +1,173 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Выгружаемые таблицы: имя в команде -> (таблица, колонки)
+TABLES = {
+    "ads": ("advertisements", ("id", "user_id", "server_id", "text", "photo_id", "status", "created_at", "moderated_at")),
+    "users": ("users", ("id", "username", "full_name", "role", "is_active")),
+}
+FORMATS = ("csv", "jsonl")
+STATUSES = ("pending", "approved", "rejected")
+
+# Строк за один fetchmany и строк на один блок записи в gzip
+EXPORT_BATCH_SIZE = 1000
+
+USAGE = (
+    "📤 Выгрузка: /export <ads|users> [csv|jsonl] [фильтры]\n\n"
+    "Фильтры для ads: server:<id> status:<pending|approved|rejected> "
+    "from:<ГГГГ-ММ-ДД> to:<ГГГГ-ММ-ДД>\n"
+    "Например: /export ads csv server:2 status:approved from:2024-01-01"
+)
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+class ExportQuery(NamedTuple):
+    table: str
+    fmt: str = "csv"
+    server_id: Optional[int] = None
+    status: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+    @property
+    def filename(self) -> str:
+        return f"{self.table}.{self.fmt}.gz"
+
+
+def parse_export_args(text: str) -> ExportQuery:
+    # Разбор аргументов /export; при ошибке — ValueError с текстом для пользователя
+    tokens = text.split()
+    if not tokens or tokens[0] not in TABLES:
+        raise ValueError(USAGE)
+
+    query = ExportQuery(tokens[0])
+    for token in tokens[1:]:
+        key, _, value = token.partition(":")
+        if token in FORMATS:
+            query = query._replace(fmt=token)
+        elif key == "server" and value.isdigit():
+            query = query._replace(server_id=int(value))
+        elif key == "status" and value in STATUSES:
+            query = query._replace(status=value)
+        elif key in ("from", "to") and _DATE.fullmatch(value):
+            query = query._replace(**{"date_from" if key == "from" else "date_to": value})
+        else:
+            raise ValueError(f"Непонятный параметр: {token}\n\n{USAGE}")
+
+    if query.table != "ads" and (query.server_id or query.status or query.date_from or query.date_to):
+        raise ValueError(f"Фильтры поддерживаются только для ads\n\n{USAGE}")
+    return query
+
+
+def build_select(query: ExportQuery) -> Tuple[Sequence[str], str, list]:
+    table, columns = TABLES[query.table]
+    conditions, params = [], []
+    if query.server_id is not None:
+        conditions.append("server_id = ?")
+        params.append(query.server_id)
+    if query.status is not None:
+        conditions.append("status = ?")
+        params.append(query.status)
+    if query.date_from is not None:
+        conditions.append("created_at >= ?")
+        params.append(query.date_from)
+    if query.date_to is not None:
+        # Дата «по» включительно
+        conditions.append("created_at < date(?, '+1 day')")
+        params.append(query.date_to)
+
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return columns, sql + " ORDER BY id", params
+
+
+def iter_rows(cursor: sqlite3.Cursor, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[tuple]:
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+class _Buffer:
+    # Приёмник для csv.writer: строки копятся в список и отдаются блоками
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    def take(self) -> str:
+        chunk = "".join(self.parts)
+        self.parts.clear()
+        return chunk
+
+
+def encode_csv(columns: Sequence[str], rows: Iterable[tuple], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.take()
+    yield buffer.take()
+
+
+def encode_jsonl(columns: Sequence[str], rows: Iterable[tuple], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        if len(lines) >= batch_size:
+            yield "".join(lines)
+            lines.clear()
+    yield "".join(lines)
+
+
+ENCODERS = {"csv": encode_csv, "jsonl": encode_jsonl}
+
+
+def write_export(db_path: str, query: ExportQuery, path: str) -> int:
+    # Конвейер генераторов: курсор (fetchmany) -> кодирование в CSV/JSONL ->
+    # gzip на диск. В памяти одновременно не больше одного блока строк, при
+    # любом размере таблицы. Читает отдельное соединение только на чтение:
+    # в WAL-режиме оно видит согласованный снимок и не занимает поток
+    # основного соединения бота. Возвращает число выгруженных строк.
+    columns, sql, params = build_select(query)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(sql, params)
+        count = 0
+
+        def counted(rows: Iterable[tuple]) -> Iterator[tuple]:
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        with gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="") as file:
+            for chunk in ENCODERS[query.fmt](columns, counted(iter_rows(cursor))):
+                file.write(chunk)
+        return count
+    finally:
+        conn.close()
+
+
+async def export_table(db_path: str, query: ExportQuery) -> Tuple[str, int]:
+    # Выгрузка во временный файл в отдельном потоке; файл удаляет вызывающий
+    fd, path = tempfile.mkstemp(suffix=f".{query.fmt}.gz")
+    os.close(fd)
+    try:
+        return path, await asyncio.to_thread(write_export, db_path, query, path)
+    except BaseException:
+        os.remove(path)
+        raise
@@ -1,11 +1,15 @@
-from aiogram import Router, types
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import F
 from database.db import Database
-import config
+from dedup import DuplicateDetector, fingerprint
+from jobs import ON_APPROVE, ON_REJECT, ON_SUBMIT
+from metrics import MODERATION_CONFLICTS
+from scheduler import Scheduler
+from typing import Dict, List, Optional, Set, Tuple
 
 router = Router()
 
@@ -16,11 +20,31 @@ class UserStates(StatesGroup):
     CONFIRM_PHOTO_OPTION = State()
 
 
-def get_main_menu(user_id: int) -> ReplyKeyboardMarkup:
+# Больше фото Telegram не пропустит в один альбом
+MAX_PHOTOS = 10
+
+# Параметры пагинации списка серверов
+SERVERS_PER_PAGE = 5
+SERVERS_KEYBOARD_CACHE_SIZE = 256
+
+# Ответ на повторную подачу того же объявления (см. dedup.DuplicateDetector)
+DUPLICATE_MESSAGE = (
+    "⚠️ Такое объявление (#{ad_id}) вы уже подавали на этот сервер недавно — "
+    "повторная подача не нужна."
+)
+
+# Объявления, решение по которым сейчас записывается (защита от двойного нажатия)
+_moderating: Set[int] = set()
+
+# Кэш клавиатур выбора сервера: (версия списка серверов, якорь страницы) -> клавиатура
+_servers_keyboards: Dict[Tuple[int, int], InlineKeyboardMarkup] = {}
+
+
+def get_main_menu(db: Database, user_id: int) -> ReplyKeyboardMarkup:
     base_buttons = [[KeyboardButton(text="📝 Создать объявление")]]
 
-    # Проверяем, является ли пользователь администратором
-    if Database.is_admin(user_id) or user_id in config.ADMIN_IDS:
+    # Проверяем, является ли пользователь администратором (по кэшу ролей)
+    if db.is_admin(user_id):
         base_buttons.append([KeyboardButton(text="🛠 Админ-панель")])
 
     return ReplyKeyboardMarkup(
@@ -29,68 +53,73 @@ def get_main_menu(user_id: int) -> ReplyKeyboardMarkup:
     )
 
 @router.message(Command("start"))
-async def start(message: Message, state: FSMContext):
-    db = Database()
-    db.add_user_if_not_exists(
+async def start(message: Message, state: FSMContext, db: Database):
+    await db.add_user_if_not_exists(
         user_id=message.from_user.id,
         username=message.from_user.username,
         full_name=message.from_user.full_name
     )
-    db.close()
 
     await state.clear()
     await message.answer(
         "👋 Добро пожаловать в *BLACK russia Б/У РЫНОК*\n\n"
         "🛍️ *SellVibe* — бот для быстрой подачи объявлений!\n\n"
         "✍️ Подавай объявление, лови хороший вайб! Нажми кнопку ниже ⬇️",
-        reply_markup=get_main_menu(message.from_user.id),
+        reply_markup=get_main_menu(db, message.from_user.id),
         parse_mode="Markdown"
     )
 
 @router.message(F.text == "📝 Создать объявление")
-async def create_advertisement_entry(message: Message, state: FSMContext):
+async def create_advertisement_entry(message: Message, state: FSMContext, db: Database):
     await message.answer(
         "Выберите сервер для размещения объявления:",
-        reply_markup=await get_servers_keyboard()
+        reply_markup=await get_servers_keyboard(db)
     )
     await state.set_state(UserStates.WAITING_FOR_SERVER)
 
-async def get_servers_keyboard(page=0):
-    db = Database()
-    servers = db.get_servers()
-    db.close()
+async def get_servers_keyboard(db: Database, after_id: int = 0) -> InlineKeyboardMarkup:
+    # Готовые клавиатуры кэшируются по якорю страницы; при добавлении сервера
+    # меняется db.servers_version и кэш сбрасывается
+    if _servers_keyboards and (
+        next(iter(_servers_keyboards))[0] != db.servers_version
+        or len(_servers_keyboards) >= SERVERS_KEYBOARD_CACHE_SIZE
+    ):
+        _servers_keyboards.clear()
 
-    # Параметры пагинации
-    servers_per_page = 5
-    start = page * servers_per_page
-    end = start + servers_per_page
-    paged_servers = servers[start:end]
+    key = (db.servers_version, after_id)
+    keyboard = _servers_keyboards.get(key)
+    if keyboard is not None:
+        return keyboard
+
+    servers, has_next, prev_after_id = await db.get_servers_page(after_id, SERVERS_PER_PAGE)
 
     # Кнопки для серверов
     buttons = [
         [InlineKeyboardButton(text=name, callback_data=f"server_{server_id}")]
-        for server_id, name in paged_servers
+        for server_id, name in servers
     ]
 
-    # Кнопки для переключения страниц
+    # Кнопки для переключения страниц (в callback — id последнего сервера предыдущей страницы)
     pagination_buttons = []
-    if page > 0:
-        pagination_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page_{page - 1}"))
-    if end < len(servers):
-        pagination_buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"page_{page + 1}"))
+    if prev_after_id is not None:
+        pagination_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page_{prev_after_id}"))
+    if has_next and servers:
+        pagination_buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"page_{servers[-1][0]}"))
 
     # Добавление кнопок пагинации
     if pagination_buttons:
         buttons.append(pagination_buttons)
 
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    _servers_keyboards[key] = keyboard
+    return keyboard
 
 @router.callback_query(F.data.startswith("server_"))
 async def process_server_selection(callback: CallbackQuery, state: FSMContext):
     server_id = int(callback.data.split("_")[1])
     await state.update_data(server_id=server_id)
     await callback.message.answer(
-        "✍️ Отправьте текст объявления (и только *одно* фото после этого).\n\nЕсли хотите отменить — нажмите кнопку ниже.",
+        "✍️ Отправьте текст объявления (фото — после этого, одно или альбомом до 10 штук).\n\nЕсли хотите отменить — нажмите кнопку ниже.",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
             InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")
         ]]),
@@ -113,89 +142,85 @@ async def process_text(message: Message, state: FSMContext):
 
 @router.callback_query(F.data == "add_photo")
 async def handle_add_photo(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("📸 Отправьте *фото* для объявления", parse_mode="Markdown")
+    await callback.message.edit_text("📸 Отправьте *фото* для объявления (можно альбомом)", parse_mode="Markdown")
     await state.set_state(UserStates.WAITING_FOR_PHOTO)
 
 @router.message(UserStates.WAITING_FOR_PHOTO, F.photo)
-async def process_photo(message: Message, state: FSMContext):
+async def process_photo(
+    message: Message,
+    state: FSMContext,
+    db: Database,
+    duplicates: DuplicateDetector,
+    album: Optional[List[Message]] = None,
+):
     data = await state.get_data()
     if 'text' not in data or 'server_id' not in data:
         await message.answer("❗ Что-то пошло не так. Начните заново командой /start.")
         await state.clear()
         return
 
-    photo_id = message.photo[-1].file_id
+    # Альбом приходит одним вызовом (albums.AlbumMiddleware), все части — в album
+    photos = [(m.photo[-1].file_id, m.photo[-1].file_unique_id) for m in album or [message] if m.photo][:MAX_PHOTOS]
+    fp = fingerprint(data['text'], photos[0][1])
 
-    db = Database()
     try:
-        ad_id = db.add_advertisement(
+        duplicate_id = await duplicates.find_duplicate(message.from_user.id, data['server_id'], fp)
+        if duplicate_id:
+            await message.answer(DUPLICATE_MESSAGE.format(ad_id=duplicate_id), reply_markup=get_main_menu(db, message.from_user.id))
+            return
+
+        # Пересылка в группу модерации ставится в очередь заданий вместе с объявлением
+        ad_id = await db.add_advertisement(
             user_id=message.from_user.id,
             server_id=data['server_id'],
             text=data['text'],
-            photo_id=photo_id
+            photos=photos,
+            fingerprint=fp,
+            jobs=ON_SUBMIT
         )
+        duplicates.remember(message.from_user.id, data['server_id'], ad_id, fp)
 
-        server = db.get_server(data['server_id'])
-        moderation_group_id = server[3]
-
-        await message.bot.send_photo(
-            chat_id=moderation_group_id,
-            photo=photo_id,
-            caption=f"Новое объявление #{ad_id}\n\n{data['text']}",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad_id}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{ad_id}")
-            ]])
-        )
-
-        await message.answer("✅ Ваше объявление отправлено на модерацию!", reply_markup=get_main_menu(message.from_user.id))
+        await message.answer("✅ Ваше объявление отправлено на модерацию!", reply_markup=get_main_menu(db, message.from_user.id))
     finally:
-        db.close()
         await state.clear()
 
 @router.callback_query(F.data.startswith("page_"))
-async def handle_page_navigation(callback: CallbackQuery):
-    page = int(callback.data.split("_")[1])
+async def handle_page_navigation(callback: CallbackQuery, db: Database):
+    after_id = int(callback.data.split("_")[1])
     await callback.message.edit_text(
         "Выберите сервер для размещения объявления:",
-        reply_markup=await get_servers_keyboard(page)
+        reply_markup=await get_servers_keyboard(db, after_id)
     )
 
 
 @router.callback_query(F.data == "no_photo")
-async def handle_no_photo(callback: CallbackQuery, state: FSMContext):
+async def handle_no_photo(callback: CallbackQuery, state: FSMContext, db: Database, duplicates: DuplicateDetector):
     data = await state.get_data()
     if 'text' not in data or 'server_id' not in data:
         await callback.message.answer("❗ Что-то пошло не так. Начните заново командой /start.")
         await state.clear()
         return
 
-    db = Database()
+    fp = fingerprint(data['text'])
+
     try:
-        ad_id = db.add_advertisement(
+        duplicate_id = await duplicates.find_duplicate(callback.from_user.id, data['server_id'], fp)
+        if duplicate_id:
+            await callback.message.answer(DUPLICATE_MESSAGE.format(ad_id=duplicate_id), reply_markup=get_main_menu(db, callback.from_user.id))
+            return
+
+        ad_id = await db.add_advertisement(
             user_id=callback.from_user.id,
             server_id=data['server_id'],
             text=data['text'],
-            photo_id=None  # <- Без фото
-        )
-
-        server = db.get_server(data['server_id'])
-        moderation_group_id = server[3]
-
-        await callback.bot.send_message(
-            chat_id=moderation_group_id,
-            text=f"Новое объявление #{ad_id}\n\n{data['text']}",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad_id}"),
-                    InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{ad_id}")
-                ]
-            ])
+            photo_id=None,  # <- Без фото
+            fingerprint=fp,
+            jobs=ON_SUBMIT
         )
+        duplicates.remember(callback.from_user.id, data['server_id'], ad_id, fp)
 
-        await callback.message.answer("✅ Ваше объявление отправлено на модерацию!", reply_markup=get_main_menu(callback.from_user.id))
+        await callback.message.answer("✅ Ваше объявление отправлено на модерацию!", reply_markup=get_main_menu(db, callback.from_user.id))
     finally:
-        db.close()
         await state.clear()
 
 
@@ -204,61 +229,41 @@ async def cancel_advertisement(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text("❌ Создание объявления отменено")
 
-@router.callback_query(F.data.startswith("approve_"))
-async def approve_advertisement(callback: CallbackQuery):
+async def _moderate(callback: CallbackQuery, db: Database, status: str, jobs, schedule=()) -> bool:
+    # Переход pending -> status. Повторное нажатие, пока первое ещё
+    # обрабатывается, отсекается по множеству объявлений «в работе» без
+    # обращения к БД; проигравший гонку (статус уже сменил другой модератор)
+    # получает только ответ на callback
     ad_id = int(callback.data.split("_")[1])
-    db = Database()
+    if ad_id in _moderating:
+        MODERATION_CONFLICTS.inc("in_flight")
+        await callback.answer("Объявление уже обрабатывается")
+        return False
+
+    _moderating.add(ad_id)
     try:
-        ad = db.get_advertisement(ad_id)
-        if ad:
-            server = db.get_server(ad[2])
-            channel_id = server[2]
-
-            photo_id = ad[4]
-            caption = ad[3]
-
-            if photo_id:
-                await callback.bot.send_photo(
-                    chat_id=channel_id,
-                    photo=photo_id,
-                    caption=caption
-                )
-            else:
-                await callback.bot.send_message(
-                    chat_id=channel_id,
-                    text=caption
-                )
-
-            db.update_advertisement_status(ad_id, "approved")
-
-            await callback.bot.send_message(
-                chat_id=ad[1],
-                text="✅ Ваше объявление было *одобрено* и опубликовано!",
-                parse_mode="Markdown"
-            )
-
-            await callback.message.answer("Объявление одобрено и опубликовано ✅")
-            await callback.message.delete()
+        if not await db.update_advertisement_status(ad_id, status, jobs=jobs, schedule=schedule):
+            MODERATION_CONFLICTS.inc("already_moderated")
+            await callback.answer("Объявление уже промодерировано")
+            return False
     finally:
-        db.close()
+        _moderating.discard(ad_id)
+    return True
+
+
+@router.callback_query(F.data.startswith("approve_"))
+async def approve_advertisement(callback: CallbackQuery, db: Database, scheduler: Scheduler):
+    # Публикация в канале и уведомление автора выполняются очередью заданий;
+    # они и истечение публикации ставятся в той же транзакции, что и смена статуса
+    expiry = scheduler.expiry()
+    if await _moderate(callback, db, "approved", ON_APPROVE, expiry):
+        scheduler.notify(expiry)
+        await callback.message.answer("Объявление одобрено и поставлено в очередь на публикацию ✅")
+        await callback.message.delete()
 
 
 @router.callback_query(F.data.startswith("reject_"))
-async def reject_advertisement(callback: CallbackQuery):
-    ad_id = int(callback.data.split("_")[1])
-    db = Database()
-    try:
-        ad = db.get_advertisement(ad_id)
-        if ad:
-            db.update_advertisement_status(ad_id, "rejected")
-
-            await callback.bot.send_message(
-                chat_id=ad[1],
-                text="❌ Ваше объявление было *отклонено* модератором.",
-                parse_mode="Markdown"
-            )
-
-            await callback.message.edit_text("Объявление отклонено")
-            await callback.message.delete()
-    finally:
-        db.close()
+async def reject_advertisement(callback: CallbackQuery, db: Database):
+    if await _moderate(callback, db, "rejected", ON_REJECT):
+        await callback.message.edit_text("Объявление отклонено")
+        await callback.message.delete()
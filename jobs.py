@@ -0,0 +1,362 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import DeleteMessage, EditMessageCaption, EditMessageText, SendMediaGroup, SendMessage, SendPhoto
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, Message
+
+from database.db import Database
+from database.models import Ad, Server
+from metrics import JOBS_PROCESSED
+from sender import OutboundQueue, Priority
+
+logger = logging.getLogger(__name__)
+
+# Виды заданий. Все они привязаны к объявлению (payload {"ad_id": ...,
+# "message_ids": [...]}), ключ идемпотентности — "<вид>:<id объявления>"
+MODERATION_FORWARD = "moderation_forward"
+PUBLISH = "publish"
+NOTIFY = "notify"
+EXPIRE = "expire"
+BUMP = "bump"
+
+# Задания, которые ставятся вместе со сменой статуса объявления: (вид, приоритет)
+ON_SUBMIT = ((MODERATION_FORWARD, Priority.MODERATION),)
+ON_APPROVE = ((PUBLISH, Priority.MODERATION), (NOTIFY, Priority.NOTIFICATION))
+ON_REJECT = ((NOTIFY, Priority.NOTIFICATION),)
+# Задания отложенных действий (scheduler.Scheduler). Истечение и поднятие
+# отправляются с приоритетом BULK: накопившиеся срабатывания не задерживают
+# модерацию, а лимит канала в OutboundQueue не даёт залить канал
+ON_EXPIRE = ((EXPIRE, Priority.BULK),)
+ON_BUMP = ((BUMP, Priority.BULK),)
+
+# Задания, которые отправляют только в личные чаты. Остальные уходят в группы
+# и каналы, а их лимит соблюдает OutboundQueue одного процесса, поэтому из
+# нескольких процессов (worker.py) все виды берёт только один
+PRIVATE_JOBS = (NOTIFY,)
+
+NOTIFICATIONS = {
+    "approved": "✅ Ваше объявление было *одобрено* и опубликовано!",
+    "rejected": "❌ Ваше объявление было *отклонено* модератором.",
+}
+
+# Сколько фото в одном альбоме при публикации
+ALBUM_SIZE = 10
+
+# Как снимать публикацию по истечении: "delete" — удалить сообщения (Bot API
+# удаляет только сообщения моложе 48 часов, более старые помечаются),
+# "mark" — дописать пометку в начало текста
+EXPIRE_DELETE = "delete"
+EXPIRE_MARK = "mark"
+EXPIRED_LABEL = "⌛️ Объявление неактуально"
+
+
+def moderation_keyboard(ad_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad_id}"),
+        InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{ad_id}")
+    ]])
+
+
+def album_media(photos: List[str], caption: str) -> List[InputMediaPhoto]:
+    # Подпись у первого фото — Telegram показывает её под альбомом
+    return [
+        InputMediaPhoto(media=file_id, caption=caption if position == 0 else None)
+        for position, file_id in enumerate(photos[:ALBUM_SIZE])
+    ]
+
+
+def publish_advertisements(
+    sender: OutboundQueue,
+    channel_id: str,
+    ads: List[Ad],
+    photos: Optional[Dict[int, List[str]]] = None,
+    priority: Priority = Priority.MODERATION,
+) -> List[Tuple[List[int], asyncio.Future]]:
+    # Объявление-альбом (несколько фото в photos) публикуется своим альбомом
+    # одним запросом. Объявления с одним фото собираются в общие альбомы по
+    # ALBUM_SIZE (подпись — у каждого фото), текстовые — отдельными сообщениями.
+    # Возвращает (id объявлений, future отправки) для каждого запроса
+    photos = photos or {}
+    sent = []
+    for ad in ads:
+        if len(photos.get(ad.id, ())) > 1:
+            method = SendMediaGroup(chat_id=channel_id, media=album_media(photos[ad.id], ad.text))
+            sent.append(([ad.id], sender.send(method, priority=priority)))
+
+    with_photo = [ad for ad in ads if ad.photo_id and len(photos.get(ad.id, ())) <= 1]
+    for start in range(0, len(with_photo), ALBUM_SIZE):
+        chunk = with_photo[start:start + ALBUM_SIZE]
+        if len(chunk) == 1:
+            method = SendPhoto(chat_id=channel_id, photo=chunk[0].photo_id, caption=chunk[0].text)
+        else:
+            method = SendMediaGroup(
+                chat_id=channel_id,
+                media=[InputMediaPhoto(media=ad.photo_id, caption=ad.text) for ad in chunk]
+            )
+        sent.append(([ad.id for ad in chunk], sender.send(method, priority=priority)))
+
+    for ad in ads:
+        if not ad.photo_id:
+            sent.append(([ad.id], sender.send(SendMessage(chat_id=channel_id, text=ad.text), priority=priority)))
+    return sent
+
+
+def published_message_ids(ad_ids: List[int], result: Union[Message, List[Message]]) -> Dict[int, List[int]]:
+    # Сопоставляет ответ публикации объявлениям: альбом одного объявления —
+    # все сообщения его, общий альбом — по сообщению на объявление по порядку
+    messages = result if isinstance(result, list) else [result]
+    if len(ad_ids) == 1:
+        return {ad_ids[0]: [message.message_id for message in messages]}
+    return {ad_id: [message.message_id] for ad_id, message in zip(ad_ids, messages)}
+
+
+async def _delete_posts(sender: OutboundQueue, channel_id: str, message_ids: List[int]) -> bool:
+    # True, если удалены все сообщения
+    results = await asyncio.gather(
+        *[sender.send(DeleteMessage(chat_id=channel_id, message_id=message_id), priority=Priority.BULK) for message_id in message_ids],
+        return_exceptions=True
+    )
+    return not any(isinstance(result, Exception) for result in results)
+
+
+async def _expire_post(sender: OutboundQueue, channel_id: str, ad: Ad, mode: str):
+    if mode == EXPIRE_DELETE and await _delete_posts(sender, channel_id, ad.message_ids):
+        return
+
+    # Подпись (или текст) — у первого сообщения публикации
+    text = f"{EXPIRED_LABEL}\n\n{ad.text}"
+    if ad.photo_id:
+        method = EditMessageCaption(chat_id=channel_id, message_id=ad.message_ids[0], caption=text)
+    else:
+        method = EditMessageText(chat_id=channel_id, message_id=ad.message_ids[0], text=text)
+    try:
+        await sender.send(method, priority=Priority.BULK)
+    except TelegramBadRequest as e:
+        # Сообщение уже удалено из канала вручную — снимать нечего
+        logger.warning("Не удалось пометить публикацию объявления %s: %s", ad.id, e)
+
+
+async def _forward_album(sender: OutboundQueue, chat_id: str, ad_id: int, photos: List[str], caption: str):
+    # К альбому нельзя прикрепить кнопки — они уходят следующим сообщением,
+    # строго после альбома
+    await sender.send(SendMediaGroup(chat_id=chat_id, media=album_media(photos, caption)), priority=Priority.MODERATION)
+    await sender.send(
+        SendMessage(chat_id=chat_id, text=f"Решение по объявлению #{ad_id} ⬆️", reply_markup=moderation_keyboard(ad_id)),
+        priority=Priority.MODERATION
+    )
+
+
+class JobWorker:
+    # Исполнитель очереди заданий (таблица jobs). Берёт пачку заданий в аренду
+    # на lease_seconds и продлевает её, пока работает (heartbeat). Если процесс
+    # упал, аренда истекает и задания забирает другой исполнитель — доставка
+    # «как минимум один раз». Повторную постановку отсекает ключ
+    # идемпотентности. Статус объявления отсекает только устаревшие задания
+    # (на модерацию уходит только ожидающее, публикуется только одобренное),
+    # но не повтор задания, выполненного до падения: публикация и поднятие
+    # пропускаются, если сообщения публикации уже не те, что были при
+    # постановке задания (payload "message_ids").
+    # Несколько исполнителей (worker.py, по одному на процесс) работают с
+    # одной базой параллельно; kinds ограничивает виды заданий исполнителя
+    # (None — любые).
+    def __init__(
+        self,
+        db: Database,
+        sender: OutboundQueue,
+        owner: Optional[str] = None,
+        batch_size: int = 50,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        max_attempts: int = 10,
+        retention_days: float = 7,
+        expire_mode: str = EXPIRE_MARK,
+        kinds: Optional[Tuple[str, ...]] = None,
+    ):
+        self.db = db
+        self.sender = sender
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention = retention_days * 24 * 60 * 60
+        self.expire_mode = expire_mode
+        self.kinds = kinds
+        self._active: List[int] = []
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._loop())
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self, timeout: float = 30.0):
+        # Текущая пачка дорабатывается; если не успела — аренда истечёт и
+        # задания выполнит другой исполнитель
+        self._stopping.set()
+        for task in (self._task, self._heartbeat_task):
+            if task is None:
+                continue
+            try:
+                await asyncio.wait_for(task, timeout if task is self._task else 0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        self._task = self._heartbeat_task = None
+
+    async def _loop(self):
+        cleaned_at = 0.0
+        while not self._stopping.is_set():
+            try:
+                if time.time() - cleaned_at > 60 * 60:
+                    await self.db.delete_finished_jobs(time.time() - self.retention)
+                    cleaned_at = time.time()
+
+                jobs = await self.db.claim_jobs(self.owner, self.batch_size, self.lease_seconds, self.kinds)
+                if jobs:
+                    self._active = [job[0] for job in jobs]
+                    await self._process(jobs)
+                    self._active = []
+                    continue
+            except Exception as e:
+                logger.error("Ошибка исполнителя заданий %s: %s", self.owner, e)
+                self._active = []
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.lease_seconds / 3)
+            except asyncio.TimeoutError:
+                pass
+            if self._active:
+                try:
+                    await self.db.extend_job_leases(self.owner, list(self._active), self.lease_seconds)
+                except Exception as e:
+                    logger.error("Не удалось продлить аренду заданий: %s", e)
+
+    async def _process(self, jobs: List[Tuple]):
+        done: List[int] = []
+        publish: Dict[Tuple[str, str], List[Tuple[int, Ad]]] = defaultdict(list)
+        # (id заданий, вид, future отправки, id объявлений)
+        sent: List[Tuple[List[int], str, asyncio.Future, List[int]]] = []
+
+        loaded: List[Tuple[int, str, Ad]] = []
+        for job_id, kind, payload, attempts in jobs:
+            if attempts > self.max_attempts:
+                await self.db.fail_jobs(self.owner, [job_id], "превышено число попыток", None)
+                JOBS_PROCESSED.inc(kind, "failed")
+                continue
+
+            payload = json.loads(payload)
+            ad = await self.db.get_advertisement(payload["ad_id"])
+            if ad is None:
+                done.append(job_id)
+                continue
+            if kind in (PUBLISH, BUMP) and ad.message_ids != payload.get("message_ids", ad.message_ids):
+                # Задание уже выполнено, но процесс упал до complete_jobs:
+                # публикация в канале с тех пор сменилась
+                logger.info("Повтор задания %s для объявления %s пропущен: уже выполнено", kind, ad.id)
+                done.append(job_id)
+                continue
+            loaded.append((job_id, kind, ad))
+
+        # Фото альбомов — одним запросом на всю пачку
+        with_photo = {ad.id for _, kind, ad in loaded if ad.photo_id and kind in (MODERATION_FORWARD, PUBLISH, BUMP)}
+        photos = await self.db.get_advertisement_photos(with_photo) if with_photo else {}
+
+        for job_id, kind, ad in loaded:
+            # Серверы кэшируются в Database, повторного запроса на каждое задание нет
+            server: Server = await self.db.get_server(ad.server_id)
+
+            if kind == MODERATION_FORWARD and ad.status == "pending":
+                caption = f"Новое объявление #{ad.id}\n\n{ad.text}"
+                if len(photos.get(ad.id, ())) > 1:
+                    future = asyncio.ensure_future(_forward_album(self.sender, server.moderation_group_id, ad.id, photos[ad.id], caption))
+                else:
+                    if ad.photo_id:
+                        method = SendPhoto(chat_id=server.moderation_group_id, photo=ad.photo_id, caption=caption, reply_markup=moderation_keyboard(ad.id))
+                    else:
+                        method = SendMessage(chat_id=server.moderation_group_id, text=caption, reply_markup=moderation_keyboard(ad.id))
+                    future = self.sender.send(method, priority=Priority.MODERATION)
+                sent.append(([job_id], kind, future, [ad.id]))
+            elif kind == PUBLISH and ad.status == "approved" and not ad.message_ids or kind == BUMP and ad.status == "approved" and not ad.expired_at:
+                # Публикации собираются по каналам, чтобы фото ушли альбомами;
+                # поднятие — та же публикация заново
+                publish[(server.channel_id, kind)].append((job_id, ad))
+            elif kind == EXPIRE and ad.message_ids and not ad.expired_at:
+                future = asyncio.ensure_future(_expire_post(self.sender, server.channel_id, ad, self.expire_mode))
+                sent.append(([job_id], kind, future, [ad.id]))
+            elif kind == NOTIFY and ad.status in NOTIFICATIONS:
+                method = SendMessage(chat_id=ad.user_id, text=NOTIFICATIONS[ad.status], parse_mode="Markdown")
+                sent.append(([job_id], kind, self.sender.send(method, priority=Priority.NOTIFICATION), [ad.id]))
+            else:
+                # Объявление уже в другом статусе (например, промодерировано
+                # до пересылки) или неизвестный вид задания — делать нечего
+                done.append(job_id)
+
+        # Прежние сообщения поднятых объявлений удаляются после новой публикации
+        previous: Dict[int, Tuple[str, List[int]]] = {}
+        for (channel_id, kind), items in publish.items():
+            job_ids = {ad.id: job_id for job_id, ad in items}
+            priority = Priority.MODERATION if kind == PUBLISH else Priority.BULK
+            if kind == BUMP:
+                previous.update((ad.id, (channel_id, ad.message_ids)) for _, ad in items if ad.message_ids)
+            for ad_ids, future in publish_advertisements(self.sender, channel_id, [ad for _, ad in items], photos, priority):
+                sent.append(([job_ids[ad_id] for ad_id in ad_ids], kind, future, ad_ids))
+
+        if done:
+            await self.db.complete_jobs(self.owner, done)
+
+        # Задание отмечается выполненным сразу после ответа Bot API, не дожидаясь
+        # остальных запросов пачки, — так окно, в котором падение процесса
+        # приведёт к повторной отправке, минимально
+        attempts = {job[0]: job[3] for job in jobs}
+        replaced: List[Tuple[str, List[int]]] = []
+        for settled in asyncio.as_completed([_settle(item) for item in sent]):
+            (job_ids, kind, future, ad_ids), error = await settled
+            if error is None:
+                # Сообщения публикации и снятие сохраняются вместе с отметкой
+                # о выполнении. Если запись не удалась, задание повторится
+                # после истечения аренды
+                try:
+                    if kind in (PUBLISH, BUMP):
+                        await self.db.complete_jobs(self.owner, job_ids, message_ids=published_message_ids(ad_ids, future.result()))
+                    else:
+                        await self.db.complete_jobs(self.owner, job_ids, expired=ad_ids if kind == EXPIRE else ())
+                except Exception as e:
+                    logger.error("Не удалось сохранить результат задания %s для объявлений %s: %s", kind, ad_ids, e)
+                    continue
+                if kind == BUMP:
+                    replaced.extend(previous[ad_id] for ad_id in ad_ids if ad_id in previous)
+                JOBS_PROCESSED.inc(kind, "done", amount=len(job_ids))
+                continue
+
+            attempt = max(attempts[job_id] for job_id in job_ids)
+            retry_at = time.time() + min(5 * 2 ** attempt, 600) if attempt < self.max_attempts else None
+            logger.warning("Задание %s %s не выполнено (попытка %s): %s", kind, job_ids, attempt, error)
+            await self.db.fail_jobs(self.owner, job_ids, str(error), retry_at)
+            JOBS_PROCESSED.inc(kind, "retry" if retry_at else "failed", amount=len(job_ids))
+
+        if replaced:
+            await asyncio.gather(*[_delete_posts(self.sender, channel_id, message_ids) for channel_id, message_ids in replaced])
+
+async def _settle(item: Tuple[List[int], str, asyncio.Future, List[int]]):
+    try:
+        await item[2]
+    except Exception as e:
+        return item, e
+    return item, None
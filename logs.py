@@ -0,0 +1,172 @@
+import json
+import logging
+import queue
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Контекст апдейта, который попадает в каждую запись лога. Задаётся
+# middleware ниже; задачи, созданные при обработке апдейта, наследуют его
+UPDATE_ID: ContextVar[Optional[int]] = ContextVar("update_id", default=None)
+USER_ID: ContextVar[Optional[int]] = ContextVar("user_id", default=None)
+HANDLER: ContextVar[Optional[str]] = ContextVar("handler", default=None)
+
+CONTEXT_FIELDS = (("update_id", UPDATE_ID), ("user_id", USER_ID), ("handler", HANDLER))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [update=%(update_id)s user=%(user_id)s handler=%(handler)s] %(message)s"
+
+
+def parse_sampling(text: str) -> Dict[str, float]:
+    # "aiogram.event=0.01,database.db=0.1" -> {логгер: доля сохраняемых записей}
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    # Переносит контекст апдейта в запись. Фильтр стоит на QueueHandler и
+    # выполняется в коде, вызвавшем логгер, — пока contextvars ещё его
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in CONTEXT_FIELDS:
+            setattr(record, name, var.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # Выборка записей частых событий: для логгера из `rates` (и его дочерних)
+    # сохраняется доля rate записей ниже WARNING — каждая N-я, без random.
+    # Предупреждения и ошибки проходят всегда
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._every: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+
+    def _period(self, name: str) -> int:
+        # Период для логгера: 1 — без выборки, 0 — отбрасывать всё
+        period = self._every.get(name)
+        if period is None:
+            logger_name = name
+            while logger_name not in self.rates and "." in logger_name:
+                logger_name = logger_name.rsplit(".", 1)[0]
+            rate = self.rates.get(logger_name, 1.0)
+            period = self._every[name] = 0 if rate <= 0 else max(1, round(1 / rate))
+        return period
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        period = self._period(record.name)
+        if period <= 1:
+            return period == 1
+        count = self._counters.get(record.name, 0)
+        self._counters[record.name] = count + 1
+        return count % period == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, _ in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _LazyQueueHandler(QueueHandler):
+    # Стандартный QueueHandler форматирует сообщение до постановки в очередь,
+    # то есть в потоке event loop. Здесь запись уходит в очередь как есть, а
+    # подстановка аргументов и JSON выполняются в потоке QueueListener.
+    # Аргументы логгера в проекте — неизменяемые значения или копии
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    sampling: Optional[Dict[str, float]] = None,
+    lean_records: bool = False,
+) -> QueueListener:
+    # Корневой логгер пишет только в очередь: вызов логгера в хендлере — это
+    # фильтры и put() в SimpleQueue, вывод в stderr — в отдельном потоке.
+    # Возвращает запущенный QueueListener; его stop() при завершении
+    # дописывает оставшиеся записи
+    if lean_records:
+        # Поля, которых нет в выводе, не собираются: поиск места вызова по
+        # стеку (_srcfile), имена потока и процесса — это бо́льшая часть цены
+        # LogRecord. Это глобальные настройки модуля logging (_srcfile —
+        # приватный), они действуют на весь процесс, включая чужие
+        # обработчики, поэтому включаются только по явной просьбе вызвавшего
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _LazyQueueHandler(records)
+    # Выборка — раньше контекста: отброшенной записи контекст не нужен
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    handler.addFilter(ContextFilter())
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(records, output)
+    listener.start()
+    return listener
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: id апдейта и пользователя — в контекст логов
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = UPDATE_ID.set(event.update_id)
+        user_token = USER_ID.set(user.id if user is not None else None)
+        try:
+            return await handler(event, data)
+        finally:
+            USER_ID.reset(user_token)
+            UPDATE_ID.reset(update_token)
+
+
+class HandlerContextMiddleware(BaseMiddleware):
+    # Внутренний middleware: имя выбранного хендлера — в контекст логов
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        token = HANDLER.set(getattr(getattr(handler_object, "callback", None), "__name__", None))
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER.reset(token)
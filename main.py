@@ -1,36 +1,189 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.dispatcher.event.handler import HandlerObject
 import config
 from admin_panel import router as admin_router
+from albums import AlbumMiddleware
+from archive import Archiver
+from broadcast import Broadcaster
 from handlers import router as user_router
+from moderation import router as moderation_router
+from search import router as search_router
 from database.db import Database
+from database.fsm_storage import SQLiteStorage
+from dedup import DuplicateDetector
+from jobs import JobWorker
+from logs import HandlerContextMiddleware, UpdateContextMiddleware, parse_sampling, setup_logging
+from ordering import ChatOrderingMiddleware
+from scheduler import Scheduler
+from metrics import HandlerMetricsMiddleware, RequestMetricsMiddleware, start_metrics_server
+from sender import OutboundQueue
+from throttling import ThrottlingMiddleware, parse_action_limits
+from webhook import WebhookServer, run_webhook
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_dispatcher(db: Database, sender: OutboundQueue, storage: SQLiteStorage) -> Dispatcher:
+    # Сборка диспетчера вынесена отдельно, чтобы нагрузочный тест
+    # (benchmarks/load_test.py) гонял ту же конфигурацию, что и бот
+    duplicates = DuplicateDetector(
+        db,
+        window_days=config.DEDUP_WINDOW_DAYS,
+        min_similarity=config.DEDUP_MIN_SIMILARITY,
+        max_keys=config.DEDUP_CACHE_SIZE,
+    )
+    archiver = Archiver(
+        db,
+        archive_path=config.ARCHIVE_PATH,
+        after_days=config.ARCHIVE_AFTER_DAYS,
+        batch_size=config.ARCHIVE_BATCH_SIZE,
+        interval_hours=config.ARCHIVE_INTERVAL_HOURS,
+    )
+    broadcaster = Broadcaster(
+        db,
+        sender,
+        page_size=config.BROADCAST_PAGE_SIZE,
+        progress_interval=config.BROADCAST_PROGRESS_INTERVAL,
+    )
+    scheduler = Scheduler(db, batch_size=config.SCHEDULE_BATCH_SIZE, expire_days=config.AD_EXPIRE_DAYS)
+    dp = Dispatcher(
+        storage=storage,
+        db=db,
+        sender=sender,
+        duplicates=duplicates,
+        archiver=archiver,
+        broadcaster=broadcaster,
+        scheduler=scheduler,
+    )
+    # id апдейта и пользователя — в контекст логов всего, что выполняется ниже
+    dp.update.outer_middleware(UpdateContextMiddleware())
+    # Части альбома собираются в один апдейт до очереди чата, FSM и троттлинга.
+    # При остановке диспетчер дожидается альбомов, которые ещё собираются, —
+    # первым делом, до закрытия FSM-хранилища (его fsm.close aiogram
+    # регистрирует в конструкторе Dispatcher): хендлер альбома пишет в FSM
+    albums = AlbumMiddleware(dp, config.ALBUM_LATENCY)
+    dp.update.outer_middleware(albums)
+    dp.shutdown.handlers.insert(0, HandlerObject(callback=albums.close))
+    # Параллельная обработка апдейтов разных чатов с сохранением порядка внутри
+    # чата; встроенные middleware aiogram (контекст, FSM) зарегистрированы раньше,
+    # состояние FSM перечитывается уже под блокировкой чата
+    if config.UPDATE_CONCURRENCY:
+        dp.update.outer_middleware(ChatOrderingMiddleware(config.UPDATE_CONCURRENCY))
+    # Троттлинг — внешний middleware: отброшенные апдейты не проходят даже фильтры
+    throttling = ThrottlingMiddleware(
+        db,
+        user_rate=config.THROTTLE_USER_RATE,
+        user_burst=config.THROTTLE_USER_BURST,
+        action_rate=config.THROTTLE_ACTION_RATE,
+        action_burst=config.THROTTLE_ACTION_BURST,
+        action_limits=parse_action_limits(config.THROTTLE_ACTIONS),
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    # Внутренние middleware диспетчера распространяются на все вложенные роутеры
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.message.middleware(HandlerContextMiddleware())
+    dp.callback_query.middleware(HandlerContextMiddleware())
+    dp.include_router(admin_router)
+    dp.include_router(moderation_router)
+    dp.include_router(search_router)
+    dp.include_router(user_router)
+    return dp
 
 async def main():
-    # Инициализация базы данных
-    db = Database()
+    # Инициализация базы данных: одно соединение на весь процесс
+    db = Database(
+        admin_ids=config.ADMIN_IDS,
+        role_cache_ttl=config.ROLE_CACHE_TTL,
+        write_delay=config.DB_WRITE_DELAY_MS / 1000,
+        write_batch_size=config.DB_WRITE_BATCH_SIZE,
+    )
     try:
+        await db.connect()
+        await db.migrate()
         # Проверяем соединение с базой данных
-        db.cursor.execute("SELECT 1")
-        logging.info("База данных успешно инициализирована")
+        await db.ping()
+        logger.info("База данных успешно инициализирована")
     except Exception as e:
-        logging.error(f"Ошибка при инициализации базы данных: {e}")
+        logger.error("Ошибка при инициализации базы данных: %s", e)
         return
-    finally:
-        db.close()
 
-    # Инициализация бота и диспетчера
+    # Инициализация бота и диспетчера; db и sender доступны хендлерам через DI
     bot = Bot(token=config.BOT_TOKEN)
-    dp = Dispatcher()
-    dp.include_router(admin_router)
-    dp.include_router(user_router)
+    bot.session.middleware(RequestMetricsMiddleware())
+    sender = OutboundQueue(
+        bot,
+        global_rate=config.SEND_GLOBAL_RATE,
+        chat_rate=config.SEND_CHAT_RATE,
+        group_rate=config.SEND_GROUP_RATE_PER_MINUTE / 60,
+        concurrency=config.SEND_CONCURRENCY,
+    )
+    # Черновики объявлений (FSM) хранятся в той же базе и переживают перезапуск
+    storage = SQLiteStorage(db, ttl=config.FSM_DRAFT_TTL_HOURS * 60 * 60, cache_size=config.FSM_CACHE_SIZE)
+    dp = create_dispatcher(db, sender, storage)
+
+    # Задания из очереди выполняет сам бот или отдельные процессы worker.py
+    worker = None
+    if config.JOB_EMBEDDED_WORKER:
+        worker = JobWorker(
+            db,
+            sender,
+            batch_size=config.JOB_BATCH_SIZE,
+            lease_seconds=config.JOB_LEASE_SECONDS,
+            max_attempts=config.JOB_MAX_ATTEMPTS,
+            expire_mode=config.AD_EXPIRE_MODE,
+        )
 
     # Запуск бота
-    await dp.start_polling(bot)
+    sender.start()
+    storage.start()
+    if worker is not None:
+        worker.start()
+    archiver: Archiver = dp["archiver"]
+    archiver.start()
+    # Рассылки, прерванные перезапуском, продолжаются с контрольной точки
+    broadcaster: Broadcaster = dp["broadcaster"]
+    await broadcaster.resume()
+    # Таймеры отложенных публикаций, истечений и поднятий — из таблицы schedule
+    scheduler: Scheduler = dp["scheduler"]
+    await scheduler.start()
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+    try:
+        if config.BOT_MODE == "webhook":
+            server = WebhookServer(
+                dp,
+                bot,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret_token=config.WEBHOOK_SECRET or None,
+            )
+            await run_webhook(dp, bot, server, url=config.WEBHOOK_URL)
+        else:
+            # При UPDATE_CONCURRENCY=0 апдейты обрабатываются по одному
+            await dp.start_polling(bot, handle_as_tasks=config.UPDATE_CONCURRENCY > 0)
+    finally:
+        await scheduler.stop()
+        await archiver.stop()
+        # Неотправленные сообщения рассылки снимаются с очереди до её остановки
+        await broadcaster.stop()
+        if worker is not None:
+            await worker.stop()
+        await sender.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await db.close()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # Записи логов выводятся в отдельном потоке; при остановке он дописывает очередь
+    log_listener = setup_logging(
+        config.LOG_LEVEL, config.LOG_FORMAT == "json", parse_sampling(config.LOG_SAMPLING), config.LOG_LEAN_RECORDS
+    )
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop() 
\ No newline at end of file
@@ -0,0 +1,203 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Минимальная реализация метрик в текстовом формате Prometheus без внешних
+# зависимостей. Метрики обновляются только из потока event loop (поток БД
+# возвращает замеры вместе с результатом), поэтому блокировки не нужны, а
+# запись значения — это поиск в словаре и пара сложений.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        state = self._values.get(labels)
+        if state is None:
+            # [счётчики по корзинам (+Inf — последняя), сумма, количество]
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Хендлеры
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler", "error"))
+
+# База данных
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Время выполнения метода Database в потоке БД", ("method",))
+DB_ROWS = Counter("bot_db_rows_total", "Строк прочитано методами Database", ("method",))
+DB_COMMIT_SECONDS = Histogram("bot_db_commit_seconds", "Время фиксации транзакций", ("method",))
+DB_ERRORS = Counter("bot_db_errors_total", "Ошибки методов Database", ("method", "error"))
+DB_WRITE_BATCH_SIZE = Histogram(
+    "bot_db_write_batch_size", "Записей в одной групповой транзакции", buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+
+# Очереди апдейтов по чатам (ordering.ChatOrderingMiddleware)
+UPDATES_WAITING = Gauge("bot_updates_waiting", "Апдейты, ожидающие своей очереди в чате или свободного слота")
+UPDATES_IN_PROGRESS = Gauge("bot_updates_in_progress", "Апдейты, обрабатываемые прямо сейчас")
+UPDATES_ACTIVE_CHATS = Gauge("bot_updates_active_chats", "Чаты с апдейтами в обработке или в очереди")
+UPDATE_WAIT_SECONDS = Histogram("bot_update_wait_seconds", "Время ожидания апдейта в очереди до начала обработки")
+ALBUM_UPDATES_MERGED = Counter("bot_album_updates_merged_total", "Апдейты альбомов, присоединённые к первому сообщению альбома")
+
+# Троттлинг входящих апдейтов
+THROTTLED = Counter("bot_throttled_total", "Апдейты, отброшенные лимитом на пользователя", ("action",))
+
+# Объявления
+DUPLICATE_ADS = Counter("bot_duplicate_ads_total", "Отклонённые повторные объявления", ("kind",))
+MODERATION_CONFLICTS = Counter(
+    "bot_moderation_conflicts_total", "Повторные решения по уже промодерированным объявлениям", ("reason",)
+)
+
+# Рассылки
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Сообщения рассылок по результату доставки", ("result",))
+
+# Очередь заданий
+JOBS_PROCESSED = Counter("bot_jobs_processed_total", "Обработанные задания очереди", ("kind", "result"))
+
+# Отложенные действия (scheduler.Scheduler)
+SCHEDULE_TIMERS = Gauge("bot_schedule_timers", "Таймеры отложенных действий в куче планировщика")
+SCHEDULE_FIRED = Counter("bot_schedule_fired_total", "Сработавшие отложенные действия", ("kind",))
+
+# Bot API
+API_REQUEST_SECONDS = Histogram("bot_api_request_seconds", "Время запроса к Bot API", ("method",))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware: к этому моменту хендлер уже выбран фильтрами,
+    # его имя лежит в data["handler"]
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, name)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
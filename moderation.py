@@ -0,0 +1,128 @@
+import time
+from typing import Set
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+import config
+from database.db import Database
+from database.models import ScheduleEntry
+from jobs import ON_APPROVE, ON_REJECT
+from scheduler import PUBLISH_AT, Scheduler, parse_local_time
+
+router = Router()
+
+# Сколько объявлений обрабатывается за одно нажатие
+BULK_LIMIT = 500
+
+# Серверы, чья очередь сейчас обрабатывается массовым действием
+_bulk_in_flight: Set[int] = set()
+
+SCHEDULE_USAGE = (
+    "🕒 Отложенная публикация: /schedule <id объявления> <ГГГГ-ММ-ДД ЧЧ:ММ>\n"
+    "Например: /schedule 42 2024-05-01 18:00"
+)
+
+
+def _can_moderate(db: Database, user_id: int, chat_id: int, moderation_group_id: str) -> bool:
+    return db.is_admin(user_id) or str(chat_id) == moderation_group_id
+
+
+@router.message(Command("pending"))
+async def show_pending(message: Message, db: Database):
+    # В группе модерации показываем её серверы, администратору — все
+    counts = [
+        row for row in await db.get_pending_counts()
+        if _can_moderate(db, message.from_user.id, message.chat.id, row[2])
+    ]
+    if not counts:
+        await message.answer("Очередь модерации пуста")
+        return
+
+    response = "Очередь модерации:\n\n"
+    buttons = []
+    for server_id, name, _, count in counts:
+        response += f"{name}: {count}\n"
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ Одобрить все ({name})", callback_data=f"bulk_approve_{server_id}"),
+            InlineKeyboardButton(text=f"❌ Отклонить все ({name})", callback_data=f"bulk_reject_{server_id}"),
+        ])
+
+    await message.answer(response, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+@router.callback_query(F.data.startswith("bulk_approve_") | F.data.startswith("bulk_reject_"))
+async def bulk_moderate(callback: CallbackQuery, db: Database, scheduler: Scheduler):
+    _, action, server_id = callback.data.split("_")
+    server_id = int(server_id)
+    approve = action == "approve"
+
+    server = await db.get_server(server_id)
+    if not server or not _can_moderate(db, callback.from_user.id, callback.message.chat.id, server.moderation_group_id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    if server_id in _bulk_in_flight:
+        await callback.answer("Очередь этого сервера уже обрабатывается")
+        return
+
+    await callback.answer("Обрабатываю очередь…")
+    # Публикация (альбомами) и уведомления авторов ставятся в очередь заданий
+    # в той же транзакции, что и смена статусов
+    _bulk_in_flight.add(server_id)
+    expiry = scheduler.expiry() if approve else []
+    try:
+        ads = await db.moderate_pending_advertisements(
+            server_id,
+            "approved" if approve else "rejected",
+            BULK_LIMIT,
+            jobs=ON_APPROVE if approve else ON_REJECT,
+            schedule=expiry,
+        )
+    finally:
+        _bulk_in_flight.discard(server_id)
+    if not ads:
+        await callback.message.edit_text(f"В очереди {server.name} нет объявлений")
+        return
+    # Время истечения у всей пачки одно — и таймер один
+    scheduler.notify(expiry)
+
+    verb = "одобрено и поставлено в очередь на публикацию" if approve else "отклонено"
+    text = f"{server.name}: {verb} объявлений — {len(ads)}"
+    if len(ads) == BULK_LIMIT:
+        text += "\n\nВ очереди ещё есть объявления — нажмите /pending снова"
+    await callback.message.edit_text(text)
+
+
+@router.message(Command("schedule"))
+async def schedule_publication(message: Message, command: CommandObject, db: Database, scheduler: Scheduler):
+    # Одобрение с публикацией в заданное время (часовой пояс — SCHEDULE_UTC_OFFSET)
+    ad_id, _, when = (command.args or "").partition(" ")
+    try:
+        ad_id = int(ad_id)
+        run_at = parse_local_time(when, config.SCHEDULE_UTC_OFFSET)
+    except ValueError:
+        await message.answer(SCHEDULE_USAGE)
+        return
+    if run_at <= time.time():
+        await message.answer("Это время уже прошло")
+        return
+
+    ad = await db.get_advertisement(ad_id)
+    if ad is None:
+        await message.answer("Объявление не найдено")
+        return
+    server = await db.get_server(ad.server_id)
+    if not server or not _can_moderate(db, message.from_user.id, message.chat.id, server.moderation_group_id):
+        await message.answer("Нет доступа")
+        return
+
+    # Публикация и уведомление автора поставятся в очередь заданий в момент
+    # публикации; истечение отсчитывается от него же
+    entries = [ScheduleEntry(PUBLISH_AT, run_at)] + scheduler.expiry(run_at)
+    if not await db.update_advertisement_status(ad_id, "approved", schedule=entries):
+        await message.answer("Объявление уже промодерировано")
+        return
+    scheduler.notify(entries)
+    await message.answer(f"Объявление #{ad_id} одобрено и будет опубликовано {when.strip()}")
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import UPDATE_WAIT_SECONDS, UPDATES_ACTIVE_CHATS, UPDATES_IN_PROGRESS, UPDATES_WAITING
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "size")
+
+    def __init__(self):
+        # asyncio.Lock будит ожидающих в порядке прихода — это и есть очередь чата
+        self.lock = asyncio.Lock()
+        self.size = 0
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: апдейты разных чатов обрабатываются
+    # параллельно (не больше `limit` одновременно), апдейты одного чата — строго
+    # по очереди, в порядке получения. Так текст и фото одного пользователя не
+    # обгоняют друг друга в FSM, а медленная отправка в одном чате не держит
+    # остальные. Порядок занимается синхронно при входе в middleware: задачи
+    # апдейтов создаются в порядке получения, а до этого места ни один
+    # встроенный middleware aiogram не уступает управление.
+    # Встроенный FSMContextMiddleware срабатывает раньше и читает состояние
+    # ещё до очереди чата, поэтому raw_state перечитывается здесь, под
+    # блокировкой чата: иначе апдейт, дождавшийся очереди, прошёл бы фильтры
+    # по состоянию, которое предыдущий апдейт уже сменил.
+    def __init__(self, limit: int = 64):
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat is not None else (user.id if user is not None else None)
+
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = _ChatQueue()
+            UPDATES_ACTIVE_CHATS.set(len(self._chats))
+        queue.size += 1
+        UPDATES_WAITING.inc()
+        waiting = True
+        enqueued_at = time.monotonic()
+        try:
+            async with queue.lock:
+                # Слот занимается уже с местом в очереди чата, чтобы апдейты,
+                # ждущие свой чат, не держали общий лимит
+                async with self._slots:
+                    UPDATES_WAITING.dec()
+                    waiting = False
+                    UPDATE_WAIT_SECONDS.observe(time.monotonic() - enqueued_at)
+                    UPDATES_IN_PROGRESS.inc()
+                    try:
+                        state = data.get("state")
+                        if state is not None:
+                            data["raw_state"] = await state.get_state()
+                        return await handler(event, data)
+                    finally:
+                        UPDATES_IN_PROGRESS.dec()
+        finally:
+            if waiting:
+                UPDATES_WAITING.dec()
+            queue.size -= 1
+            if not queue.size:
+                del self._chats[key]
+                UPDATES_ACTIVE_CHATS.set(len(self._chats))
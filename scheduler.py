@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from database.db import Database
+from database.models import ScheduleEntry
+from jobs import ON_APPROVE, ON_BUMP, ON_EXPIRE
+from metrics import SCHEDULE_FIRED, SCHEDULE_TIMERS
+
+logger = logging.getLogger(__name__)
+
+# Виды отложенных действий с объявлением (таблица schedule)
+PUBLISH_AT = "publish"
+EXPIRE_AT = "expire"
+BUMP_AT = "bump"
+
+# Задания, которые ставит сработавшее действие. Отложенная публикация — то же,
+# что одобрение: публикация в канале и уведомление автора
+SCHEDULED_JOBS = {PUBLISH_AT: ON_APPROVE, EXPIRE_AT: ON_EXPIRE, BUMP_AT: ON_BUMP}
+
+DAY = 24 * 60 * 60
+
+
+def parse_local_time(text: str, utc_offset_hours: float) -> float:
+    # "ГГГГ-ММ-ДД ЧЧ:ММ" в часовом поясе UTC+utc_offset_hours -> unix-время;
+    # при ошибке — ValueError
+    moment = datetime.strptime(text.strip(), "%Y-%m-%d %H:%M")
+    return moment.replace(tzinfo=timezone(timedelta(hours=utc_offset_hours))).timestamp()
+
+
+class Scheduler:
+    # Отложенные действия с объявлениями: публикация в заданное время,
+    # истечение через expire_days после публикации и периодическое поднятие.
+    # Действия хранятся в таблице schedule, а в памяти — только куча (min-heap)
+    # времён срабатывания: одна задача спит до ближайшего из них и не опрашивает
+    # базу. При старте куча заполняется одним запросом по частичному индексу.
+    # Сработавшие действия не отправляют ничего сами, а ставят задания в
+    # очередь jobs той же транзакцией — дальше их выполняет JobWorker через
+    # OutboundQueue, так что даже накопившиеся за простой срабатывания уходят
+    # в канал не быстрее его лимита. За один раз обрабатывается не больше
+    # batch_size действий.
+    def __init__(self, db: Database, batch_size: int = 100, expire_days: float = 0, retry_delay: float = 5.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.expire_days = expire_days
+        self.retry_delay = retry_delay
+        self._timers: List[float] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._timers = await self.db.get_schedule_times()
+            heapq.heapify(self._timers)
+            SCHEDULE_TIMERS.set(len(self._timers))
+            logger.info("Загружено отложенных действий: %s", len(self._timers))
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def expiry(self, published_at: Optional[float] = None) -> List[ScheduleEntry]:
+        # Истечение публикации, если оно включено (expire_days > 0)
+        if self.expire_days <= 0:
+            return []
+        return [ScheduleEntry(EXPIRE_AT, (published_at or time.time()) + self.expire_days * DAY)]
+
+    def notify(self, entries: Iterable[ScheduleEntry]):
+        # Вызывается после записи действий в базу: таймер добавляется в кучу,
+        # и если он раньше текущего ближайшего, задача просыпается
+        for entry in entries:
+            heapq.heappush(self._timers, entry.run_at)
+            if self._timers[0] == entry.run_at:
+                self._wake.set()
+        SCHEDULE_TIMERS.set(len(self._timers))
+
+    async def add(self, ad_id: int, entries: List[ScheduleEntry]):
+        await self.db.add_schedule(ad_id, entries)
+        self.notify(entries)
+
+    async def _loop(self):
+        while True:
+            self._wake.clear()
+            if not self._timers:
+                await self._wake.wait()
+                continue
+            delay = self._timers[0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            while self._timers and self._timers[0] <= now:
+                heapq.heappop(self._timers)
+            try:
+                fired = await self.db.fire_schedule(now, SCHEDULED_JOBS, self.batch_size)
+            except Exception as e:
+                logger.error("Ошибка планировщика, повтор через %s с: %s", self.retry_delay, e)
+                heapq.heappush(self._timers, now + self.retry_delay)
+                continue
+
+            for kind, next_run_at in fired:
+                SCHEDULE_FIRED.inc(kind)
+                if next_run_at is not None:
+                    heapq.heappush(self._timers, next_run_at)
+            if len(fired) == self.batch_size:
+                # Наступивших действий больше, чем пачка, — следующая сразу
+                heapq.heappush(self._timers, now)
+            SCHEDULE_TIMERS.set(len(self._timers))
@@ -0,0 +1,89 @@
+import re
+from typing import List, Optional, Tuple
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+from database.db import Database
+
+router = Router()
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_TERMS = 8
+STATUSES = ("pending", "approved", "rejected")
+
+USAGE = (
+    "🔎 Поиск объявлений: /search <слова>\n\n"
+    "Фильтр по серверу: server:<id>, например /search аккаунт server:2"
+)
+
+
+def parse_query(text: str, is_admin: bool) -> Tuple[Optional[str], str, Optional[int]]:
+    # Возвращает (выражение MATCH для FTS5, статус, id сервера). Каждое слово
+    # запроса превращается в префиксный терм "слово"*, так что пользовательский
+    # ввод не может сломать синтаксис FTS5. Статус меняют только администраторы.
+    status = "approved"
+    server_id = None
+    terms: List[str] = []
+    for token in text.split():
+        key, _, value = token.partition(":")
+        if key == "server" and value.isdigit():
+            server_id = int(value)
+        elif key == "status" and value in STATUSES and is_admin:
+            status = value
+        else:
+            terms.extend(re.findall(r"\w+", token.lower()))
+
+    match = " ".join(f'"{term}"*' for term in terms[:SEARCH_MAX_TERMS]) or None
+    return match, status, server_id
+
+
+async def render_results(db: Database, search: dict, after: Optional[Tuple[float, int]] = None):
+    rows = await db.search_advertisements(
+        search["match"], search["status"], search["server_id"], after, SEARCH_PAGE_SIZE + 1
+    )
+    if not rows:
+        return ("Ничего не найдено" if after is None else "Больше результатов нет"), None
+
+    page = rows[:SEARCH_PAGE_SIZE]
+    text = "🔎 Результаты поиска:\n\n" + "\n\n".join(
+        f"#{ad_id} · {server_name}\n{snippet}" for ad_id, _, server_name, snippet, _ in page
+    )
+
+    keyboard = None
+    if len(rows) > SEARCH_PAGE_SIZE:
+        last_id, last_rank = page[-1][0], page[-1][4]
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="Далее ▶️", callback_data=f"search_{last_rank!r}_{last_id}")
+        ]])
+    return text, keyboard
+
+
+@router.message(Command("search"))
+async def search(message: Message, command: CommandObject, state: FSMContext, db: Database):
+    match, status, server_id = parse_query(command.args or "", db.is_admin(message.from_user.id))
+    if match is None:
+        await message.answer(USAGE)
+        return
+
+    # Запрос сохраняется в данных FSM, в кнопке «Далее» — только позиция
+    search_params = {"match": match, "status": status, "server_id": server_id}
+    await state.update_data(search=search_params)
+
+    text, keyboard = await render_results(db, search_params)
+    await message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("search_"))
+async def search_next_page(callback: CallbackQuery, state: FSMContext, db: Database):
+    search_params = (await state.get_data()).get("search")
+    if not search_params:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+
+    _, rank, ad_id = callback.data.split("_")
+    text, keyboard = await render_results(db, search_params, (float(rank), int(ad_id)))
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    # Чем меньше значение, тем раньше уходит запрос
+    MODERATION = 0    # пересылка в группу модерации и публикация одобренных объявлений
+    NOTIFICATION = 1  # уведомления пользователям
+    BULK = 2          # массовые рассылки и прочий фоновый трафик
+
+
+class _Outgoing:
+    __slots__ = ("method", "chat_key", "priority", "future", "attempts")
+
+    def __init__(self, method: TelegramMethod, priority: Priority, future: asyncio.Future):
+        self.method = method
+        chat_id = getattr(method, "chat_id", None)
+        self.chat_key = str(chat_id) if chat_id is not None else None
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+def _is_group_chat(chat_key: str) -> bool:
+    # Отрицательные id и @username — группы и каналы, положительные — личные чаты
+    return chat_key.startswith("-") or chat_key.startswith("@")
+
+
+def _consume_exception(future: asyncio.Future):
+    # Ошибка уже залогирована; если результат никто не ждёт, не даём asyncio
+    # ругаться на «Future exception was never retrieved»
+    if not future.cancelled():
+        future.exception()
+
+
+def _resolve(future: asyncio.Future, result: Any = None, exception: Optional[BaseException] = None):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class OutboundQueue:
+    # Центральная очередь исходящих запросов к Bot API. Хендлеры вызывают
+    # send() и сразу продолжают работу, а очередь отправляет запросы в порядке
+    # приоритета, соблюдая общий лимит бота, лимит на личный чат и лимит на
+    # группу/канал. При TelegramRetryAfter запрос откладывается на указанное
+    # время и повторяется автоматически.
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3.0,
+        concurrency: int = 8,
+        max_retries: int = 5,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[str, TokenBucket] = {}
+        self._ready: List[Tuple[int, int, _Outgoing]] = []
+        self._delayed: List[Tuple[float, int, int, _Outgoing]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._in_flight: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def send(self, method: TelegramMethod, priority: Priority = Priority.NOTIFICATION) -> asyncio.Future:
+        # Ставит запрос в очередь; возвращённый future можно не ждать
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        item = _Outgoing(method, priority, future)
+        heapq.heappush(self._ready, (item.priority, next(self._seq), item))
+        self._wakeup.set()
+        return future
+
+    def pending(self) -> int:
+        return len(self._ready) + len(self._delayed) + len(self._in_flight)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = 10.0):
+        # Дожидаемся отправки уже поставленных запросов, затем останавливаемся
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pending():
+            logger.warning("Очередь отправки остановлена, не отправлено запросов: %s", self.pending())
+
+    def _chat_bucket(self, chat_key: str) -> TokenBucket:
+        bucket = self._chats.get(chat_key)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._evict_idle_buckets()
+            if _is_group_chat(chat_key):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, 1)
+            self._chats[chat_key] = bucket
+        return bucket
+
+    def _evict_idle_buckets(self):
+        # Полные бакеты ничего не ограничивают — их можно пересоздать позже
+        now = time.monotonic()
+        for chat_key in [key for key, bucket in self._chats.items() if bucket.is_full(now)]:
+            del self._chats[chat_key]
+
+    def _defer(self, item: _Outgoing, delay: float):
+        heapq.heappush(self._delayed, (time.monotonic() + delay, item.priority, next(self._seq), item))
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, item = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, item))
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, seq, item = heapq.heappop(self._ready)
+            if item.future.done():
+                # Отправитель отменил запрос, пока тот стоял в очереди
+                continue
+
+            # Чат упёрся в свой лимит — откладываем только его запрос,
+            # остальные чаты продолжают получать сообщения
+            if item.chat_key is not None:
+                chat_delay = self._chat_bucket(item.chat_key).delay(now)
+                if chat_delay > 0:
+                    self._defer(item, chat_delay)
+                    continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                heapq.heappush(self._ready, (priority, seq, item))
+                await asyncio.sleep(global_delay)
+                continue
+
+            self._global.consume(now)
+            if item.chat_key is not None:
+                self._chat_bucket(item.chat_key).consume(now)
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, item: _Outgoing):
+        try:
+            item.attempts += 1
+            result: Any = await self.bot(item.method)
+        except TelegramRetryAfter as e:
+            if item.attempts > self.max_retries:
+                logger.error("Запрос %s не отправлен после %s попыток: %s", type(item.method).__name__, item.attempts, e)
+                _resolve(item.future, exception=e)
+                return
+            logger.warning("Flood control для чата %s: повтор через %s с", item.chat_key, e.retry_after)
+            if item.chat_key is not None:
+                self._chat_bucket(item.chat_key).penalize(e.retry_after)
+            else:
+                self._global.penalize(e.retry_after)
+            self._defer(item, e.retry_after)
+            self._wakeup.set()
+        except Exception as e:
+            logger.error("Ошибка при отправке %s в чат %s: %s", type(item.method).__name__, item.chat_key, e)
+            _resolve(item.future, exception=e)
+        else:
+            _resolve(item.future, result=result)
+        finally:
+            self._slots.release()
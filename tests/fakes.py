@@ -0,0 +1,69 @@
+import asyncio
+import datetime
+import itertools
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMediaGroup, TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+_ids = itertools.count(1)
+
+
+class FakeSession(BaseSession):
+    # Отвечает на методы Bot API без сети и запоминает запросы. errors —
+    # исключения, которые по очереди выбрасываются вместо ответа
+    def __init__(self, errors: Optional[List[Exception]] = None):
+        super().__init__()
+        self.requests: List[TelegramMethod] = []
+        self.errors = list(errors or [])
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        await asyncio.sleep(0)
+        if self.errors:
+            raise self.errors.pop(0)
+        chat_id = getattr(method, "chat_id", 0)
+        chat = Chat(id=chat_id if isinstance(chat_id, int) else -1, type="private")
+        message = Message(message_id=next(_ids), date=datetime.datetime.now(), chat=chat)
+        if isinstance(method, SendMediaGroup):
+            return [message for _ in method.media]
+        if "Message" in str(method.__returning__):
+            return message
+        return True
+
+
+def make_bot(errors: Optional[List[Exception]] = None):
+    session = FakeSession(errors)
+    return Bot("42:TEST", session=session), session
+
+
+def message_update(user_id: int, text: str = None, photo: str = None, media_group_id: str = None, chat_id: int = None) -> Update:
+    user = User(id=user_id, is_bot=False, first_name="U")
+    chat = Chat(id=chat_id or user_id, type="private")
+    photos = [PhotoSize(file_id=photo, file_unique_id=f"{photo}_u", width=1, height=1)] if photo else None
+    message = Message(
+        message_id=next(_ids),
+        date=datetime.datetime.now(),
+        chat=chat,
+        from_user=user,
+        text=text,
+        photo=photos,
+        media_group_id=media_group_id,
+    )
+    return Update(update_id=next(_ids), message=message)
+
+
+def callback_update(user_id: int, data: str, chat_id: int = None) -> Update:
+    user = User(id=user_id, is_bot=False, first_name="U")
+    chat = Chat(id=chat_id or user_id, type="private")
+    message = Message(message_id=next(_ids), date=datetime.datetime.now(), chat=chat, from_user=user, text="x")
+    query = CallbackQuery(id=str(next(_ids)), from_user=user, chat_instance="c", message=message, data=data)
+    return Update(update_id=next(_ids), callback_query=query)
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, ErrorEvent, Message, PhotoSize, Update, User
+
+from albums import AlbumMiddleware
+from database.db import Database
+from database.fsm_storage import SQLiteStorage
+from main import create_dispatcher
+from sender import OutboundQueue
+from tests.fakes import callback_update, make_bot, message_update as fake_message_update
+
+
+def message_update(update_id: int, text: str = None, media_group_id: str = None) -> Update:
+    user = User(id=1, is_bot=False, first_name="U")
+    chat = Chat(id=1, type="private")
+    photo = [PhotoSize(file_id=f"photo{update_id}", file_unique_id=f"u{update_id}", width=1, height=1)] if media_group_id else None
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(),
+        chat=chat,
+        from_user=user,
+        text=text,
+        photo=photo,
+        media_group_id=media_group_id,
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def make_dispatcher(seen: list, latency: float = 0.05):
+    dp = Dispatcher()
+    albums = AlbumMiddleware(dp, latency)
+    dp.update.outer_middleware(albums)
+
+    @dp.message(F.photo)
+    async def on_album(message: Message, album: list = None):
+        seen.append(("album", [part.message_id for part in album or [message]]))
+
+    @dp.message(F.text)
+    async def on_text(message: Message):
+        seen.append(("text", message.text))
+
+    return dp, albums
+
+
+def test_later_update_of_same_chat_waits_for_album():
+    # Апдейты подаются по одному, как при UPDATE_CONCURRENCY=0: текст,
+    # пришедший после альбома, обрабатывается после него
+    async def scenario():
+        seen = []
+        dp, _ = make_dispatcher(seen)
+        bot = Bot("42:TEST")
+        await dp.feed_update(bot, message_update(1, media_group_id="g"))
+        await dp.feed_update(bot, message_update(2, media_group_id="g"))
+        await dp.feed_update(bot, message_update(3, text="after"))
+        await bot.session.close()
+        return seen
+
+    assert asyncio.run(scenario()) == [("album", [1, 2]), ("text", "after")]
+
+
+def test_album_errors_reach_error_handlers():
+    async def scenario():
+        errors = []
+        dp = Dispatcher()
+        dp.update.outer_middleware(AlbumMiddleware(dp, 0.01))
+
+        @dp.message(F.photo)
+        async def on_album(message: Message):
+            raise ValueError("boom")
+
+        @dp.errors()
+        async def on_error(event: ErrorEvent):
+            errors.append(str(event.exception))
+
+        bot = Bot("42:TEST")
+        await dp.feed_update(bot, message_update(1, media_group_id="g"))
+        await dp.feed_update(bot, message_update(2, text="after"))
+        await bot.session.close()
+        return errors
+
+    assert asyncio.run(scenario()) == ["boom"]
+
+
+def test_close_processes_pending_album():
+    async def scenario():
+        seen = []
+        dp, albums = make_dispatcher(seen, latency=0.05)
+        bot = Bot("42:TEST")
+        await dp.feed_update(bot, message_update(1, media_group_id="g"))
+        await albums.close()
+        await bot.session.close()
+        return seen
+
+    assert asyncio.run(scenario()) == [("album", [1])]
+
+
+def test_shutdown_drains_album_before_fsm_storage_closes(tmp_path):
+    # Альбом, который ещё собирается при остановке, обрабатывается до
+    # закрытия SQLiteStorage: очистка черновика хендлером альбома попадает
+    # в базу, а не теряется в отложенном сбросе
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        await db.migrate()
+        bot, _ = make_bot()
+        storage = SQLiteStorage(db)
+        dp = create_dispatcher(db, OutboundQueue(bot), storage)
+        await db.add_server("S1", "-1001", "-1002")
+        for update in (
+            fake_message_update(1, text="📝 Создать объявление"),
+            callback_update(1, "server_1"),
+            fake_message_update(1, text="Продаю машину недорого"),
+            callback_update(1, "add_photo"),
+        ):
+            await dp.feed_update(bot, update)
+        await storage.flush()
+        key = SQLiteStorage._key(StorageKey(bot_id=bot.id, chat_id=1, user_id=1))
+        draft = await db.get_fsm_record(key)
+
+        await dp.feed_update(bot, fake_message_update(1, photo="p1", media_group_id="g"))
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        try:
+            return draft, await db.get_fsm_record(key)
+        finally:
+            await db.close()
+
+    draft, after = asyncio.run(scenario())
+    assert draft is not None and draft[0] == "UserStates:WAITING_FOR_PHOTO"
+    assert after is None
@@ -0,0 +1,74 @@
+import asyncio
+
+from database.db import Database
+from database.models import Ad
+from dedup import DuplicateDetector, fingerprint, similarity
+
+AD = "Продам аккаунт, уровень 50, много доната. Цена 1000 руб"
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.statuses = {}
+
+    async def get_recent_fingerprints(self, user_id, server_id, since, limit):
+        return []
+
+    async def get_advertisement(self, ad_id):
+        return Ad(ad_id, 1, 1, AD, None, self.statuses.get(ad_id, "pending"), None, None)
+
+
+def test_price_change_in_short_ad_is_near_duplicate():
+    edited = AD.replace("1000", "1500")
+    assert similarity(fingerprint(AD).minhash, fingerprint(edited).minhash) >= 0.7
+
+
+def test_different_short_ads_are_not_duplicates():
+    other = "Продам меч +15, заточка на урон. Цена 300 руб"
+    assert similarity(fingerprint(AD).minhash, fingerprint(other).minhash) < 0.7
+
+
+def test_detector_reports_near_duplicate_only():
+    async def scenario():
+        detector = DuplicateDetector(FakeDatabase())
+        assert await detector.find_duplicate(1, 1, fingerprint(AD)) is None
+        detector.remember(1, 1, 10, fingerprint(AD))
+        return (
+            await detector.find_duplicate(1, 1, fingerprint(AD.replace("1000", "900"))),
+            await detector.find_duplicate(1, 1, fingerprint("Куплю машину недорого, срочно")),
+        )
+
+    assert asyncio.run(scenario()) == (10, None)
+
+
+def test_rejected_ad_is_not_a_duplicate():
+    # Отклонённое объявление, уже лежащее в памяти детектора, не мешает
+    # подать исправленный вариант
+    async def scenario():
+        db = FakeDatabase()
+        detector = DuplicateDetector(db)
+        await detector.find_duplicate(1, 1, fingerprint(AD))
+        detector.remember(1, 1, 10, fingerprint(AD))
+        db.statuses[10] = "rejected"
+        return await detector.find_duplicate(1, 1, fingerprint(AD.replace("1000", "900")))
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_recent_fingerprints_skip_rejected_ads(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        await db.migrate()
+        try:
+            server_id = await db.add_server("S1", "-1001", "-1002")
+            rejected = await db.add_advertisement(1, server_id, AD, fingerprint=fingerprint(AD))
+            pending = await db.add_advertisement(1, server_id, AD, fingerprint=fingerprint(AD))
+            await db.update_advertisement_status(rejected, "rejected")
+            rows = await db.get_recent_fingerprints(1, server_id, 0)
+        finally:
+            await db.close()
+        return [row[0] for row in rows], pending
+
+    ad_ids, pending = asyncio.run(scenario())
+    assert ad_ids == [pending]
@@ -0,0 +1,80 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from database.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+class FakeDatabase:
+    def __init__(self, failures: int = 0, save_delay: float = 0):
+        self.failures = failures
+        self.save_delay = save_delay
+        self.loading = asyncio.Event()
+        self.release = asyncio.Event()
+        self.saving = asyncio.Event()
+        self.saved = []
+
+    async def get_fsm_record(self, key):
+        # Первое чтение ждёт release, остальные отвечают сразу
+        if not self.loading.is_set():
+            self.loading.set()
+            await self.release.wait()
+        return None
+
+    async def save_fsm_records(self, upserts, deletes):
+        self.saving.set()
+        await asyncio.sleep(self.save_delay)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.saved.append(upserts)
+
+
+def test_load_keeps_record_changed_while_reading():
+    # Первое чтение ключа ждёт базу, а тем временем второе обращение
+    # загружает и меняет запись: прочитанная первым пустая запись не должна
+    # её затереть
+    async def scenario():
+        db = FakeDatabase()
+        storage = SQLiteStorage(db, flush_delay=60)
+        reading = asyncio.create_task(storage.get_state(KEY))
+        await db.loading.wait()
+        await storage.set_state(KEY, "Draft:text")
+        db.release.set()
+        await reading
+        state = await storage.get_state(KEY)
+        storage._flush_task.cancel()
+        return state
+
+    assert asyncio.run(scenario()) == "Draft:text"
+
+
+def test_delayed_flush_is_retried_after_error():
+    async def scenario():
+        db = FakeDatabase(failures=1)
+        db.release.set()
+        storage = SQLiteStorage(db, flush_delay=0.01)
+        await storage.set_state(KEY, "Draft:text")
+        await storage._flush_task
+        return db.saved
+
+    saved = asyncio.run(scenario())
+    assert [[(key, state) for key, state, _, _ in upserts] for upserts in saved] == [[("42:1:1::default", "Draft:text")]]
+
+
+def test_close_waits_for_flush_in_progress():
+    # close() во время медленной записи не должен её отменять: иначе
+    # изменения, уже забранные из очереди, теряются
+    async def scenario():
+        db = FakeDatabase(save_delay=0.1)
+        db.release.set()
+        storage = SQLiteStorage(db, flush_delay=0.01)
+        await storage.set_state(KEY, "Draft:text")
+        await db.saving.wait()
+        await storage.close()
+        return db.saved
+
+    saved = asyncio.run(scenario())
+    assert [[(key, state) for key, state, _, _ in upserts] for upserts in saved] == [[("42:1:1::default", "Draft:text")]]
@@ -0,0 +1,30 @@
+import asyncio
+
+from database.db import Database
+from jobs import ON_APPROVE, ON_REJECT
+
+
+def test_concurrent_moderation_applies_only_one_decision(tmp_path):
+    # Два модератора одновременно одобряют и отклоняют одно объявление:
+    # статус меняет только первое решение, и задания ставит только оно
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        await db.migrate()
+        try:
+            server_id = await db.add_server("S1", "-1001", "-1002")
+            ad_id = await db.add_advertisement(1, server_id, "Продаю аккаунт")
+            results = await asyncio.gather(
+                db.update_advertisement_status(ad_id, "approved", jobs=ON_APPROVE),
+                db.update_advertisement_status(ad_id, "rejected", jobs=ON_REJECT),
+            )
+            ad = await db.get_advertisement(ad_id)
+            jobs = await db.get_job_counts()
+        finally:
+            await db.close()
+        return results, ad.status, sorted((kind, count) for kind, _, count in jobs)
+
+    results, status, jobs = asyncio.run(scenario())
+    assert results == [True, False]
+    assert status == "approved"
+    assert jobs == sorted((kind, 1) for kind, _ in ON_APPROVE)
@@ -0,0 +1,52 @@
+import asyncio
+import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Chat, Message, Update, User
+
+from ordering import ChatOrderingMiddleware
+
+
+class Draft(StatesGroup):
+    text = State()
+    photo = State()
+
+
+def text_update(update_id: int, text: str) -> Update:
+    user = User(id=1, is_bot=False, first_name="U")
+    chat = Chat(id=1, type="private")
+    message = Message(message_id=update_id, date=datetime.datetime.now(), chat=chat, from_user=user, text=text)
+    return Update(update_id=update_id, message=message)
+
+
+def test_same_chat_updates_see_state_of_previous_update():
+    # Два текста одного чата приходят одновременно: второй должен дождаться
+    # первого и пройти фильтр уже по новому состоянию, то есть не попасть
+    # в хендлер текста
+    async def scenario():
+        texts = []
+        router = Router()
+
+        @router.message(StateFilter(Draft.text))
+        async def process_text(message: Message, state: FSMContext):
+            await asyncio.sleep(0.01)
+            texts.append(message.text)
+            await state.set_state(Draft.photo)
+
+        dp = Dispatcher()
+        dp.update.outer_middleware(ChatOrderingMiddleware(limit=8))
+        dp.include_router(router)
+        bot = Bot("42:TEST")
+        await dp.fsm.get_context(bot, chat_id=1, user_id=1).set_state(Draft.text)
+
+        await asyncio.gather(
+            dp.feed_update(bot, text_update(1, "first")),
+            dp.feed_update(bot, text_update(2, "second")),
+        )
+        await bot.session.close()
+        return texts
+
+    assert asyncio.run(scenario()) == ["first"]
@@ -0,0 +1,30 @@
+import asyncio
+
+from database.db import Database
+from search import parse_query
+
+
+def test_search_finds_only_ads_live_in_channel(tmp_path):
+    # Отложенное (одобрено, но ещё не опубликовано) и снятое объявления
+    # в поиске не показываются
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        await db.migrate()
+        try:
+            server_id = await db.add_server("S1", "-1001", "-1002")
+            scheduled, live, expired = [
+                await db.add_advertisement(1, server_id, f"Продаю аккаунт номер {i}") for i in range(3)
+            ]
+            for ad_id in (scheduled, live, expired):
+                await db.update_advertisement_status(ad_id, "approved")
+            await db.complete_jobs("test", [], message_ids={live: [10], expired: [11]})
+            await db.complete_jobs("test", [], expired=[expired])
+            match, status, _ = parse_query("аккаунт", is_admin=False)
+            rows = await db.search_advertisements(match, status, limit=10)
+        finally:
+            await db.close()
+        return [row[0] for row in rows], live
+
+    ad_ids, live = asyncio.run(scenario())
+    assert ad_ids == [live]
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from sender import OutboundQueue
+from tests.fakes import make_bot
+
+
+def test_chat_limit_delays_only_its_own_chat():
+    # Второе сообщение чата 1 ждёт токен своего чата, а сообщение чата 2
+    # уходит, не дожидаясь его
+    async def scenario():
+        bot, session = make_bot()
+        sender = OutboundQueue(bot, chat_rate=10)
+        sender.start()
+        started = time.monotonic()
+        first, second, other = [
+            sender.send(SendMessage(chat_id=chat_id, text=text))
+            for chat_id, text in ((1, "first"), (1, "second"), (2, "other"))
+        ]
+        await asyncio.gather(first, other)
+        sent_before_second = [method.text for method in session.requests]
+        await second
+        elapsed = time.monotonic() - started
+        await sender.stop()
+        return sent_before_second, elapsed
+
+    sent_before_second, elapsed = asyncio.run(scenario())
+    assert sent_before_second == ["first", "other"]
+    assert elapsed >= 0.09
+
+
+def test_retry_after_requeues_request():
+    # TelegramRetryAfter не доходит до отправителя: запрос повторяется
+    # через указанное время, и future получает ответ повтора
+    async def scenario():
+        method = SendMessage(chat_id=1, text="hello")
+        bot, session = make_bot(errors=[TelegramRetryAfter(method, "Too Many Requests", retry_after=0.1)])
+        sender = OutboundQueue(bot, chat_rate=10)
+        sender.start()
+        started = time.monotonic()
+        result = await sender.send(method)
+        elapsed = time.monotonic() - started
+        await sender.stop()
+        return result, len(session.requests), elapsed
+
+    result, attempts, elapsed = asyncio.run(scenario())
+    assert result.message_id
+    assert attempts == 2
+    assert elapsed >= 0.1
@@ -0,0 +1,35 @@
+import asyncio
+
+from aiogram import Dispatcher
+from aiogram.types import Message
+
+from tests.fakes import make_bot, message_update
+from throttling import THROTTLED_TEXT, ThrottlingMiddleware
+
+
+class FakeDatabase:
+    def is_admin(self, user_id):
+        return user_id == 9
+
+
+def test_flood_is_dropped_after_one_warning():
+    # Сверх лимита апдейты не доходят до хендлера; предупреждение
+    # отправляется один раз, остальные отброшенные не стоят запросов
+    async def scenario():
+        dp = Dispatcher()
+        dp.message.outer_middleware(ThrottlingMiddleware(FakeDatabase(), user_rate=0.01, user_burst=2))
+        handled = []
+
+        @dp.message()
+        async def handler(message: Message):
+            handled.append((message.from_user.id, message.text))
+
+        bot, session = make_bot()
+        for user_id in (1, 9):
+            for i in range(5):
+                await dp.feed_update(bot, message_update(user_id, text=f"text {i}"))
+        return handled, [method.text for method in session.requests]
+
+    handled, sent = asyncio.run(scenario())
+    assert handled == [(1, "text 0"), (1, "text 1")] + [(9, f"text {i}") for i in range(5)]
+    assert sent == [THROTTLED_TEXT]
@@ -0,0 +1,124 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from database.db import Database
+from metrics import THROTTLED
+from ratelimit import TokenBucket
+
+THROTTLED_TEXT = "⏳ Слишком много запросов, подождите пару секунд"
+
+
+def parse_action_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    # "page=3:10,photo=0.2:2" -> {"page": (3.0, 10.0), "photo": (0.2, 2.0)}
+    limits = {}
+    for item in value.split(","):
+        action, _, limit = item.strip().partition("=")
+        if action and limit:
+            rate, _, burst = limit.partition(":")
+            limits[action] = (float(rate), float(burst or rate))
+    return limits
+
+
+def event_action(event: TelegramObject) -> str:
+    # Тип действия для отдельного лимита: имя команды, photo/text для
+    # сообщений и префикс callback_data без параметров ("page_12" -> "page",
+    # "bulk_approve_3" -> "bulk_approve")
+    if isinstance(event, CallbackQuery):
+        parts = []
+        for part in (event.data or "").split("_"):
+            if not part.isalpha():
+                break
+            parts.append(part)
+        return "_".join(parts) or "callback"
+    if isinstance(event, Message):
+        if event.text and event.text.startswith("/"):
+            return event.text[1:].split(maxsplit=1)[0].split("@")[0] or "text"
+        if event.photo:
+            return "photo"
+    return "text"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Внешний middleware для message и callback_query: срабатывает до фильтров
+    # и хендлеров, поэтому лишний апдейт не доходит до БД и Bot API. У каждого
+    # пользователя два token bucket — общий и на тип действия. Отброшенный
+    # апдейт стоит пары обращений к словарю; о троттлинге пользователь узнаёт
+    # один раз, пока лимит не восстановится. Администраторы (кэш ролей) и
+    # события вне личных чатов — модерация в группах — не ограничиваются.
+    def __init__(
+        self,
+        db: Database,
+        user_rate: float = 2.0,
+        user_burst: float = 10.0,
+        action_rate: float = 1.0,
+        action_burst: float = 5.0,
+        action_limits: Optional[Mapping[str, Tuple[float, float]]] = None,
+        sweep_interval: float = 60.0,
+    ):
+        self.db = db
+        self.user_limit = (user_rate, user_burst)
+        self.action_limit = (action_rate, action_burst)
+        self.action_limits = dict(action_limits or {})
+        self.sweep_interval = sweep_interval
+        self._users: Dict[int, TokenBucket] = {}
+        self._actions: Dict[Tuple[int, str], TokenBucket] = {}
+        self._warned: Set[int] = set()
+        self._swept_at = time.monotonic()
+
+    def _bucket(self, buckets: Dict, key, limit: Tuple[float, float]) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def _sweep(self, now: float):
+        # Полный bucket ничем не отличается от нового — такие можно удалить,
+        # чтобы память не росла с числом когда-либо писавших пользователей
+        for buckets in (self._users, self._actions):
+            for key in [key for key, bucket in buckets.items() if bucket.is_full(now)]:
+                del buckets[key]
+        self._warned.intersection_update(self._users)
+        self._swept_at = now
+
+    def allow(self, user_id: int, action: str) -> bool:
+        now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self._sweep(now)
+
+        user_bucket = self._bucket(self._users, user_id, self.user_limit)
+        action_bucket = self._bucket(
+            self._actions, (user_id, action), self.action_limits.get(action, self.action_limit)
+        )
+        # Токен берётся из общего bucket только если есть токен действия,
+        # чтобы отброшенный апдейт не расходовал чужой лимит
+        if action_bucket.delay(now) or not user_bucket.consume(now):
+            return False
+        action_bucket.consume(now)
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None or (chat is not None and chat.type != "private") or self.db.is_admin(user.id):
+            return await handler(event, data)
+
+        action = event_action(event)
+        if self.allow(user.id, action):
+            self._warned.discard(user.id)
+            return await handler(event, data)
+
+        THROTTLED.inc(action)
+        if user.id not in self._warned:
+            # Сообщение в чат или всплывающее уведомление на кнопке; остальные
+            # отброшенные апдейты не стоят ни одного запроса к Bot API
+            self._warned.add(user.id)
+            await event.answer(THROTTLED_TEXT)
+        return None
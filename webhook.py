@@ -0,0 +1,123 @@
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    # Встроенный aiohttp-сервер для режима webhook. Апдейт подтверждается
+    # ответом 200 сразу после разбора, а обрабатывается в фоновой задаче.
+    # При остановке сервер перестаёт принимать запросы и дожидается
+    # обработки уже принятых апдейтов.
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = "/webhook",
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        secret_token: Optional[str] = None,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self._in_flight: Set[asyncio.Task] = set()
+        self._accepting = False
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get("/health", self.handle_health)
+
+    def _check_secret(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Сервер останавливается: Telegram повторит доставку позже
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.error("Некорректный апдейт в webhook: %s", e)
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error("Ошибка при обработке апдейта %s: %s", update.update_id, e)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok" if self._accepting else "stopping",
+            "in_flight": len(self._in_flight),
+        }, status=200 if self._accepting else 503)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._accepting = True
+        logger.info("Webhook-сервер слушает %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self, timeout: float = 30.0):
+        self._accepting = False
+        if self._in_flight:
+            logger.info("Ожидание обработки %s апдейтов перед остановкой", len(self._in_flight))
+            done, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+            if pending:
+                logger.warning("Не дождались обработки %s апдейтов, отменяем", len(pending))
+                for task in pending:
+                    task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, server: WebhookServer, url: Optional[str] = None):
+    # Если задан внешний адрес — регистрируем webhook в Telegram; без него
+    # сервер можно проверять, отправляя апдейты прямо на localhost
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    await server.start()
+    try:
+        if url:
+            await bot.set_webhook(
+                url=url.rstrip("/") + server.path,
+                secret_token=server.secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("Webhook зарегистрирован: %s", url)
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка webhook-сервера")
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        await bot.session.close()
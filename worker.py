@@ -0,0 +1,124 @@
+# Отдельные процессы-исполнители очереди заданий (jobs.JobWorker). Каждый
+# процесс работает со своим соединением к базе и своим event loop, поэтому
+# уведомления масштабируются на несколько ядер независимо от процесса бота.
+# Отправку в группы и каналы (модерация, публикация, истечение, поднятие)
+# выполняет только первый процесс: лимит на канал у каждой OutboundQueue
+# свой, и с несколькими отправителями он бы умножался на их число.
+# Запуск рядом с ботом (в боте — JOB_EMBEDDED_WORKER=0):
+#
+#   python worker.py --processes 4
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from aiogram import Bot
+
+import config
+from database.db import Database
+from jobs import PRIVATE_JOBS, JobWorker
+from logs import parse_sampling, setup_logging
+from metrics import RequestMetricsMiddleware
+from sender import OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(index: int, processes: int):
+    db = Database(admin_ids=config.ADMIN_IDS)
+    await db.connect()
+
+    bot = Bot(token=config.BOT_TOKEN)
+    bot.session.middleware(RequestMetricsMiddleware())
+    # Общий лимит бота делится между процессами. Лимит на группу/канал
+    # соблюдает единственный процесс, который туда отправляет; лимиты на
+    # личный чат у каждого процесса свои, при превышении Telegram ответит
+    # RetryAfter и очередь отправки повторит запрос
+    sender = OutboundQueue(
+        bot,
+        global_rate=config.SEND_GLOBAL_RATE / processes,
+        chat_rate=config.SEND_CHAT_RATE,
+        group_rate=config.SEND_GROUP_RATE_PER_MINUTE / 60,
+        concurrency=config.SEND_CONCURRENCY,
+    )
+    worker = JobWorker(
+        db,
+        sender,
+        batch_size=config.JOB_BATCH_SIZE,
+        lease_seconds=config.JOB_LEASE_SECONDS,
+        max_attempts=config.JOB_MAX_ATTEMPTS,
+        expire_mode=config.AD_EXPIRE_MODE,
+        kinds=None if index == 0 else PRIVATE_JOBS,
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    sender.start()
+    worker.start()
+    logger.info("Исполнитель заданий %s запущен", worker.owner)
+    try:
+        await stop_event.wait()
+    finally:
+        await worker.stop()
+        await sender.stop()
+        await bot.session.close()
+        await db.close()
+        logger.info("Исполнитель заданий %s остановлен", worker.owner)
+
+
+def _setup_logging():
+    return setup_logging(
+        config.LOG_LEVEL, config.LOG_FORMAT == "json", parse_sampling(config.LOG_SAMPLING), config.LOG_LEAN_RECORDS
+    )
+
+
+def _process_main(index: int, processes: int):
+    # У каждого процесса своя очередь логов и свой поток вывода
+    log_listener = _setup_logging()
+    try:
+        asyncio.run(run_worker(index, processes))
+    finally:
+        log_listener.stop()
+
+
+async def _migrate():
+    # Схему обновляет родительский процесс до запуска исполнителей, чтобы
+    # миграции не применялись из нескольких процессов одновременно
+    db = Database()
+    await db.connect()
+    try:
+        await db.migrate()
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Исполнители очереди заданий")
+    parser.add_argument("--processes", type=int, default=config.JOB_WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    log_listener = _setup_logging()
+    asyncio.run(_migrate())
+
+    processes = [
+        multiprocessing.Process(target=_process_main, args=(index, args.processes), name=f"worker-{index}")
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # SIGTERM пересылается исполнителям; Ctrl+C терминал отправляет всей
+    # группе процессов сам — родитель просто дожидается их завершения
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+    log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()